@@ -0,0 +1,280 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+'''
+End-to-end benchmark of the daily pipeline (`client.py`, `report.py` and
+`post.py`) against a local stand-in server replaying recorded cassettes
+
+Each configuration runs in a scratch directory (so without any cache),
+with the global configuration pointing every upstream host to the
+stand-in server. Wall time, peak RSS and requests per host are measured
+for each stage, and the results are written as JSON, to be compared
+against a baseline file.
+'''
+
+import argparse
+import configparser
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+from benchmarks.server import CassetteServer
+from lib.cassette import Cassette
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Options of the global configuration naming an upstream host
+HOSTS = (('treeherder', 'host'), ('taskcluster', 'host'), ('taskcluster', 'artifacts'), ('hg', 'host'),
+         ('github', 'api'))
+
+
+def parse_args(cmdln_args):
+    parser = argparse.ArgumentParser(
+        description='Benchmarks the pipeline against recorded cassettes'
+    )
+
+    parser.add_argument(
+        '--project',
+        nargs='+',
+        default=['reference-browser', 'mozilla-central'],
+        help='Configurations to benchmark (default: reference-browser mozilla-central)',
+        required=False
+    )
+    parser.add_argument(
+        '--cassettes',
+        default=os.path.join(ROOT, 'benchmarks', 'cassettes'),
+        metavar='DIR',
+        help='Directory of the cassettes, one per configuration (default: benchmarks/cassettes)',
+        required=False
+    )
+    parser.add_argument(
+        '--concurrency',
+        default=8,
+        type=int,
+        help='--concurrency of client.py (default: 8)',
+        required=False
+    )
+    parser.add_argument(
+        '--parse-workers',
+        default=2,
+        type=int,
+        help='--parse-workers of client.py (default: 2)',
+        required=False
+    )
+    parser.add_argument(
+        '--repeat',
+        default=3,
+        type=int,
+        help='Runs of each configuration, reporting the median wall time (default: 3)',
+        required=False
+    )
+    parser.add_argument(
+        '--latency',
+        action='append',
+        default=[],
+        metavar='HOST=SECONDS',
+        help='Delay the responses of a host (or of every host with *=SECONDS)',
+        required=False
+    )
+    parser.add_argument(
+        '--output',
+        default=os.path.join(ROOT, 'benchmarks', 'results.json'),
+        metavar='PATH',
+        help='Results file (default: benchmarks/results.json)',
+        required=False
+    )
+    parser.add_argument(
+        '--baseline',
+        default=os.path.join(ROOT, 'benchmarks', 'baseline.json'),
+        metavar='PATH',
+        help='Baseline results to compare against (default: benchmarks/baseline.json)',
+        required=False
+    )
+    parser.add_argument(
+        '--save-baseline',
+        default=False,
+        action='store_true',
+        help='Also write the results to the baseline file',
+        required=False
+    )
+
+    return parser.parse_args(args=cmdln_args)
+
+
+def prepare(workdir, server, overrides=None):
+    '''Copy the configurations to a scratch directory, pointing every upstream host to the server
+
+    `overrides` are {section: {option: value}} to set in the global configuration.
+    '''
+    shutil.copytree(os.path.join(ROOT, 'configurations'), os.path.join(workdir, 'configurations'))
+
+    config = configparser.ConfigParser()
+    config.read(os.path.join(workdir, 'configurations', 'config.ini'))
+
+    for section, option in HOSTS:
+        if config.has_option(section, option):
+            config[section][option] = f"{server.url}/{urlsplit(config[section][option]).netloc}"
+
+    for section, options in (overrides or {}).items():
+        for option, value in options.items():
+            config[section][option] = str(value)
+
+    with open(os.path.join(workdir, 'configurations', 'config.ini'), 'w', encoding='utf-8') as config_file:
+        config.write(config_file)
+
+
+def run_stage(workdir, name, command):
+    '''Run a stage to completion, as (wall time, peak RSS in MiB)'''
+    env = dict(os.environ, GITHUB_TOKEN=os.environ.get('GITHUB_TOKEN', 'benchmark'))
+    env.pop('SLACK_WEBHOOK', None)
+
+    with open(os.path.join(workdir, f'{name}.log'), 'w', encoding='utf-8') as log:
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, *command], cwd=workdir, env=env, stdout=log,
+                                   stderr=subprocess.STDOUT)
+        # The resource usage of the stage alone, including its worker processes
+        _, status, usage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+
+    if process.returncode:
+        with open(os.path.join(workdir, f'{name}.log'), encoding='utf-8') as log:
+            print(''.join(log.readlines()[-20:]), file=sys.stderr)
+        raise SystemExit(f'Stage [{name}] failed with exit code {process.returncode}')
+
+    return wall, usage.ru_maxrss / 1024
+
+
+def run_pipeline(args, project, cassette, server):
+    '''Run every stage of the pipeline once, in a scratch directory'''
+    bugzilla = os.path.join(cassette, 'bugzilla')
+    stages = {
+        'build': [
+            os.path.join(ROOT, 'client.py'), f'--project={project}',
+            f'--concurrency={args.concurrency}', f'--parse-workers={args.parse_workers}'
+        ],
+        # Searches missing from the cassette fail at once, and are reported without bugs
+        'report': [
+            os.path.join(ROOT, 'report.py'), '--bugzilla-ttl=0',
+            f'--replay={bugzilla if os.path.isdir(bugzilla) else cassette}',
+            *[f'--latency={latency}' for latency in args.latency]
+        ],
+        'post': [os.path.join(ROOT, 'post.py'), '--dry-run=slack'],
+    }
+    results = {}
+
+    with tempfile.TemporaryDirectory(prefix=f'benchmark-{project}-') as workdir:
+        prepare(workdir, server)
+
+        for name, command in stages.items():
+            server.reset()
+            wall, peak_rss = run_stage(workdir, name, command)
+            results[name] = {
+                'wall': wall,
+                'peak_rss': peak_rss,
+                'requests': dict(sorted(server.requests.items())),
+                'missed': dict(sorted(server.misses.items())),
+            }
+
+    return results
+
+
+def benchmark(args, project):
+    '''Run the pipeline of a configuration `repeat` times, keeping the median wall time of each stage'''
+    cassette = os.path.join(args.cassettes, project)
+
+    if not os.path.exists(os.path.join(cassette, 'index.json')):
+        raise SystemExit(f'No cassette for [{project}], record one with: '
+                         f'python client.py --project={project} --record={cassette}')
+
+    with CassetteServer(cassette, latency=Cassette.parse_latency(args.latency)) as server:
+        runs = [run_pipeline(args, project, cassette, server) for _ in range(args.repeat)]
+
+    stages = {
+        name: {
+            'wall': statistics.median(run[name]['wall'] for run in runs),
+            'walls': [run[name]['wall'] for run in runs],
+            'peak_rss': max(run[name]['peak_rss'] for run in runs),
+            'requests': runs[-1][name]['requests'],
+            'missed': runs[-1][name]['missed'],
+        }
+        for name in runs[0]
+    }
+
+    return {
+        'wall': sum(stage['wall'] for stage in stages.values()),
+        'peak_rss': max(stage['peak_rss'] for stage in stages.values()),
+        'requests': sum(sum(stage['requests'].values()) for stage in stages.values()),
+        'stages': stages,
+    }
+
+
+def change(current, baseline):
+    if not baseline:
+        return ''
+    return f' ({(current - baseline) / baseline:+.1%})'
+
+
+def print_results(results, baseline):
+    for project, result in results['configurations'].items():
+        previous = baseline.get('configurations', {}).get(project, {})
+        print(f"{project}: {result['wall']:.2f}s{change(result['wall'], previous.get('wall'))}, "
+              f"{result['requests']} requests, peak RSS {result['peak_rss']:.0f} MiB"
+              f"{change(result['peak_rss'], previous.get('peak_rss'))}")
+
+        for name, stage in result['stages'].items():
+            previous_stage = previous.get('stages', {}).get(name, {})
+            print(f"  {name:<8}{stage['wall']:8.2f}s{change(stage['wall'], previous_stage.get('wall')):<10} "
+                  f"{stage['peak_rss']:6.0f} MiB{change(stage['peak_rss'], previous_stage.get('peak_rss')):<10} "
+                  f"{sum(stage['requests'].values()):6} requests")
+
+            if stage['missed']:
+                print(f"          requests missing from the cassette: {stage['missed']}")
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+
+    if args.repeat < 1:
+        raise SystemExit('--repeat must be at least 1')
+
+    results = {
+        'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'options': {
+            'concurrency': args.concurrency,
+            'parse_workers': args.parse_workers,
+            'repeat': args.repeat,
+            'latency': Cassette.parse_latency(args.latency),
+        },
+        'configurations': {project: benchmark(args, project) for project in args.project},
+    }
+
+    try:
+        with open(args.baseline, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)
+    except FileNotFoundError:
+        baseline = {}
+
+    print_results(results, baseline)
+
+    for path in [args.output] + ([args.baseline] if args.save_baseline else []):
+        with open(path, 'w', encoding='utf-8') as results_file:
+            json.dump(results, results_file, indent=4)
+        print(f'Results written to [{path}]')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+'''
+Scaling benchmark of the pipeline over synthetic histories of growing size
+
+For every combination of `--days` and `--tests`, a synthetic history
+(see `benchmarks/synthetic.py`) is served locally and `client.py`,
+`report.py` and `post.py --dry-run` run against it, in a scratch
+directory. Wall time and peak RSS of each stage are written as JSON
+and, when matplotlib is installed, plotted against the number of test
+cases (jobs x test cases per report).
+'''
+
+import argparse
+import itertools
+import json
+import os
+import sys
+import tempfile
+
+from benchmarks.run import ROOT, prepare, run_stage
+from benchmarks.synthetic import SyntheticHistory, SyntheticServer, add_arguments, history_options
+
+STAGES = ('build', 'report', 'post')
+
+
+def parse_args(cmdln_args):
+    parser = argparse.ArgumentParser(
+        description='Benchmarks the pipeline over synthetic histories of growing size'
+    )
+
+    add_arguments(parser)
+    parser.add_argument(
+        '--days',
+        nargs='+',
+        default=[1, 7, 30],
+        type=int,
+        help='Days of history of each run (default: 1 7 30)',
+        required=False
+    )
+    parser.add_argument(
+        '--tests',
+        nargs='+',
+        default=[200],
+        type=int,
+        help='Test cases per JUnit report of each run (default: 200)',
+        required=False
+    )
+    parser.add_argument(
+        '--concurrency',
+        default=8,
+        type=int,
+        help='--concurrency of client.py (default: 8)',
+        required=False
+    )
+    parser.add_argument(
+        '--parse-workers',
+        default=2,
+        type=int,
+        help='--parse-workers of client.py (default: 2)',
+        required=False
+    )
+    parser.add_argument(
+        '--output',
+        default=os.path.join(ROOT, 'benchmarks', 'scaling.json'),
+        metavar='PATH',
+        help='Results file (default: benchmarks/scaling.json)',
+        required=False
+    )
+    parser.add_argument(
+        '--plot',
+        default=os.path.join(ROOT, 'benchmarks', 'scaling.png'),
+        metavar='PATH',
+        help='Plot of the results, if matplotlib is installed (default: benchmarks/scaling.png)',
+        required=False
+    )
+
+    return parser.parse_args(args=cmdln_args)
+
+
+def run_point(args, days, tests):
+    '''Run the pipeline once over a synthetic history of `days` days and `tests` test cases per report'''
+    history = SyntheticHistory(args.project, days=days, tests=tests, **history_options(args))
+    jobs = sum(len(jobs) for jobs in history.jobs.values())
+    stages = {
+        'build': [
+            os.path.join(ROOT, 'client.py'), f'--project={args.project}',
+            f'--concurrency={args.concurrency}', f'--parse-workers={args.parse_workers}'
+        ],
+        # Bugzilla is replaced by an empty cassette: every search fails at once
+        'report': [os.path.join(ROOT, 'report.py'), '--bugzilla-ttl=0', '--replay=bugzilla'],
+        'post': [os.path.join(ROOT, 'post.py'), '--dry-run=slack'],
+    }
+    point = {'days': days, 'tests': tests, 'pushes': len(history.pushes), 'jobs': jobs, 'test_cases': jobs * tests}
+
+    with SyntheticServer(history) as server, \
+            tempfile.TemporaryDirectory(prefix=f'scaling-{args.project}-') as workdir:
+        prepare(workdir, server, {'pushes': {'days': days, 'maxcount': len(history.pushes)}})
+        os.makedirs(os.path.join(workdir, 'bugzilla'))
+        with open(os.path.join(workdir, 'bugzilla', 'index.json'), 'w', encoding='utf-8') as index_file:
+            json.dump({}, index_file)
+
+        for name in STAGES:
+            server.reset()
+            wall, peak_rss = run_stage(workdir, name, stages[name])
+            point[name] = {'wall': wall, 'peak_rss': peak_rss, 'requests': sum(server.requests.values())}
+
+        point['output_size'] = os.path.getsize(os.path.join(workdir, 'output.json'))
+
+    return point
+
+
+def plot(points, path):
+    '''Plot wall time and peak RSS of every stage against the number of test cases'''
+    try:
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print('matplotlib is not installed, skipping the plot')
+        return
+
+    points = sorted(points, key=lambda point: point['test_cases'])
+    figure, (runtime, memory) = plt.subplots(1, 2, figsize=(12, 5))
+
+    for name in STAGES:
+        sizes = [point['test_cases'] for point in points]
+        runtime.plot(sizes, [point[name]['wall'] for point in points], marker='o', label=name)
+        memory.plot(sizes, [point[name]['peak_rss'] for point in points], marker='o', label=name)
+
+    for axes, label in ((runtime, 'Wall time (s)'), (memory, 'Peak RSS (MiB)')):
+        axes.set_xscale('log')
+        axes.set_xlabel('Test cases (jobs x test cases per report)')
+        axes.set_ylabel(label)
+        axes.grid(True, alpha=0.3)
+        axes.legend()
+
+    figure.tight_layout()
+    figure.savefig(path)
+    print(f'Plot written to [{path}]')
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    points = []
+
+    for days, tests in itertools.product(args.days, args.tests):
+        point = run_point(args, days, tests)
+        points.append(point)
+        print(f"{days:4} day(s) {tests:6} tests/report {point['jobs']:6} jobs: " + ', '.join(
+            f"{name} {point[name]['wall']:.2f}s {point[name]['peak_rss']:.0f} MiB" for name in STAGES
+        ))
+
+    with open(args.output, 'w', encoding='utf-8') as results_file:
+        json.dump({'project': args.project, 'options': vars(args), 'points': points}, results_file, indent=4)
+    print(f'Results written to [{args.output}]')
+
+    plot(points, args.plot)
+
+
+if __name__ == '__main__':
+    main()
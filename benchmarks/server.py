@@ -0,0 +1,200 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+'''
+Local stand-in for Treeherder, Taskcluster, artifact storage, Mercurial
+and Github, serving the exchanges of a cassette recorded with
+`client.py --record DIR`
+
+Every upstream host is served under a path prefix named after it, e.g.
+https://treeherder.mozilla.org/api/... is served as
+http://127.0.0.1:PORT/treeherder.mozilla.org/api/... URLs of recorded
+hosts are rewritten the same way in response headers (redirects,
+pagination links) and text bodies (artifact URLs).
+'''
+
+import argparse
+import json
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from lib.cassette import Cassette, CassetteMiss
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    '''Base handler of the stand-in servers, answering every method with `respond_to`'''
+
+    protocol_version = 'HTTP/1.1'
+    # Send headers and body in a single write, without waiting for delayed ACKs
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.respond_to()
+
+    def do_POST(self):
+        self.respond_to()
+
+    def do_PUT(self):
+        self.respond_to()
+
+    def respond(self, status, headers, content):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class CassetteHandler(StandInHandler):
+    '''Serve a request from the cassette of the server'''
+
+    def respond_to(self):
+        server = self.server
+        host, _, path = self.path.lstrip('/').partition('/')
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0)) or None
+
+        for scheme in server.schemes.get(host, ('https',)):
+            url = f'{scheme}://{host}/{path}'
+            try:
+                status, headers, content = server.cassette.replay(Cassette.key(self.command, url, body))
+                break
+            except CassetteMiss:
+                continue
+        else:
+            server.count(host, missed=True)
+            message = f'Not recorded: {self.command} /{host}/{path}'
+            return self.respond(404, {'Content-Type': 'text/plain'}, message.encode())
+
+        server.count(host)
+        time.sleep(server.cassette.delay(url))
+
+        headers = {name: server.rewrite(value) for name, value in headers.items()}
+        content_type = next((value for name, value in headers.items() if name.lower() == 'content-type'), '')
+        # Artifacts are served as recorded, still compressed
+        if content_type.startswith(('application/json', 'text/')) and content[:2] != b'\x1f\x8b':
+            content = server.rewrite(content.decode()).encode()
+
+        self.respond(status, headers, content)
+
+
+class StandInServer(ThreadingHTTPServer):
+    '''Threaded HTTP server on a free local port, counting requests per host'''
+
+    daemon_threads = True
+
+    def __init__(self, handler, port=0):
+        super().__init__(('127.0.0.1', port), handler)
+        self.url = f'http://127.0.0.1:{self.server_address[1]}'
+        self.lock = threading.Lock()
+        self.requests = Counter()
+        self.misses = Counter()
+
+    def count(self, host, missed=False):
+        with self.lock:
+            (self.misses if missed else self.requests)[host] += 1
+
+    def reset(self):
+        '''Forget request counts'''
+        with self.lock:
+            self.requests.clear()
+            self.misses.clear()
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+class CassetteServer(StandInServer):
+    '''Stand-in server replaying a cassette'''
+
+    def __init__(self, directory, port=0, latency=None):
+        super().__init__(CassetteHandler, port)
+        self.cassette = Cassette(directory, 'replay', latency=latency)
+
+        # Schemes each recorded host was reached with
+        self.schemes = {}
+        for key in self.cassette.index:
+            parts = urlsplit(key.split(' ')[1])
+            self.schemes.setdefault(parts.netloc, [])
+            if parts.scheme not in self.schemes[parts.netloc]:
+                self.schemes[parts.netloc].append(parts.scheme)
+
+        self.prefixes = sorted(
+            ((f'{scheme}://{host}', f'{self.url}/{host}') for host, schemes in self.schemes.items()
+             for scheme in schemes),
+            key=lambda prefix: -len(prefix[0])
+        )
+
+    def rewrite(self, text):
+        for upstream, local in self.prefixes:
+            text = text.replace(upstream, local)
+        return text
+
+    def reset(self):
+        '''Forget request counts, and replay every exchange from the start again'''
+        super().reset()
+        with self.cassette.lock:
+            self.cassette.positions.clear()
+
+
+def parse_args(cmdln_args):
+    parser = argparse.ArgumentParser(
+        description='Serves a recorded cassette as a local stand-in for every upstream host'
+    )
+
+    parser.add_argument(
+        '--cassette',
+        metavar='DIR',
+        help='Cassette directory recorded with client.py --record',
+        required=True
+    )
+    parser.add_argument(
+        '--port',
+        default=8765,
+        type=int,
+        help='Port to listen on (default: 8765)',
+        required=False
+    )
+    parser.add_argument(
+        '--latency',
+        action='append',
+        default=[],
+        metavar='HOST=SECONDS',
+        help='Delay the responses of a host (or of every host with *=SECONDS)',
+        required=False
+    )
+
+    return parser.parse_args(args=cmdln_args)
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+
+    with CassetteServer(args.cassette, args.port, Cassette.parse_latency(args.latency)) as server:
+        print(f'Serving [{args.cassette}] at {server.url}, hosts:')
+        print(json.dumps({host: f'{server.url}/{host}' for host in server.schemes}, indent=4))
+
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
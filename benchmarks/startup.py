@@ -0,0 +1,120 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+'''
+Import-time budget of the command line scripts
+
+Each script runs with `--help` under `python -X importtime`, which
+imports what its argument parsing needs and nothing more. The time
+spent importing modules (beyond those the interpreter imports on its
+own) must stay within the budget of the script, and none of the
+backend clients may be imported yet: they are loaded once the
+arguments and configurations are checked, and only when needed.
+'''
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+from benchmarks.run import ROOT
+
+# Import-time budget (milliseconds) of each script
+BUDGETS = {'client.py': 50, 'post.py': 50, 'report.py': 50}
+
+# HTTP and backend modules, only imported once a run actually needs them
+BACKENDS = ('requests', 'github', 'taskcluster', 'thclient', 'junitparser', 'aiohttp', 'numpy', 'lib.databuilder')
+
+
+def parse_args(cmdln_args):
+    parser = argparse.ArgumentParser(
+        description='Checks the import time of the command line scripts against their budget'
+    )
+
+    parser.add_argument(
+        '--script',
+        nargs='+',
+        default=list(BUDGETS),
+        choices=list(BUDGETS),
+        help='Scripts to check (default: every one)',
+        required=False
+    )
+    parser.add_argument(
+        '--repeat',
+        default=5,
+        type=int,
+        help='Runs of each script, checking the median import time (default: 5)',
+        required=False
+    )
+    parser.add_argument(
+        '--scale',
+        default=1.0,
+        type=float,
+        help='Multiply every budget, e.g. on slower machines (default: 1.0)',
+        required=False
+    )
+
+    return parser.parse_args(args=cmdln_args)
+
+
+def imports(command):
+    '''Return (cumulative import time in seconds of every top-level module, every module) imported by a command'''
+    process = subprocess.run([sys.executable, '-X', 'importtime', *command], cwd=ROOT,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+    modules, names = {}, set()
+
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+
+        _, cumulative, name = line.split('|')
+        names.add(name.strip())
+        # Nested imports are indented below the module importing them
+        if cumulative.strip().isdigit() and not name.startswith('  '):
+            modules[name.strip()] = int(cumulative) / 1e6
+
+    return modules, names
+
+
+def import_time(script, repeat):
+    '''Return (median import time in seconds, imported backends) of `script --help`'''
+    interpreter, _ = imports(['-c', 'pass'])
+    times, backends = [], set()
+
+    for _ in range(repeat):
+        modules, names = imports([script, '--help'])
+        times.append(sum(seconds for name, seconds in modules.items() if name not in interpreter))
+        backends.update(name for name in names if name in BACKENDS)
+
+    return statistics.median(times), sorted(backends)
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    failed = False
+
+    if args.repeat < 1:
+        raise SystemExit('--repeat must be at least 1')
+
+    for script in args.script:
+        seconds, backends = import_time(os.path.join(ROOT, script), args.repeat)
+        budget = BUDGETS[script] * args.scale / 1000
+        over = seconds > budget
+
+        print(f'{script:<10} {seconds * 1000:6.0f} ms (budget {budget * 1000:.0f} ms)'
+              f'{" OVER BUDGET" if over else ""}')
+        if backends:
+            print(f'           imports {", ".join(backends)} before checking its arguments')
+
+        failed = failed or over or bool(backends)
+
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,634 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+'''
+Synthetic CI history of arbitrary size, for scale tests
+
+Pushes, Treeherder jobs (one or more per configuration section of the
+project), task definitions and the `matrix_ids.json`,
+`android_shards.json` and `FullJUnitReport.xml` artifacts of every task
+are generated deterministically from a seed, shaped like the fields
+`lib/databuilder.py` reads. They can be written to a directory, or
+served by a stand-in server for Treeherder, Taskcluster, artifact
+storage, Mercurial and Github (see `benchmarks/scaling.py`), or recorded
+as the cassette of a `client.py` run (see `benchmarks/run.py`).
+'''
+
+import argparse
+import base64
+import configparser
+import gzip
+import hashlib
+import json
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone
+from urllib.parse import parse_qs, urlsplit
+from xml.sax.saxutils import escape, quoteattr
+
+from benchmarks.run import HOSTS, ROOT, prepare, run_stage
+from benchmarks.server import StandInHandler, StandInServer
+
+DEVICES = ('Pixel2.arm', 'Pixel5.arm', 'Pixel6.arm', 'Pixel7.arm', 'SamsungGalaxyS21', 'MediumPhone.arm')
+
+
+class SyntheticHistory:
+    '''Deterministic pushes, jobs and artifacts of a project over a number of days
+
+    Every push runs `jobs_per_section` jobs of every configuration section.
+    Each JUnit report holds `tests` test cases. Every test case is flaky
+    with probability `flaky_rate` (times a per-test weight, so some tests
+    are much flakier than others), and, in jobs whose result is not
+    `success`, fails with probability `failure_rate` (with at least one
+    failure per such job). A share `retry_rate` of the jobs has a
+    superseded earlier run.
+    '''
+
+    def __init__(self, project, days=1, pushes_per_day=10, jobs_per_section=1, tests=200, flaky_rate=0.01,
+                 failure_rate=0.002, retry_rate=0.05, devices=2, seed=1):
+        self.project = project
+        self.days = days
+        self.tests = tests
+        self.flaky_rate = flaky_rate
+        self.failure_rate = failure_rate
+        self.devices = DEVICES[:max(1, devices)]
+        self.seed = seed
+
+        config = configparser.ConfigParser()
+        config.read(os.path.join(ROOT, 'configurations', 'config.ini'))
+        self.hg = project in [name.strip() for name in config.get('hg', 'projects', fallback='').split(',')]
+
+        sections = configparser.ConfigParser()
+        sections.read(os.path.join(ROOT, 'configurations', f'{project}.ini'))
+        if not sections.sections():
+            raise SystemExit(f'Unknown project [{project}]')
+
+        rng = self.random('history')
+        self.weights = [rng.expovariate(1) for _ in range(tests)]
+        self.pushes = []
+        self.jobs = {}
+        self.tasks = {}
+
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        job_id = 1
+
+        for index in range(days * pushes_per_day):
+            push_time = now - timedelta(days=days) + timedelta(seconds=(index + 0.5) * 86400 / pushes_per_day)
+            revision = hashlib.sha1(f'{seed}-{project}-{index}'.encode()).hexdigest()
+            push = {
+                'id': 100000 + index,
+                'revision': revision,
+                'author': f'dev{index % 7}@example.com',
+                'push_timestamp': int(push_time.timestamp()),
+                'revisions': [{
+                    'revision': revision,
+                    'author': f'Developer {index % 7} <dev{index % 7}@example.com>',
+                    'comments': f'Bug {1800000 + index} - Synthetic change {index} r=reviewer',
+                }],
+            }
+            self.pushes.append(push)
+            self.jobs[push['id']] = []
+            group_id = self.slug(f'group-{push["id"]}')
+
+            for section in sections.sections():
+                for _ in range(jobs_per_section):
+                    task_id = self.slug(f'task-{job_id}')
+                    start = push_time + timedelta(minutes=rng.randint(5, 60))
+                    job = {
+                        'id': job_id,
+                        'push_id': push['id'],
+                        'tier': int(sections[section]['tier']),
+                        'job_type_symbol': sections[section]['symbol'],
+                        # Treeherder reports ungrouped jobs as '?'
+                        'job_group_symbol': sections[section]['group_symbol'] or '?',
+                        'result': sections[section]['result'],
+                        'who': push['author'],
+                        'task_id': task_id,
+                        'retry_id': 0,
+                        'start_timestamp': int(start.timestamp()),
+                        'end_timestamp': int(start.timestamp()) + rng.randint(5, 40) * 60,
+                        'last_modified': (start + timedelta(minutes=45)).isoformat(timespec='microseconds')[:-6],
+                    }
+
+                    if rng.random() < retry_rate:
+                        self.jobs[push['id']].append(dict(job, result='exception'))
+                        job_id += 1
+                        job.update(id=job_id, retry_id=1)
+
+                    self.jobs[push['id']].append(job)
+                    self.tasks[task_id] = (push, group_id)
+                    job_id += 1
+
+    def random(self, *key):
+        return random.Random(':'.join(map(str, (self.seed, *key))))
+
+    def slug(self, key):
+        '''Return a Taskcluster-like task or group id'''
+        return base64.urlsafe_b64encode(hashlib.sha1(f'{self.seed}-{key}'.encode()).digest()[:16]).decode()[:22]
+
+    def job(self, task_id, run_id):
+        push, _ = self.tasks[task_id]
+        return next(
+            job for job in self.jobs[push['id']] if job['task_id'] == task_id and job['retry_id'] == run_id
+        )
+
+    def task_definition(self, task_id):
+        push, group_id = self.tasks[task_id]
+
+        if self.hg:
+            env = {
+                'GECKO_HEAD_REPOSITORY': f'https://hg.mozilla.org/{self.project}',
+                'GECKO_HEAD_REV': push['revision'],
+            }
+        else:
+            env = {
+                'MOBILE_HEAD_REPOSITORY': 'https://github.com/mozilla-mobile/firefox-android',
+                'MOBILE_HEAD_REV': push['revision'],
+            }
+
+        return {
+            'taskGroupId': group_id,
+            'metadata': {'name': f'synthetic-{task_id}', 'owner': push['author']},
+            'payload': {'env': env},
+        }
+
+    def outcomes(self, task_id, run_id):
+        '''Return the {test index: 'flaky' | 'failure'} outcomes of a task run'''
+        job = self.job(task_id, run_id)
+        rng = self.random('outcomes', task_id, run_id)
+        outcomes = {}
+
+        for test, weight in enumerate(self.weights):
+            draw = rng.random()
+            if draw < self.flaky_rate * weight:
+                outcomes[test] = 'flaky'
+            elif job['result'] != 'success' and draw < (self.flaky_rate + self.failure_rate) * weight:
+                outcomes[test] = 'failure'
+
+        if job['result'] != 'success' and 'failure' not in outcomes.values():
+            outcomes[rng.randrange(self.tests)] = 'failure'
+
+        return outcomes
+
+    @staticmethod
+    def trace(test, attempt):
+        return (f'java.lang.AssertionError: Synthetic failure of test{test} (attempt {attempt})\n'
+                f'\tat org.mozilla.fenix.ui.SyntheticTest{test % 50}.test{test}'
+                f'(SyntheticTest{test % 50}.kt:{test % 300})\n'
+                '\tat java.lang.reflect.Method.invoke(Native Method)\n'
+                '\tat org.junit.runners.model.FrameworkMethod$1.runReflectiveCall(FrameworkMethod.java:59)')
+
+    def junit_report(self, task_id, run_id):
+        outcomes = self.outcomes(task_id, run_id)
+        suites = []
+
+        for suite_start in range(0, self.tests, 100):
+            cases = []
+
+            for test in range(suite_start, min(suite_start + 100, self.tests)):
+                name = quoteattr(f'test{test}')
+                classname = quoteattr(f'org.mozilla.fenix.ui.SyntheticTest{test % 50}')
+
+                if outcomes.get(test) == 'flaky':
+                    # A flaky test fails, then passes on a retry of the same device
+                    cases.append(f'<testcase name={name} classname={classname} time="12.3" flaky="true">'
+                                 f'<failure>{escape(self.trace(test, 1))}</failure></testcase>')
+                elif outcomes.get(test) == 'failure':
+                    cases.append(f'<testcase name={name} classname={classname} time="30.1">'
+                                 f'<failure>{escape(self.trace(test, 1))}</failure>'
+                                 f'<failure>{escape(self.trace(test, 2))}</failure></testcase>')
+                else:
+                    cases.append(f'<testcase name={name} classname={classname} time="4.2"/>')
+
+            suites.append(f'<testsuite name="matrix-{task_id}-{suite_start // 100}" tests="{len(cases)}">'
+                          + ''.join(cases) + '</testsuite>')
+
+        return ('<?xml version="1.0" encoding="UTF-8"?><testsuites>' + ''.join(suites) + '</testsuites>').encode()
+
+    def matrix_ids(self, task_id, run_id):
+        outcomes = set(self.outcomes(task_id, run_id).values())
+        outcome = 'failure' if 'failure' in outcomes else 'flaky' if 'flaky' in outcomes else 'success'
+        matrix_id = f'matrix-{self.slug(f"matrix-{task_id}-{run_id}")[:12]}'
+
+        return {
+            matrix_id: {
+                'matrixId': matrix_id,
+                'state': 'FINISHED',
+                'gcsPath': f'synthetic/{task_id}/{run_id}',
+                'webLink': f'https://console.firebase.google.com/project/synthetic/testlab/histories/{matrix_id}',
+                'downloaded': False,
+                'billableMinutes': 5,
+                'clientDetails': {'matrixLabel': self.project},
+                'gcsPathWithoutRootBucket': f'{task_id}/{run_id}',
+                'isRoboTest': False,
+                'axes': [
+                    {'device': device, 'outcome': outcome, 'details': f'{len(outcomes)} problem kind(s)',
+                     'testAxisExecutionId': f'{matrix_id}-{index}'}
+                    for index, device in enumerate(self.devices)
+                ],
+            }
+        }
+
+    def android_shards(self, task_id, run_id):
+        rng = self.random('shards', task_id)
+        ignored = sorted(rng.sample(range(self.tests), min(self.tests, 5)))
+
+        return {
+            f'shard-{shard}': {
+                'junit-ignored': [f'org.mozilla.fenix.ui.SyntheticTest{test % 50}#test{test}' for test in ignored],
+                'junit-tests': [f'class org.mozilla.fenix.ui.SyntheticTest{shard}'],
+            }
+            for shard in range(2)
+        }
+
+    def artifact(self, task_id, run_id, name):
+        '''Return an artifact as (content type, gzip-compressed body), or None'''
+        if task_id not in self.tasks or run_id > 1:
+            return None
+
+        if name.endswith('FullJUnitReport.xml'):
+            return 'application/xml', gzip.compress(self.junit_report(task_id, run_id), compresslevel=5, mtime=0)
+
+        for suffix, builder in (('matrix_ids.json', self.matrix_ids), ('android_shards.json', self.android_shards)):
+            if name.endswith(suffix):
+                return 'application/json', gzip.compress(json.dumps(builder(task_id, run_id)).encode(), mtime=0)
+
+        return None
+
+    def write(self, directory):
+        '''Write every push, job list and artifact under a directory'''
+        os.makedirs(os.path.join(directory, 'jobs'), exist_ok=True)
+
+        with open(os.path.join(directory, 'pushes.json'), 'w', encoding='utf-8') as pushes_file:
+            json.dump({'results': self.pushes}, pushes_file, indent=1)
+
+        for push_id, jobs in self.jobs.items():
+            with open(os.path.join(directory, 'jobs', f'{push_id}.json'), 'w', encoding='utf-8') as jobs_file:
+                json.dump({'results': jobs}, jobs_file, indent=1)
+
+        for push_id, jobs in self.jobs.items():
+            for job in jobs:
+                task_directory = os.path.join(directory, 'tasks', job['task_id'], str(job['retry_id']))
+                os.makedirs(task_directory, exist_ok=True)
+
+                with open(os.path.join(task_directory, 'task.json'), 'w', encoding='utf-8') as task_file:
+                    json.dump(self.task_definition(job['task_id']), task_file, indent=1)
+
+                for name in ('matrix_ids.json', 'android_shards.json', 'FullJUnitReport.xml'):
+                    with open(os.path.join(task_directory, name), 'wb') as artifact_file:
+                        artifact_file.write(gzip.decompress(self.artifact(job['task_id'], job['retry_id'], name)[1]))
+
+
+class SyntheticHandler(StandInHandler):
+    '''Serve Treeherder, Taskcluster, artifact, Mercurial and Github requests from a synthetic history'''
+
+    ROUTES = (
+        (r'/api/project/[^/]+/push/$', 'pushes'),
+        (r'/api/project/[^/]+/jobs/$', 'jobs'),
+        (r'/api/project/[^/]+/job-log-url/$', 'job_logs'),
+        (r'/api/queue/v1/task-group/(?P<group_id>[^/]+)/list$', 'task_group'),
+        (r'/api/queue/v1/task/(?P<task_id>[^/]+)$', 'task'),
+        (r'/api/queue/v1/task/(?P<task_id>[^/]+)/runs/(?P<run_id>\d+)/artifact-content/(?P<name>.+)$', 'redirect'),
+        (r'/artifacts/(?P<task_id>[^/]+)/(?P<run_id>\d+)/(?P<name>.+)$', 'artifact'),
+        (r'/json-rev/(?P<revision>[0-9a-f]+)$', 'revision'),
+        (r'/json-pushes$', 'hg_pushes'),
+        (r'/rate_limit$', 'rate_limit'),
+        (r'/graphql$', 'graphql'),
+    )
+
+    def respond_to(self):
+        host, _, path = self.path.lstrip('/').partition('/')
+        parts = urlsplit(f'/{path}')
+        self.query = parse_qs(parts.query)
+        self.body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        history = self.server.history
+
+        for pattern, route in self.ROUTES:
+            match = re.search(pattern, parts.path)
+            if not match:
+                continue
+
+            # Routes return JSON data, an artifact as (content type, body), or None when not found
+            response = getattr(self, route)(history, host, **match.groupdict())
+            if response is None:
+                break
+
+            self.server.count(host)
+            if isinstance(response, tuple):
+                return self.respond(200, {'Content-Type': response[0]}, response[1])
+            return self.respond(200, {'Content-Type': 'application/json'}, json.dumps(response).encode())
+
+        self.server.count(host, missed=True)
+        self.respond(404, {'Content-Type': 'application/json'}, b'{"detail": "Not found."}')
+
+    def pushes(self, history, host):
+        count = int(self.query.get('count', ['100'])[0])
+        # Newest first, like Treeherder
+        return {'results': history.pushes[::-1][:count]}
+
+    def jobs(self, history, host):
+        jobs = history.jobs.get(int(self.query.get('push_id', ['0'])[0]), [])
+
+        if 'tier__in' in self.query:
+            jobs = [job for job in jobs if str(job['tier']) in self.query['tier__in'][0].split(',')]
+        if 'last_modified__gt' in self.query:
+            jobs = [job for job in jobs if job['last_modified'] > self.query['last_modified__gt'][0]]
+
+        offset, count = int(self.query.get('offset', ['0'])[0]), int(self.query.get('count', ['2000'])[0])
+        return {'results': jobs[offset:offset + count]}
+
+    def job_logs(self, history, host):
+        return [
+            {'job_id': int(job_id), 'name': 'live_backing_log', 'url': f'https://logs.example.com/{job_id}.log'}
+            for job_id in self.query.get('job_id', [])
+        ]
+
+    def task_group(self, history, host, group_id):
+        tasks = sorted(task_id for task_id, (_, group) in history.tasks.items() if group == group_id)
+        offset = int(self.query.get('continuationToken', ['0'])[0])
+        limit = int(self.query.get('limit', ['1000'])[0])
+        page = {
+            'taskGroupId': group_id,
+            'tasks': [
+                {'status': {'taskId': task_id, 'state': 'completed'}, 'task': history.task_definition(task_id)}
+                for task_id in tasks[offset:offset + limit]
+            ],
+        }
+        if offset + limit < len(tasks):
+            page['continuationToken'] = str(offset + limit)
+        return page
+
+    def task(self, history, host, task_id):
+        return history.task_definition(task_id) if task_id in history.tasks else None
+
+    def redirect(self, history, host, task_id, run_id, name):
+        return {'storageType': 's3', 'url': f'{self.server.url}/{host}/artifacts/{task_id}/{run_id}/{name}'}
+
+    def artifact(self, history, host, task_id, run_id, name):
+        return history.artifact(task_id, int(run_id), name)
+
+    def revision(self, history, host, revision):
+        push = next((push for push in history.pushes if push['revision'] == revision), None)
+        if push is None:
+            return None
+        return {'node': revision, 'desc': push['revisions'][0]['comments'], 'user': push['revisions'][0]['author']}
+
+    def hg_pushes(self, history, host):
+        revisions = self.query.get('changeset', [])
+        return {
+            str(push['id']): {
+                'user': push['author'],
+                'date': push['push_timestamp'],
+                'changesets': [
+                    {'node': revision['revision'], 'desc': revision['comments'], 'author': revision['author']}
+                    for revision in push['revisions']
+                ],
+            }
+            for push in history.pushes if push['revision'] in revisions
+        } or None
+
+    def rate_limit(self, history, host):
+        limit = {'limit': 5000, 'remaining': 5000, 'reset': 4102444800, 'used': 0}
+        return {'resources': {'core': limit, 'graphql': limit, 'search': limit}, 'rate': limit}
+
+    def graphql(self, history, host):
+        query = json.loads(self.body)['query']
+        commits = {
+            alias: {
+                'oid': sha,
+                'url': f'https://github.com/mozilla-mobile/firefox-android/commit/{sha}',
+                'message': f'Synthetic commit {sha[:8]}',
+                'associatedPullRequests': {'nodes': [{
+                    'title': f'Bug {1800000 + int(sha[:4], 16)} - Synthetic pull request',
+                    'url': f'https://github.com/mozilla-mobile/firefox-android/pull/{int(sha[:4], 16)}',
+                }]},
+            }
+            for alias, sha in re.findall(r'(c\d+): object\(oid: "([0-9a-f]+)"\)', query)
+        }
+        return {'data': {'repository': commits, 'rateLimit': {'cost': 1, 'remaining': 4999}}}
+
+
+class SyntheticServer(StandInServer):
+    '''Stand-in server for every upstream host, answering from a synthetic history'''
+
+    def __init__(self, history, port=0):
+        super().__init__(SyntheticHandler, port)
+        self.history = history
+
+
+def record_cassette(history, directory, concurrency=8):
+    '''Record the cassette of a `client.py` run over a history, as if it had run against the upstream hosts
+
+    The run is recorded against the synthetic server, then the server's
+    URLs are replaced by the upstream hosts of the global configuration
+    in the requests, headers and (uncompressed) bodies of the cassette.
+    An empty Bugzilla cassette is added, so that bug searches fail at once.
+    '''
+    config = configparser.ConfigParser()
+    config.read(os.path.join(ROOT, 'configurations', 'config.ini'))
+    shutil.rmtree(directory, ignore_errors=True)
+
+    with SyntheticServer(history) as server, tempfile.TemporaryDirectory(prefix='cassette-') as workdir:
+        # The global configuration is left as is, so its requests match those of the benchmark
+        prepare(workdir, server)
+        run_stage(workdir, 'record', [
+            os.path.join(ROOT, 'client.py'), f'--project={history.project}', f'--concurrency={concurrency}',
+            f'--record={os.path.abspath(directory)}'
+        ])
+        upstream = sorted(
+            {(f"{server.url}/{urlsplit(config[section][option]).netloc}",
+              f"{urlsplit(config[section][option]).scheme}://{urlsplit(config[section][option]).netloc}")
+             for section, option in HOSTS if config.has_option(section, option)},
+            key=lambda prefix: -len(prefix[0])
+        )
+
+    def relocate(text):
+        for local, host in upstream:
+            text = text.replace(local, host)
+        return text
+
+    with open(os.path.join(directory, 'index.json'), encoding='utf-8') as index_file:
+        index = json.load(index_file)
+
+    for exchanges in index.values():
+        for exchange in exchanges:
+            exchange['headers'] = {name: relocate(value) for name, value in exchange['headers'].items()}
+            path = os.path.join(directory, 'bodies', f"{exchange['body']}.gz")
+            with open(path, 'rb') as body_file:
+                body = gzip.decompress(body_file.read())
+
+            if body[:2] == b'\x1f\x8b':
+                continue
+
+            try:
+                relocated = relocate(body.decode()).encode()
+            except UnicodeDecodeError:
+                continue
+
+            if relocated != body:
+                exchange['body'] = hashlib.sha256(relocated).hexdigest()
+                with open(os.path.join(directory, 'bodies', f"{exchange['body']}.gz"), 'wb') as body_file:
+                    body_file.write(gzip.compress(relocated, mtime=0))
+
+    index = {relocate(key): exchanges for key, exchanges in index.items()}
+    with open(os.path.join(directory, 'index.json'), 'w', encoding='utf-8') as index_file:
+        json.dump(index, index_file, indent=1, sort_keys=True)
+
+    # Drop the bodies only the server's URLs referred to
+    used = {exchange['body'] for exchanges in index.values() for exchange in exchanges}
+    for name in os.listdir(os.path.join(directory, 'bodies')):
+        if name[:-len('.gz')] not in used:
+            os.remove(os.path.join(directory, 'bodies', name))
+
+    os.makedirs(os.path.join(directory, 'bugzilla'), exist_ok=True)
+    with open(os.path.join(directory, 'bugzilla', 'index.json'), 'w', encoding='utf-8') as index_file:
+        json.dump({}, index_file)
+
+
+def add_arguments(parser):
+    '''Add the scale and rate options of a synthetic history to a parser'''
+    parser.add_argument(
+        '--project',
+        default='mozilla-central',
+        help='Project configuration (default: mozilla-central)',
+        required=False
+    )
+    parser.add_argument(
+        '--pushes-per-day',
+        default=10,
+        type=int,
+        help='Pushes per day (default: 10)',
+        required=False
+    )
+    parser.add_argument(
+        '--jobs-per-section',
+        default=1,
+        type=int,
+        help='Jobs of every configuration section per push (default: 1)',
+        required=False
+    )
+    parser.add_argument(
+        '--flaky-rate',
+        default=0.01,
+        type=float,
+        help='Average probability of a test case being flaky (default: 0.01)',
+        required=False
+    )
+    parser.add_argument(
+        '--failure-rate',
+        default=0.002,
+        type=float,
+        help='Average probability of a test case failing in a failed job (default: 0.002)',
+        required=False
+    )
+    parser.add_argument(
+        '--retry-rate',
+        default=0.05,
+        type=float,
+        help='Share of the jobs with a superseded earlier run (default: 0.05)',
+        required=False
+    )
+    parser.add_argument(
+        '--devices',
+        default=2,
+        type=int,
+        help=f'Devices per matrix (default: 2, at most {len(DEVICES)})',
+        required=False
+    )
+    parser.add_argument(
+        '--seed',
+        default=1,
+        type=int,
+        help='Random seed (default: 1)',
+        required=False
+    )
+
+
+def history_options(args, **overrides):
+    '''Return the keyword arguments of SyntheticHistory from parsed options'''
+    return dict({
+        'pushes_per_day': args.pushes_per_day,
+        'jobs_per_section': args.jobs_per_section,
+        'flaky_rate': args.flaky_rate,
+        'failure_rate': args.failure_rate,
+        'retry_rate': args.retry_rate,
+        'devices': args.devices,
+        'seed': args.seed,
+    }, **overrides)
+
+
+def parse_args(cmdln_args):
+    parser = argparse.ArgumentParser(
+        description='Generates a synthetic CI history, written to a directory or served locally'
+    )
+
+    add_arguments(parser)
+    parser.add_argument(
+        '--days',
+        default=1,
+        type=int,
+        help='Days of history (default: 1)',
+        required=False
+    )
+    parser.add_argument(
+        '--tests',
+        default=200,
+        type=int,
+        help='Test cases per JUnit report (default: 200)',
+        required=False
+    )
+    output = parser.add_mutually_exclusive_group(required=True)
+    output.add_argument(
+        '--write',
+        metavar='DIR',
+        help='Write pushes, job lists, task definitions and artifacts under DIR'
+    )
+    output.add_argument(
+        '--serve',
+        metavar='PORT',
+        type=int,
+        help='Serve the history on a local port, every upstream host under /<host>'
+    )
+    output.add_argument(
+        '--record',
+        metavar='DIR',
+        help='Record the cassette of a client.py run over the history to DIR, for benchmarks/run.py'
+    )
+
+    return parser.parse_args(args=cmdln_args)
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    history = SyntheticHistory(args.project, days=args.days, tests=args.tests, **history_options(args))
+    jobs = sum(len(jobs) for jobs in history.jobs.values())
+
+    if args.write:
+        history.write(args.write)
+        print(f'{len(history.pushes)} pushes and {jobs} jobs written to [{args.write}]')
+        return
+
+    if args.record:
+        record_cassette(history, args.record)
+        print(f'Cassette of {len(history.pushes)} pushes and {jobs} jobs recorded to [{args.record}]')
+        return
+
+    with SyntheticServer(history, args.serve) as server:
+        print(f'Serving {len(history.pushes)} pushes and {jobs} jobs at {server.url}/<host>')
+
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -23,6 +23,9 @@ Uses:
 
 def parse_args():
     import argparse
+
+    from lib.log import LEVELS
+
     parser = argparse.ArgumentParser(
         description="Supply a INI configuration file to "
                     "fetch data from Treeherder, Github, and Taskcluster "
@@ -35,8 +38,9 @@ def parse_args():
     )
     parser.add_argument(
         "--project",
-        help="Project configuration "
-             "(e.g. 'mozilla-mobile/firefox-android')",
+        nargs='+',
+        help="Project configuration(s), built concurrently when several are given "
+             "(e.g. 'mozilla-central autoland')",
         required=True
     )
     parser.add_argument(
@@ -46,15 +50,123 @@ def parse_args():
         action='store_true',
         help='Query list of disabled tests'
     )
+    parser.add_argument(
+        '--incremental',
+        default=False,
+        required=False,
+        action='store_true',
+        help='Only fetch pushes and jobs newer than the previous run '
+             'and merge them into its output.json'
+    )
+    parser.add_argument(
+        '--concurrency',
+        default=1,
+        type=int,
+        required=False,
+        help='Maximum number of concurrent requests per host '
+             '(default: 1, fetches sequentially)'
+    )
+    parser.add_argument(
+        '--output',
+        default='output.json',
+        required=False,
+        metavar='PATH',
+        help='Output file (default: output.json); a .ndjson or .ndjson.gz '
+             'file is written as a stream of records, flushed after every push. '
+             'With several projects, each one is written to {date}_{project} '
+             'with the same suffix, or to the given template if it uses {project}'
+    )
+    parser.add_argument(
+        '--db',
+        default=None,
+        required=False,
+        metavar='PATH',
+        help='Store results in a SQLite database, written push by push '
+             'instead of being held in memory (output.json is exported from it)'
+    )
+    parser.add_argument(
+        '--parse-workers',
+        default=0,
+        type=int,
+        required=False,
+        help='Number of processes parsing JUnit reports '
+             '(default: 0, parses them in the main process)'
+    )
+    parser.add_argument(
+        '--metrics-top',
+        default=10,
+        type=int,
+        required=False,
+        help='Endpoints, phases and stages listed in the latency summary '
+             '(default: 10, every one is written to metrics.json)'
+    )
+    parser.add_argument(
+        '--log-level',
+        default='INFO',
+        type=str.upper,
+        choices=LEVELS,
+        required=False,
+        help='Level of the records written to output.log, as JSON lines (default: INFO)'
+    )
+    parser.add_argument(
+        '--profile',
+        nargs='?',
+        const='client.prof',
+        default=None,
+        metavar='PATH',
+        required=False,
+        help='Profile the run (including its worker threads) with cProfile, '
+             'writing the stats to PATH (default: client.prof)'
+    )
+
+    from lib.cassette_options import add_arguments
+    add_arguments(parser)
 
     return parser.parse_args()
 
 
+def validate(args):
+    '''Check the arguments and configurations, before any backend is imported'''
+    import os
+
+    from lib.treeherder import TreeherderConfig
+
+    if args.concurrency < 1:
+        raise SystemExit('--concurrency must be at least 1')
+    if args.parse_workers < 0:
+        raise SystemExit('--parse-workers must not be negative')
+    if args.metrics_top < 0:
+        raise SystemExit('--metrics-top must not be negative')
+
+    # Incremental runs merge into the previous output, so it needs a path that does not change between runs
+    if args.incremental and ('{date}' in args.output or (len(args.project) > 1 and '{project}' not in args.output)):
+        raise SystemExit('--incremental needs a stable --output: with several projects, '
+                         'use a template with {project} (and without {date}), e.g. --output={project}.json')
+
+    for project in args.project:
+        if not os.path.isfile(f'configurations/{project}.ini'):
+            raise SystemExit(f'No configuration found for [{project}] (configurations/{project}.ini)')
+
+    # Only projects not hosted on Mercurial resolve their commits through Github
+    global_configuration = TreeherderConfig.read_global_config()
+    hg_projects = [project.strip() for project in global_configuration['hg']['projects'].split(',')]
+    if any(project not in hg_projects for project in args.project) and 'GITHUB_TOKEN' not in os.environ:
+        raise SystemExit('GITHUB_TOKEN environment variable is not set')
+
+
 def main():
-    from lib.databuilder import data_builder
     args = parse_args()
-    data_builder = data_builder()
-    data_builder.build_complete_dataset(args)
+    validate(args)
+    from lib.cassette_options import from_args
+    cassette = from_args(args)
+    from lib.log import setup_logging
+    setup_logging(args.log_level)
+
+    from lib.databuilder import data_builder
+
+    with cassette:
+        data_builder = data_builder()
+        data_builder.build_complete_dataset(args)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,81 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+'''
+Scores the flakiness of tests over the datasets of many daily runs
+generated by `client.py` (e.g. the daily JSON files of every branch)
+'''
+
+import argparse
+import json
+import sys
+
+from lib.history import History
+
+
+def parse_args(cmdln_args):
+    '''Parse command line arguments'''
+    parser = argparse.ArgumentParser(
+        description='Ranks the flakiest tests over many datasets'
+    )
+
+    parser.add_argument(
+        '--input',
+        nargs='+',
+        help='Inputs (JSON or NDJSON), one or more per day and project',
+        required=True
+    )
+    parser.add_argument(
+        '--days',
+        default=90,
+        type=int,
+        help='Number of most recent days to score (default: 90)',
+        required=False
+    )
+    parser.add_argument(
+        '--top',
+        default=20,
+        type=int,
+        help='Number of tests to list (default: 20)',
+        required=False
+    )
+    parser.add_argument(
+        '--json',
+        default=False,
+        action='store_true',
+        help='Print the ranking as JSON',
+        required=False
+    )
+
+    return parser.parse_args(args=cmdln_args)
+
+
+def main():
+    '''Main entry point'''
+    args = parse_args(sys.argv[1:])
+
+    try:
+        history = History.load(args.input)
+    except OSError as err:
+        raise SystemExit(err) from err
+
+    top = history.top_flaky(count=args.top, days=args.days)
+
+    if args.json:
+        print(json.dumps(top, indent=4))
+        return
+
+    print(f"Top {len(top)} flaky tests over {min(args.days, len(history.days))} day(s) "
+          f"from {len(args.input)} dataset(s)", end='\n\n')
+
+    for test in top:
+        print(f"{test['flake_rate']:6.1%} flaky {test['failure_rate']:6.1%} failed "
+              f"({test['flaky']}/{test['runs']} runs, streak {test['current_streak']}/{test['longest_streak']} days, "
+              f"trend {test['trend']:+.3f}/day) {test['name']}")
+
+
+if __name__ == '__main__':
+    main()
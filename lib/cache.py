@@ -0,0 +1,131 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+'''On-disk cache for immutable Taskcluster artifacts'''
+
+import hashlib
+import os
+from collections import OrderedDict
+
+
+class ArtifactCache:
+    '''Content-addressed LRU cache of compressed artifact bytes
+
+    The artifacts of a completed task run never change, so entries are
+    keyed by (task_id, run_id, artifact name) and stored exactly as they
+    were served (gzip-compressed). Once the cache grows past `max_size`
+    bytes, the least recently used entries are evicted.
+    '''
+
+    # Artifact types that can be cached, with the suffix they are stored under
+    CONTENT_TYPES = {
+        'application/json': '.json.gz',
+        'application/xml': '.xml.gz',
+    }
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits, self.misses, self.evictions = 0, 0, 0
+        self.entries = OrderedDict()
+        self.size = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        self.load()
+
+    @classmethod
+    def from_config(cls, config):
+        '''Create the cache from the [cache] section of the global configuration'''
+        max_size = config.getint('cache', 'artifacts_max_size', fallback=0) * 1024 * 1024
+
+        if max_size <= 0:
+            return None
+
+        return cls(
+            config.get('cache', 'directory', fallback='.cache') + '/artifacts',
+            max_size
+        )
+
+    @staticmethod
+    def key(task_id, run_id, name):
+        return hashlib.sha256(f'{task_id}/{run_id}/{name}'.encode()).hexdigest()
+
+    def load(self):
+        '''Index existing entries, least recently used first'''
+        entries = []
+
+        for root, _, files in os.walk(self.directory):
+            for filename in files:
+                if filename.endswith(tuple(self.CONTENT_TYPES.values())):
+                    path = os.path.join(root, filename)
+                    stat = os.stat(path)
+                    entries.append((stat.st_mtime, path, stat.st_size))
+
+        for _, path, size in sorted(entries):
+            self.entries[path] = size
+            self.size += size
+
+    def path(self, key, content_type):
+        return os.path.join(self.directory, key[:2], key + self.CONTENT_TYPES[content_type])
+
+    def get(self, task_id, run_id, name):
+        '''Return the cached (content type, compressed bytes), or None'''
+        key = self.key(task_id, run_id, name)
+
+        for content_type in self.CONTENT_TYPES:
+            path = self.path(key, content_type)
+
+            if path in self.entries:
+                try:
+                    with open(path, 'rb') as entry:
+                        body = entry.read()
+                except OSError:
+                    self.forget(path)
+                    break
+
+                os.utime(path)
+                self.entries.move_to_end(path)
+                self.hits += 1
+                return content_type, body
+
+        self.misses += 1
+        return None
+
+    def put(self, task_id, run_id, name, content_type, body):
+        '''Store compressed artifact bytes, evicting old entries if needed'''
+        if content_type not in self.CONTENT_TYPES or len(body) > self.max_size:
+            return
+
+        path = self.path(self.key(task_id, run_id, name), content_type)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temporary file first so that an interrupted run
+        # never leaves a truncated entry behind
+        with open(f'{path}.tmp', 'wb') as entry:
+            entry.write(body)
+        os.replace(f'{path}.tmp', path)
+
+        self.forget(path)
+        self.entries[path] = len(body)
+        self.size += len(body)
+        self.evict()
+
+    def forget(self, path):
+        self.size -= self.entries.pop(path, 0)
+
+    def evict(self):
+        while self.size > self.max_size and self.entries:
+            path, size = self.entries.popitem(last=False)
+            self.size -= size
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.evictions += 1
+
+    def stats(self):
+        return (f'{self.hits} hits, {self.misses} misses, {self.evictions} evictions '
+                f'({self.size / 1024 / 1024:.1f} MiB in {len(self.entries)} entries)')
@@ -0,0 +1,220 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+'''Recording and replaying of upstream HTTP exchanges'''
+
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+# Query parameters that change from one run to the next (e.g. the push
+# window ends today), and are ignored when matching requests
+VOLATILE_PARAMS = ('startdate', 'enddate')
+
+# Response headers that describe the transfer rather than the body
+SKIPPED_HEADERS = ('content-encoding', 'content-length', 'transfer-encoding', 'set-cookie', 'connection')
+
+
+class CassetteMiss(requests.ConnectionError):
+    '''A replayed request was never recorded'''
+
+
+class Cassette:
+    '''Every HTTP exchange of a run, recorded to or replayed from a directory
+
+    Requests sent through requests (Treeherder, Taskcluster, Github and
+    Bugzilla clients) and artifact downloads of the shared transport are
+    intercepted. The cassette is compact: `index.json` maps each request
+    (method, URL without volatile parameters, body hash) to its responses
+    in order, and bodies are stored once each, gzip-compressed, under
+    `bodies/` by content hash. Replayed responses can be delayed by a
+    per-host latency, where `*` sets the latency of every other host.
+    '''
+
+    def __init__(self, directory, mode, latency=None):
+        if mode not in ('record', 'replay'):
+            raise ValueError(f'Unknown cassette mode {mode}')
+
+        self.directory = directory
+        self.mode = mode
+        self.latency = latency or {}
+        self.lock = threading.Lock()
+        self.positions = {}
+        self.patched = []
+
+        try:
+            with open(os.path.join(directory, 'index.json'), encoding='utf-8') as index_file:
+                self.index = json.load(index_file)
+        except FileNotFoundError:
+            if mode == 'replay':
+                raise SystemExit(f'No cassette found in [{directory}]')
+            self.index = {}
+
+        if mode == 'record':
+            # A recording replaces the previous one
+            self.index = {}
+            os.makedirs(os.path.join(directory, 'bodies'), exist_ok=True)
+
+    @staticmethod
+    def parse_latency(specs):
+        '''Parse `host=seconds` specifications into a dict'''
+        latency = {}
+
+        for spec in specs or []:
+            host, _, seconds = spec.rpartition('=')
+            try:
+                latency[host or '*'] = float(seconds)
+            except ValueError as err:
+                raise SystemExit(f'Invalid latency [{spec}], expected HOST=SECONDS') from err
+
+        return latency
+
+    @staticmethod
+    def key(method, url, body=None):
+        parts = urlsplit(url)
+        query = urlencode(sorted(
+            (name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+            if name not in VOLATILE_PARAMS
+        ))
+        key = f'{method.upper()} {urlunsplit((parts.scheme, parts.netloc, parts.path, query, ""))}'
+
+        if body:
+            key += ' ' + hashlib.sha256(body if isinstance(body, bytes) else body.encode()).hexdigest()[:16]
+
+        return key
+
+    def delay(self, url):
+        host = urlsplit(url).netloc
+        return self.latency.get(host, self.latency.get('*', 0))
+
+    def body_path(self, digest):
+        return os.path.join(self.directory, 'bodies', f'{digest}.gz')
+
+    def record(self, key, status, headers, body):
+        digest = hashlib.sha256(body).hexdigest()
+
+        with self.lock:
+            if not os.path.exists(self.body_path(digest)):
+                with open(f'{self.body_path(digest)}.tmp', 'wb') as body_file:
+                    body_file.write(gzip.compress(body, mtime=0))
+                os.replace(f'{self.body_path(digest)}.tmp', self.body_path(digest))
+
+            self.index.setdefault(key, []).append({
+                'status': status,
+                'headers': {
+                    name: value for name, value in headers.items() if name.lower() not in SKIPPED_HEADERS
+                },
+                'body': digest,
+            })
+
+    def replay(self, key):
+        '''Return the next recorded (status, headers, body) of a request
+
+        Responses of a request sent more than once are replayed in the
+        order they were recorded, the last one being repeated.
+        '''
+        with self.lock:
+            exchanges = self.index.get(key)
+
+            if not exchanges:
+                raise CassetteMiss(f'Request not recorded: {key}')
+
+            position = self.positions.get(key, 0)
+            self.positions[key] = position + 1
+
+        exchange = exchanges[min(position, len(exchanges) - 1)]
+
+        with open(self.body_path(exchange['body']), 'rb') as body_file:
+            return exchange['status'], exchange['headers'], gzip.decompress(body_file.read())
+
+    def send(self, send, adapter, request, **kwargs):
+        '''Intercept a request sent through a requests adapter'''
+        key = self.key(request.method, request.url, request.body)
+
+        if self.mode == 'record':
+            response = send(adapter, request, **kwargs)
+            self.record(key, response.status_code, response.headers, response.content)
+            return response
+
+        status, headers, body = self.replay(key)
+        time.sleep(self.delay(request.url))
+
+        response = requests.Response()
+        response.status_code = status
+        response.headers = CaseInsensitiveDict(headers)
+        response._content = body
+        response.url = request.url
+        response.request = request
+        response.reason = requests.status_codes._codes.get(status, ('',))[0].upper()
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        return response
+
+    async def download(self, download, transport, url, headers=None):
+        '''Intercept an artifact download of the shared transport'''
+        key = self.key('GET', url)
+
+        if self.mode == 'record':
+            content_type, body = await download(transport, url, headers=headers)
+            self.record(key, 200, {'Content-Type': content_type}, body)
+            return content_type, body
+
+        from lib.transport import NetworkError
+
+        try:
+            _, recorded_headers, body = self.replay(key)
+        except CassetteMiss as err:
+            # Raised as any other failed download, so the job is skipped rather than the run aborted
+            raise NetworkError(url, str(err)) from err
+
+        await asyncio.sleep(self.delay(url))
+        return recorded_headers['Content-Type'], body
+
+    def install(self):
+        '''Route every requests adapter and transport download through the cassette'''
+        from lib.transport import Transport
+
+        send, download = HTTPAdapter.send, Transport.download
+        cassette = self
+
+        def patched_send(adapter, request, **kwargs):
+            return cassette.send(send, adapter, request, **kwargs)
+
+        async def patched_download(transport, url, headers=None):
+            return await cassette.download(download, transport, url, headers=headers)
+
+        HTTPAdapter.send, Transport.download = patched_send, patched_download
+        self.patched = [(HTTPAdapter, 'send', send), (Transport, 'download', download)]
+
+    def uninstall(self):
+        for owner, name, original in self.patched:
+            setattr(owner, name, original)
+        self.patched = []
+
+    def save(self):
+        if self.mode != 'record':
+            return
+
+        with open(os.path.join(self.directory, 'index.json.tmp'), 'w', encoding='utf-8') as index_file:
+            json.dump(self.index, index_file, indent=1, sort_keys=True)
+        os.replace(os.path.join(self.directory, 'index.json.tmp'), os.path.join(self.directory, 'index.json'))
+
+    def __enter__(self):
+        self.install()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.uninstall()
+        self.save()
+
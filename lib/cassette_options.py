@@ -0,0 +1,54 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+'''Command line options selecting a cassette (see `lib/cassette.py`), without importing it until one is used'''
+
+
+def from_args(args):
+    '''Return the cassette selected by --record/--replay/--latency, or a no-op context'''
+    from contextlib import nullcontext
+
+    if args.latency and not args.replay:
+        raise SystemExit('--latency requires --replay')
+
+    if not (args.record or args.replay):
+        return nullcontext()
+
+    from lib.cassette import Cassette
+
+    return Cassette(
+        args.record or args.replay,
+        'record' if args.record else 'replay',
+        latency=Cassette.parse_latency(args.latency)
+    )
+
+
+def add_arguments(parser):
+    '''Add the --record, --replay and --latency options to a parser'''
+    modes = parser.add_mutually_exclusive_group()
+    modes.add_argument(
+        '--record',
+        default=None,
+        required=False,
+        metavar='DIR',
+        help='Record every HTTP exchange of the run to a cassette directory'
+    )
+    modes.add_argument(
+        '--replay',
+        default=None,
+        required=False,
+        metavar='DIR',
+        help='Replay HTTP exchanges from a cassette directory, offline'
+    )
+    parser.add_argument(
+        '--latency',
+        action='append',
+        default=[],
+        required=False,
+        metavar='HOST=SECONDS',
+        help='Delay replayed responses of a host (or of every host with *=SECONDS), '
+             'may be given several times'
+    )
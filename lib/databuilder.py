@@ -20,123 +20,235 @@ Uses:
   - Github
 '''
 
-import gzip
 import json
 import logging
 import os
 import re
-import ssl
+import zlib
 from datetime import datetime
 from statistics import mean
 
-from github import Github
-from junitparser import (Attr, Failure, JUnitXml, JUnitXmlError, TestCase,
-                         TestSuite, Skipped)
-from taskcluster import Queue
-from taskcluster.exceptions import TaskclusterRestFailure
+from lib.junit import read_problem_tests
+from lib.transport import DecodeError, TransportError, open_compressed
+from lib.treeherder import JobIndex, TreeherderConfig, TreeherderHelper
 
-from lib.treeherder import TreeherderHelper
-
-logging.basicConfig(filename='output.log', filemode='w', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def serialize_sets(obj):
-    '''Serialize sets to lists.'''
-    if isinstance(obj, set):
-        return list(obj)
+def aggregate_tests(dataset):
+    '''Aggregate the problem tests of a dataset in a single pass.
+
+    Returns a dict keyed by test name (in order of first appearance) of
+    its occurrence `count`, `flaky` and `failure` counts, first and last
+    push ids, and the distinct devices and revisions it failed on.
+    '''
+    tests = {}
+
+    for record in dataset:
+        devices = [axis['device'] for axis in record['matrix_outcome_details'] or [] if 'device' in axis]
+
+        for problem in record['problem_test_details']:
+            test = tests.setdefault(problem['name'], {
+                'count': 0,
+                'flaky': 0,
+                'failure': 0,
+                'first_push_id': record['push_id'],
+                'last_push_id': record['push_id'],
+                'devices': set(),
+                'revisions': set(),
+            })
+            test['count'] += 1
+            test[problem['result']] = test.get(problem['result'], 0) + 1
+            test['first_push_id'] = min(test['first_push_id'], record['push_id'])
+            test['last_push_id'] = max(test['last_push_id'], record['push_id'])
+            test['devices'].update(devices)
 
-    return obj
+            if record['revision']:
+                test['revisions'].add(record['revision'])
 
+    for test in tests.values():
+        test['devices'] = sorted(test['devices'])
+        test['revisions'] = sorted(test['revisions'])
 
-def get_artifact(url, params=None):
-    '''Fetch artifact from Taskcluster.'''
-    from urllib.error import HTTPError, URLError
+    return tests
+
+
+async def get_artifact(fetcher, url, params=None):
+    '''Fetch a raw (compressed) artifact from Taskcluster as (content type, bytes).'''
     from urllib.parse import urlencode
-    from urllib.request import Request, urlopen
 
     if params is not None:
         url += "?" + urlencode(params)
 
-    try:
-        request = Request(url=url, headers={'Accept-Encoding': 'gzip'})
-        response = urlopen(request, context=ssl._create_unverified_context())
-    except HTTPError as e:
-        return f'HTTPError: {e.code}'
-    except URLError as e:
-        return f'URLError: {e.reason}'
-
-    try:
-        if response.headers.get('Content-Type') == 'application/json':
-            return json.loads(gzip.decompress(response.read()))
-        elif response.headers.get('Content-Type') == 'application/xml':
-            return JUnitXml.fromstring(gzip.decompress(response.read()))
-        else:
-            return SystemError('Unknown artifact type')
-    except OSError:
-        return 'Error decompressing data'
-    except json.JSONDecodeError:
-        return 'Error decoding JSON data'
-    except JUnitXmlError:
-        return 'Error parsing XML data'
+    return await fetcher.download(url, headers={'Accept-Encoding': 'gzip'})
 
 
-class _TestSuite(TestSuite):
-    '''Extend TestSuite class to add flakes attribute.'''
-    flakes = Attr()
+def decode_artifact(content_type, body, url=None):
+    '''Decompress and decode a raw JSON artifact.'''
+    if content_type != 'application/json':
+        raise DecodeError(url, f'Unknown artifact type {content_type}')
 
-
-class _TestCase(TestCase):
-    '''Extend Testcase class to add flaky attribute.'''
-    flaky = Attr()
+    try:
+        with open_compressed(body) as stream:
+            return json.load(stream)
+    except json.JSONDecodeError as err:
+        raise DecodeError(url, f'Error decoding JSON data: {err}') from err
+    except (OSError, EOFError, zlib.error) as err:
+        raise DecodeError(url, f'Error decompressing data: {err}') from err
 
 
 class data_builder:
     '''Build the dataset.'''
     def __init__(self):
-        self.github = Github(os.environ['GITHUB_TOKEN']) \
-            if 'GITHUB_TOKEN' in os.environ else exit("GITHUB_TOKEN environment variable is not set")
+        self.github = None
+        self.artifact_cache = None
+        self.task_definitions = None
+        self.pull_requests = None
+        self.hg_metadata = None
+        self.store = None
+        self.outputs = {}
+
+    @staticmethod
+    def create_github(global_configuration, transport):
+        """Create the Github client, only needed by projects not hosted on Mercurial."""
+        if 'GITHUB_TOKEN' not in os.environ:
+            exit("GITHUB_TOKEN environment variable is not set")
+
+        return transport.create_github(
+            os.environ['GITHUB_TOKEN'],
+            base_url=global_configuration.get('github', 'api', fallback='https://api.github.com'),
+            seconds_between_writes=global_configuration.getfloat('github', 'seconds_between_writes', fallback=0.25)
+        )
 
     def fetch_pushes(self, client):
         """Fetch pushes from Treeherder API."""
         return client.get_pushes()
 
-    def fetch_jobs(self, client, args, push, job):
-        """Fetch jobs from Treeherder API."""
-        return client.get_client().get_jobs(
-            project=args.project,
-            push_id=push['id'],
+    def fetch_job_index(self, client, push, last_modified=None):
+        """Fetch every job of a push (modified after `last_modified`) from Treeherder API and index them."""
+        tiers = sorted({
+            client.project_configuration[job]['tier'] for job in client.project_configuration.sections()
+        })
+        author = client.global_configuration['filters']['author']
+        params = {'tier__in': ','.join(tiers)}
+
+        if author:
+            params['who'] = author
+
+        if last_modified:
+            params['last_modified__gt'] = last_modified
+
+        return JobIndex(client.get_push_jobs(push['id'], **params))
+
+    def fetch_jobs(self, client, job_index, job, superseded=False):
+        """Look up the (latest or superseded) jobs of a configuration section in a push's job index."""
+        return job_index.lookup(
             tier=client.project_configuration[job]['tier'],
             job_type_symbol=client.project_configuration[job]['symbol'],
-            result=client.project_configuration[job]['result'],
             job_group_symbol=client.project_configuration[job]['group_symbol'],
-            who=client.global_configuration['filters']['author']
+            result=client.project_configuration[job]['result'],
+            who=client.global_configuration['filters']['author'],
+            superseded=superseded
         )
 
-    def fetch_github(self, current_job, queue):
-        """Fetch Github data."""
+    async def fetch_artifact(self, fetcher, client, queue, current_job, name, decoder=decode_artifact,
+                             parse=False):
+        """Fetch and decode a task artifact, from the artifact cache when possible.
+
+        With `parse`, the decoder runs in the fetcher's parser processes.
+        """
+        key = (current_job['task_id'], current_job['retry_id'], name)
+        artifact = self.artifact_cache.get(*key) if self.artifact_cache else None
+
+        if artifact is None:
+            artifact = await get_artifact(fetcher, (await fetcher.call(
+                fetcher.host(client.global_configuration['taskcluster']['host']),
+                queue.artifact,
+                *key
+            ))['url'])
+
+            if self.artifact_cache:
+                self.artifact_cache.put(*key, *artifact)
+
+        if parse:
+            return await fetcher.parse(decoder, *artifact, url='/'.join(map(str, key)))
+
+        return decoder(*artifact, url='/'.join(map(str, key)))
+
+    def select_jobs(self, client, job_index, job, push, watermark=None):
+        """Select the jobs of a section to process, skipping those unchanged since the watermark."""
+        jobs = self.fetch_jobs(client, job_index, job)
+
+        if watermark and push['id'] <= watermark['push_id']:
+            jobs = [
+                current_job for current_job in jobs
+                if current_job['last_modified'] > (watermark['last_modified'] or '')
+            ]
+
+        return jobs
+
+    def fetch_github_commit(self, current_job):
+        """Fetch the Github repository and revision a task ran against."""
         from urllib.parse import urlparse
 
+        task_payload = self.task_definitions.get(current_job['task_id'])['payload']
+
+        return (
+            urlparse(task_payload['env']['MOBILE_HEAD_REPOSITORY']).path.strip("/"),
+            task_payload['env']['MOBILE_HEAD_REV']
+        )
+
+    async def prefetch_task_definitions(self, fetcher, host, task_lists):
+        """Prefetch the task definitions of the jobs of many pushes, concurrently.
+
+        Every round fetches the first missing task of each push, then lists
+        the task groups of those tasks for the other missing tasks. Rounds
+        only depend on the jobs, so a run always sends the same requests,
+        whatever the order concurrent requests complete in.
+        """
+        definitions = self.task_definitions
+
+        while True:
+            pending = [missing for missing in map(definitions.missing, task_lists) if missing]
+
+            if not pending:
+                return
+
+            await fetcher.gather([
+                fetcher.call(host, definitions.get, task_id)
+                for task_id in dict.fromkeys(missing[0] for missing in pending)
+            ])
+            await fetcher.gather([
+                fetcher.call(host, definitions.list_group, group_id, wanted)
+                for group_id, wanted in definitions.plan(pending).items()
+            ])
+
+    def prefetch_github(self, jobs):
+        """Resolve the Github commits of many tasks at once."""
+        commits = []
+
+        for current_job in jobs:
+            try:
+                commits.append(self.fetch_github_commit(current_job))
+            except KeyError:
+                pass
+
+        self.pull_requests.resolve_many(commits)
+
+    def fetch_github(self, current_job, queue):
+        """Fetch Github data."""
         try:
-            task_payload = queue.task(current_job['task_id'])['payload']
-            repo = self.github.get_repo(
-                urlparse(task_payload['env']['MOBILE_HEAD_REPOSITORY']).path.strip("/")
-            )
-            commit = repo.get_commit(task_payload['env']['MOBILE_HEAD_REV'])
-            pulls = commit.get_pulls()
-            pull_request = pulls[0] if pulls is not None and pulls.totalCount > 0 else None
+            return self.pull_requests.resolve(*self.fetch_github_commit(current_job))
         except KeyError:
             logger.error(f"Error fetching Github data for {current_job['task_id']}")
-            pull_request, commit = None, None
-
-        return pull_request, commit
+            return None
 
     def fetch_hg(self, current_job, queue):
         """Fetch Mercurial data."""
         from urllib.parse import urlparse
 
         try:
-            task_payload = queue.task(current_job['task_id'])['payload']
+            task_payload = self.task_definitions.get(current_job['task_id'])['payload']
             repo = urlparse(task_payload['env']['GECKO_HEAD_REPOSITORY'])
             commit = task_payload['env']['GECKO_HEAD_REV']
         except KeyError:
@@ -158,266 +270,610 @@ class data_builder:
         """Fetch Phabricator data."""
         pass
 
-    def fetch_comments_for_revision(self, current_push, commit):
-        """Fetch comments for a matching revision."""
-        for revision in current_push['revisions']:
-            if revision['revision'] == commit:
-                return revision['comments']
+    def prefetch_hg(self, current_push, jobs):
+        """Fetch the Mercurial metadata of the revisions many tasks ran against."""
+        self.hg_metadata.prefetch(current_push, [
+            (repo, revision) for repo, revision in (self.fetch_hg(current_job, None) for current_job in jobs)
+            if revision is not None
+        ])
 
     def construct_pushlog(self, client, project, commit):
-        return f"{client.global_configuration['treeherder']['host']}/jobs?repo={project}&revision={getattr(commit, 'sha', commit) if commit else commit}"
+        return f"{client.global_configuration['treeherder']['host']}/jobs?repo={project}&revision={commit}"
+
+    def load_previous_results(self, filename):
+        """Load the sections (records and summary) of a previous run (JSON or NDJSON), keyed by name."""
+        from lib.results import iter_sections
+
+        try:
+            results = list(iter_sections(filename))
+        except (OSError, json.JSONDecodeError):
+            return None
+
+        return {name: section for section in results for name in section if name != 'summary'}
+
+    def merge_datasets(self, previous, dataset, durations, pushes):
+        """Merge new records into a previous dataset, dropping superseded and expired records."""
+        task_ids = {record['task_id'] for record in dataset}
+        oldest_push_id = pushes[0]['id'] if pushes else 0
+        kept = [
+            record for record in previous
+            if record['task_id'] not in task_ids and record['push_id'] >= oldest_push_id
+        ]
+
+        # Previous records only kept their rounded duration
+        return (
+            sorted(kept + dataset, key=lambda record: record['push_id']),
+            [float(record['duration']) for record in kept] + durations
+        )
+
+    @staticmethod
+    def runs(records):
+        """Return the (push id, retry id) of the run of each task of some records."""
+        return {record['task_id']: (record['push_id'], record.get('retry_id', 0)) for record in records}
+
+    def merge_superseded(self, previous, superseded, runs_before, runs_after, pushes):
+        """Merge the superseded runs of a section into those of the previous run.
+
+        Previous superseded runs are kept while their push is in the window.
+        A run the previous records held is superseded once its task has a
+        newer run, even though an incremental run does not fetch it again.
+        """
+        oldest_push_id = pushes[0]['id'] if pushes else 0
+        replaced = [
+            {'push_id': push_id, 'task_id': task_id, 'retry_id': retry_id}
+            for task_id, (push_id, retry_id) in runs_before.items()
+            if task_id in runs_after and runs_after[task_id][1] > retry_id
+        ]
+        merged = {
+            (run['task_id'], run['retry_id']): run for run in previous + replaced + superseded
+            if run['push_id'] >= oldest_push_id
+        }
+
+        return sorted(merged.values(), key=lambda run: (run['push_id'], run['task_id'], run['retry_id']))
 
     def build_complete_dataset(self, args):
-        """Build the complete dataset."""
-        from collections import defaultdict
+        """Build the complete dataset, profiling the run with --profile."""
+        import asyncio
+
+        if not args.profile:
+            asyncio.run(self.build_complete_dataset_async(args))
+            return
+
+        from lib.metrics import Profiler
+
+        with Profiler() as profiler:
+            asyncio.run(self.build_complete_dataset_async(args, profiler))
+
+        profiler.dump(args.profile)
+        print(f'Profile written to [{args.profile}]', end='\n\n')
+
+    @staticmethod
+    def output_path(args, project, date):
+        """Return the output file of a project.
+
+        A single project is written to --output as is. With several
+        projects, each one is written to `{date}_{project}` (as named by
+        the daily workflow) followed by the --output suffix, unless
+        --output is itself a template using `{project}` (and `{date}`).
+        """
+        if '{project}' in args.output:
+            return args.output.format(project=project, date=date)
+
+        if len(args.project) == 1:
+            return args.output
+
+        suffix = next((suffix for suffix in ('.ndjson.gz', '.ndjson') if args.output.endswith(suffix)),
+                      os.path.splitext(args.output)[1])
+
+        return f'{date}_{project}{suffix}'
+
+    async def build_complete_dataset_async(self, args, profiler=None):
+        """Build the complete dataset of every project, fanning out upstream requests.
+
+        Projects are built concurrently and share the transport (and its
+        connection pools), the per-host request limits and every cache.
+        Latencies of the run are written to `metrics.json`, next to the
+        output.
+        """
+        import argparse
+
+        from lib.cache import ArtifactCache
+        from lib.fetcher import AsyncFetcher
+        from lib.hg import HgMetadata
+        from lib.metrics import Metrics
+        from lib.pullrequests import PullRequestResolver
+        from lib.state import IncrementalState
+        from lib.store import ResultsStore
+        from lib.tasks import TaskDefinitions
+        from lib.transport import Transport
+
+        global_configuration = TreeherderConfig.read_global_config()
+        metrics = Metrics()
+        transport = Transport.from_config(global_configuration, pool_size=args.concurrency, metrics=metrics)
+        queue = transport.create_queue(global_configuration['taskcluster']['host'])
+        self.task_definitions = TaskDefinitions.from_config(queue, global_configuration)
+        # A recording must see every request, so it bypasses the on-disk caches
+        cache = not args.record
+        self.artifact_cache = ArtifactCache.from_config(global_configuration) if cache else None
+        hg_projects = [project.strip() for project in global_configuration['hg']['projects'].split(',')]
+
+        if any(project not in hg_projects for project in args.project):
+            self.github = self.create_github(global_configuration, transport)
+            self.pull_requests = PullRequestResolver.from_config(self.github, global_configuration, cache)
+            self.pull_requests.start()
+
+        if any(project in hg_projects for project in args.project):
+            self.hg_metadata = HgMetadata.from_config(transport, global_configuration, cache)
+
+        if args.db:
+            self.store = ResultsStore(args.db)
+
+        state = IncrementalState.from_config(global_configuration) if args.incremental else None
+        date = datetime.now().strftime('%Y_%m_%d_%I_%M_%p')
+
+        async with AsyncFetcher(args.concurrency, transport, args.parse_workers, metrics, profiler) as fetcher:
+            await fetcher.gather([
+                self.build_project(
+                    fetcher, transport, queue,
+                    argparse.Namespace(**dict(vars(args), project=project, output=self.output_path(args, project, date))),
+                    state, project not in hg_projects
+                )
+                for project in args.project
+            ])
+
+        if state is not None:
+            state.save()
+
+        if self.artifact_cache:
+            print(f'Artifact cache: {self.artifact_cache.stats()}', end='\n\n')
+
+        if self.pull_requests:
+            self.pull_requests.save()
+            print(f'Github: {self.pull_requests.stats()}', end='\n\n')
+
+        if self.hg_metadata:
+            self.hg_metadata.save()
+            print(f'Mercurial: {self.hg_metadata.stats()}', end='\n\n')
+
+        if self.store:
+            self.store.close()
+            print(f'Results stored in [{args.db}]', end='\n\n')
+
+        metrics_path = os.path.join(os.path.dirname(args.output) or '.', 'metrics.json')
+        print(Metrics.report(metrics.save(metrics_path), top=args.metrics_top), end='\n\n')
+        print(f'Metrics written to [{metrics_path}]', end='\n\n')
+
+    async def build_project(self, fetcher, transport, queue, args, state, github_project):
+        """Build and write the dataset of a single project (`args.project`)."""
+        from lib.ndjson import NdjsonWriter, is_ndjson
 
         client = TreeherderHelper(args.project)
-        pushes = self.fetch_pushes(client)
-        queue = Queue({'rootUrl': client.global_configuration['taskcluster']['host']})
+        transport.mount(client.get_client().session)
 
-        results = []
-        disabled_tests = set()
+        # Incremental runs add to the previous results, others replace them
+        if self.store and not args.incremental:
+            self.store.reset(args.project)
 
-        print(f"\nFetching [{len(client.project_configuration.sections())}] in [{args.project}] {client.project_configuration.sections()}", end='\n\n')
+        previous, watermarks = {}, {}
+
+        if state is not None:
+            # The results store already holds the previous records, merged as records are stored
+            if self.store:
+                previous = {
+                    name: {'summary': summary} for name, summary in self.store.summaries(args.project).items()
+                } or None
+            else:
+                previous = self.load_previous_results(args.output)
+
+            if previous is None:
+                print(f'No previous output found for [{args.project}], fetching the full window')
+                state.reset(args.project)
+                previous = {}
+
+            watermarks = {
+                job: state.get(args.project, job) for job in client.project_configuration.sections()
+            }
+
+        # Streamed output is written push by push (after loading the previous run),
+        # unless it is exported from the results store
+        if is_ndjson(args.output) and not self.store:
+            self.outputs[args.project] = NdjsonWriter(args.output, client.project_configuration.sections())
+
+        treeherder_host = fetcher.host(client.global_configuration['treeherder']['host'])
+        with fetcher.metrics.measure('stages', 'pushes'):
+            pushes = sorted(
+                await fetcher.call(treeherder_host, self.fetch_pushes, client),
+                key=lambda push: push['id']
+            )
 
-        for job in client.project_configuration.sections():
-
-            durations, outcomes, dataset = [], [], []
-
-            print(f"Fetching result [{client.project_configuration[job]['result']}] in "
-                  f"[{client.project_configuration[job]['symbol']}] "
-                  f"[{client.project_configuration[job]['project']}] "
-                  f"({client.global_configuration['pushes']['maxcount']} max pushes) "
-                  f"from the past [{client.global_configuration['pushes']['days']}] day(s) ...",
-                  end='\n')
-
-            for current_push in sorted(pushes, key=lambda push: push['id']):
-
-                jobs = self.fetch_jobs(client, args, current_push, job)
-                retries = defaultdict(int)
-
-                for current_job in jobs:
-
-                    matrix_outcome_details, pull_request = None, None
-                    matrix_general_details = {}
-                    test_details = []
-
-                    # Fetch the log URL for the current job
-                    current_job_log = ' '.join([str(_log_url['url']) for _log_url in client.get_client().get_job_log_url(
-                        project=args.project,
-                        job_id=current_job['id']
-                    )])
-
-                    if current_job['retry_id'] < retries[current_job['task_id']]:
-                        print(f"Skipping {current_job['task_id']} run: {current_job['retry_id']} because there is a newer run of it.")
-                        continue
-
-                    retries[current_job['task_id']] = current_job['retry_id']
-                    # print(f"{current_job['task_id']} run: {current_job['retry_id']}")
-
-                    # TaskCluster
-                    try:
-                        # Dependent on public artifact visibility
-                        if (re.compile("^(ui-|robo|legacy|experimental|smoke){1}.*")).search(
-                            client.project_configuration[job]['symbol']
-                        ):
-                            # Matrix (i.e, matrix_ids.json) generated from Flank
-                            matrix_artifact = get_artifact(
-                                queue.artifact(
-                                    current_job['task_id'],
-                                    current_job['retry_id'],
-                                    client.global_configuration['artifacts']['matrix']
-                                )['url']
-                            )
-
-                            if matrix_artifact is not None:
-                                for value in matrix_artifact.values():
-                                    matrix_general_details = {
-                                        "webLink": value['webLink'],
-                                        "gcsPath": value['gcsPath'],
-                                        "matrixId": value['matrixId'],
-                                        "isRoboTest": value['isRoboTest'],
-                                    }
-                                    matrix_outcome_details = value['axes']
-
-                            # Disabled tests (if requested) [TODO: append to dataset or output to file]
-                            if args.disabled_tests:
-                                shard_artifact = get_artifact(
-                                    queue.artifact(
-                                        current_job['task_id'],
-                                        current_job['retry_id'],
-                                        client.global_configuration['artifacts']['shards']
-                                    )['url']
-                                )
-
-                                if shard_artifact is not None:
-                                    for value in shard_artifact.values():
-                                        disabled_tests.update(value['junit-ignored'])
-                            else:
-                                pass
-
-                            # JUnitReport (i.e, FullJUnitReport.xml)
-                            report_artifact = get_artifact(
-                                queue.artifact(
-                                    current_job['task_id'],
-                                    current_job['retry_id'],
-                                    client.global_configuration['artifacts']['report']
-                                )['url']
-                            )
-
-                            # Extract the test details from the FullJUnitReport
-                            if report_artifact is not None:
-                                # Dictionary to store the last seen failure details for each test case
-                                last_seen_failures = {}
-
-                                for suite in report_artifact:  # pylint: disable=not-an-iterable
-                                    cur_suite = _TestSuite.fromelem(suite)
-                                    for case in cur_suite:
-                                        case = _TestCase.fromelem(case)
-                                        
-                                        result_type = None
-                                        
-                                        if case.result:
-                                            for entry in case.result:
-                                                if isinstance(entry, Skipped):
-                                                    continue  # ignore skipped tests
-                                                if isinstance(entry, Failure):
-                                                    result_type = (
-                                                        "flaky"
-                                                        if getattr(case, "flaky", "false") == "true"
-                                                        else "failure"
-                                                    )
-                                                    test_id = "%s#%s" % (case.classname, case.name)
-                                                    if entry.text != last_seen_failures.get(test_id, ""):
-                                                        test_details.append(
-                                                            {
-                                                                "name": case.name,
-                                                                "result": result_type,
-                                                                "details": entry.text,
-                                                            }
-                                                        )
-                                                    last_seen_failures[test_id] = entry.text
-
-                                # For Robo Tests, as of now, there are no artifacts exposing details
-                                # about the outcome (e.g, crash details), so we have to write a custom outcome
-                                if matrix_general_details['isRoboTest'] is True:
-                                    if matrix_outcome_details is not None:
-                                        for axis in matrix_outcome_details:
-                                            if axis['outcome'] == 'failure':
-                                                test_details.append({
-                                                    'name': axis['device'],
-                                                    'result': 'failure',
-                                                    'details': axis['details']
-                                                })
-                        else:
-                            pass
-
-                    except TaskclusterRestFailure:
-                        # Abort iteration on current job, continue to next job
-                        print(f"Artifact(s) not available for {current_job['task_id']}")
-                        continue
-
-                    # Fetch Github or Mercurial associative data from the TaskCluster task
-                    # Mercurial (i.e, commit details)
-                    hg_projects = [project.strip() for project in client.global_configuration['hg']['projects'].split(',')]
-
-                    if args.project in hg_projects:
-                        repo, commit = self.fetch_hg(current_job, queue)
-                    else:
-                        # Github (i.e, pull request details)
-                        pull_request, commit = self.fetch_github(current_job, queue)
-
-                    # Stitch together dataset from TaskCluster and Github results
-                    dt_obj_start = datetime.fromtimestamp(current_job['start_timestamp'])
-                    dt_obj_end = datetime.fromtimestamp(current_job['end_timestamp'])
-
-                    durations.append(
-                        (dt_obj_end - dt_obj_start).total_seconds() / 60)
-                    outcomes.append(current_job)
-                    dataset.append({
-                        'push_id': current_push['id'],
-                        'task_id': current_job['task_id'],
-                        'duration': '{0:.0f}'.format(
-                            (dt_obj_end - dt_obj_start).total_seconds() / 60
-                        ),
-                        'author': current_job['who'],
-                        'result': current_job['result'],
-                        'task_html_url': '{0}'.format(''.join(
-                            [client.global_configuration['taskcluster']['host'], '/tasks/',
-                                current_job['task_id']]
-                        )),
-                        'last_modified': current_job['last_modified'],
-                        'task_log': current_job_log,
-                        'matrix_general_details': matrix_general_details,
-                        'matrix_outcome_details': matrix_outcome_details,
-                        'revision': getattr(commit, 'sha', commit) if commit else None,
-                        'pullreq_html_url': pull_request.html_url if pull_request else getattr(commit, 'html_url', None) if hasattr(commit, 'commit') else f"{repo.scheme}://{repo.netloc}/{repo.path}/rev/{commit}" if repo else None,
-                        'pullreq_html_title': pull_request.title if pull_request else getattr(getattr(commit, 'commit', None), 'message', self.fetch_comments_for_revision(current_push, commit)) if commit else None,
-                        'problem_test_details': test_details,
-                        'pushlog': self.construct_pushlog(client, args.project, commit)
-                    })
-
-                    logger.info(
-                        'Duration: {0:.0f} min {1} - {2} - '
-                        '{3}/tasks/{4} - {5} - {6} - [{7}] - '
-                        '[{8}] - {9} - {10} - {11} - {12} - {13} - {14} - {15}'.format(
-                            (dt_obj_end - dt_obj_start).total_seconds() / 60,
-                            current_job['who'],
-                            current_job['result'],
-                            client.global_configuration['taskcluster']['host'],
-                            current_job['task_id'],
-                            current_job['last_modified'],
-                            current_job_log,
-                            ', '.join(map(str, [x['details'] for x in
-                                                matrix_outcome_details]))
-                            if matrix_outcome_details else None,
-                            ', '.join(map(str, [x['outcome'] for x in
-                                                matrix_outcome_details]))
-                            if matrix_outcome_details else None,
-                            matrix_general_details['webLink'],
-                            matrix_general_details['matrixId'],
-                            getattr(commit, 'sha', commit) if commit else None,
-                            test_details,
-                            pull_request.html_url if pull_request else getattr(commit, 'html_url', None) if hasattr(commit, 'commit') else f"{repo.scheme}://{repo.netloc}/{repo.path}/rev/{commit}" if repo else None,
-                            pull_request.title if pull_request else getattr(getattr(commit, 'commit', None), 'message', self.fetch_comments_for_revision(current_push, commit)) if commit else None,
-                            self.construct_pushlog(client, args.project, getattr(commit, 'sha', commit) if commit else None)
-                        )
+        # Jobs of pushes every section has already processed only need
+        # to be fetched if they changed since the previous run
+        if watermarks and all(watermarks.values()):
+            push_watermark = min(watermark['push_id'] for watermark in watermarks.values())
+            last_modified = min(watermark['last_modified'] or '' for watermark in watermarks.values()) or None
+        else:
+            push_watermark, last_modified = None, None
+
+        # Fetch each push's jobs once and share them between every section
+        with fetcher.metrics.measure('stages', 'job indexes'):
+            job_indexes = dict(zip(
+                [push['id'] for push in pushes],
+                await fetcher.gather([
+                    fetcher.call(
+                        treeherder_host, self.fetch_job_index, client, push,
+                        last_modified if push_watermark and push['id'] <= push_watermark else None
                     )
+                    for push in pushes
+                ])
+            ))
+
+        # Prefetch the task definitions of every job that will be processed
+        with fetcher.metrics.measure('stages', 'task definitions'):
+            await self.prefetch_task_definitions(
+                fetcher, fetcher.host(client.global_configuration['taskcluster']['host']),
+                [
+                    [current_job['task_id'] for job in client.project_configuration.sections()
+                     for current_job in self.select_jobs(client, job_indexes[push['id']], job, push, watermarks.get(job))]
+                    for push in pushes
+                ]
+            )
 
-            if durations and outcomes and dataset:
-
-                tests = [problem['name'] for push in dataset for problem in push['problem_test_details']]
-
-                results.append(
-                    {
-                        str(client.project_configuration[job].name): dataset,
-                        'summary': {
-                            'repo': args.project,
-                            'project': client.project_configuration[job]['project'],
-                            'job_symbol': client.project_configuration[job]['symbol'],
-                            'job_result': client.project_configuration[job]['result'],
-                            'job_duration_avg': round(mean(durations), 2),
-                            'outcome_count': len(outcomes),
-                            'duplicates':
-                            json.dumps(set([x for x in tests if tests.count(x) > 1]), default=serialize_sets)
-                        }
-                    }
+        # Resolve the commits of those jobs to their pull requests in batches,
+        # or their revisions to the Mercurial metadata of their push
+        with fetcher.metrics.measure('stages', 'commits'):
+            if github_project:
+                # The jobs of a push share one commit, so batch the commits of every push together
+                await fetcher.call(
+                    fetcher.host(self.github.requester.base_url),
+                    self.prefetch_github,
+                    [current_job for push in pushes for job in client.project_configuration.sections()
+                     for current_job in self.select_jobs(client, job_indexes[push['id']], job, push, watermarks.get(job))]
                 )
-
-                logger.info('Summary: [%s]', client.project_configuration[job]['symbol'])
-                logger.info('Project: %s', client.project_configuration[job]['project'])
-                logger.info('Duration average: {0:.0f} minutes'.format(results[-1]['summary']['job_duration_avg']))
-                logger.info('Results: %s \n', results[-1]['summary']['outcome_count'])
-                print('Output written to LOG file', end='\n\n')
             else:
-                print('No results found with provided project config.', end='\n\n')
+                await fetcher.gather([
+                    fetcher.call(
+                        fetcher.host(client.global_configuration['hg']['host']),
+                        self.prefetch_hg,
+                        push,
+                        [current_job for job in client.project_configuration.sections()
+                         for current_job in self.select_jobs(client, job_indexes[push['id']], job, push, watermarks.get(job))]
+                    )
+                    for push in pushes
+                ])
+
+        disabled_tests = set()
+
+        print(f"\nFetching [{len(client.project_configuration.sections())}] in [{args.project}] {client.project_configuration.sections()}", end='\n\n')
+
+        with fetcher.metrics.measure('stages', 'sections'):
+            sections = await fetcher.gather([
+                self.build_section(
+                    fetcher, client, queue, args, pushes, job_indexes, job, disabled_tests,
+                    watermarks.get(job), previous.get(job)
+                )
+                for job in client.project_configuration.sections()
+            ])
+
+        results = [section for section in sections if section is not None]
 
-        if results:
+        if args.project in self.outputs:
+            self.outputs.pop(args.project).close()
+
+            if results:
+                print(f'Output written to [{args.output}] \n')
+        elif self.store and results:
             try:
-                with open('output.json', 'w', encoding='utf-8') as outfile:
+                self.store.export(args.project, args.output)
+                print(f'Output written to [{args.output}] \n')
+            except OSError as err:
+                raise SystemExit(f"Error: Failed to write output to file. {err}") from err
+        elif results:
+            try:
+                with open(args.output, 'w', encoding='utf-8') as outfile:
                     json.dump(results, outfile, indent=4)
                     print(f'Output written to [{outfile.name}] \n')
             except OSError as err:
                 raise SystemExit(f"Error: Failed to write output to file. {err}") from err
+
+        if not results:
+            print(f'No results found with provided project config [{args.project}].', end='\n\n')
+
+        if state is not None:
+            for job in client.project_configuration.sections():
+                state.update(
+                    args.project,
+                    job,
+                    pushes[-1]['id'] if pushes else None,
+                    max((current_job['last_modified'] for push in pushes
+                         for current_job in self.fetch_jobs(client, job_indexes[push['id']], job)), default=None)
+                )
+
+    async def build_section(self, fetcher, client, queue, args, pushes, job_indexes, job, disabled_tests,
+                            watermark=None, previous=None):
+        """Build the dataset and summary of a single configuration section.
+
+        In incremental mode, jobs at or below the section's watermark are
+        skipped unless they changed since, and the new records (and
+        superseded runs) are merged into those of the previous run.
+
+        With a results store, records are only held by the store (which
+        merges them into the previous run's) and the summary is computed
+        from it, so the section is returned with its summary alone.
+        """
+        print(f"Fetching result [{client.project_configuration[job]['result']}] in "
+              f"[{client.project_configuration[job]['symbol']}] "
+              f"[{client.project_configuration[job]['project']}] "
+              f"({client.global_configuration['pushes']['maxcount']} max pushes) "
+              f"from the past [{client.global_configuration['pushes']['days']}] day(s) ...",
+              end='\n')
+
+        previous_records = previous.get(job) if previous else None
+        output = self.outputs.get(args.project)
+        stream = output.section(job, [push['id'] for push in pushes], previous_records) if output else None
+
+        if previous:
+            runs_before = self.store.runs(args.project, job) if self.store else self.runs(previous_records or [])
+
+        push_entries = await fetcher.gather([
+            self.build_push(
+                fetcher, client, queue, args, current_push, job_indexes[current_push['id']], job, disabled_tests,
+                watermark, stream
+            )
+            for current_push in pushes
+        ])
+
+        if self.store:
+            if pushes:
+                self.store.prune(args.project, job, pushes[0]['id'])
+
+            durations = self.store.durations(args.project, job)
+            # Only records with problem tests are aggregated
+            dataset = self.store.records(args.project, job, problems_only=True)
         else:
+            durations, dataset = [], []
+
+            for duration, record in (entry for entries in push_entries for entry in entries):
+                durations.append(duration)
+                dataset.append(record)
+
+            if previous_records:
+                dataset, durations = self.merge_datasets(previous_records, dataset, durations, pushes)
+
+        # Runs set aside by the job indexes because a newer run of their task exists
+        superseded = [
+            {'push_id': push['id'], 'task_id': current_job['task_id'], 'retry_id': current_job['retry_id']}
+            for push in pushes for current_job in self.fetch_jobs(client, job_indexes[push['id']], job, superseded=True)
+        ]
+
+        if previous:
+            superseded = self.merge_superseded(
+                previous['summary'].get('superseded', []), superseded, runs_before,
+                self.store.runs(args.project, job) if self.store else self.runs(dataset), pushes
+            )
+
+        if not durations:
+            if self.store:
+                self.store.remove_summary(args.project, job)
             print('No results found with provided project config.', end='\n\n')
+            return None
+
+        tests = aggregate_tests(dataset)
+
+        section = {
+            'summary': {
+                'repo': args.project,
+                'project': client.project_configuration[job]['project'],
+                'job_symbol': client.project_configuration[job]['symbol'],
+                'job_result': client.project_configuration[job]['result'],
+                'job_duration_avg': round(mean(durations), 2),
+                'outcome_count': len(durations),
+                'superseded_runs': len(superseded),
+                'superseded': superseded,
+                'duplicates': [name for name, test in tests.items() if test['count'] > 1],
+                'tests': tests
+            }
+        }
+
+        if self.store:
+            self.store.set_summary(
+                args.project, job, section['summary'], client.project_configuration.sections().index(job)
+            )
+        else:
+            section = {str(client.project_configuration[job].name): dataset, **section}
+
+        if stream:
+            stream.close(section['summary'])
+
+        logger.info('Summary: [%s]', client.project_configuration[job]['symbol'], extra={'fields': {
+            'project': client.project_configuration[job]['project'],
+            'job_duration_avg': section['summary']['job_duration_avg'],
+            'outcome_count': section['summary']['outcome_count'],
+        }})
+        print('Output written to LOG file', end='\n\n')
+
+        return section
+
+    async def build_push(self, fetcher, client, queue, args, current_push, job_index, job, disabled_tests,
+                         watermark=None, stream=None):
+        """Build the (duration, record) entries of a section for a single push.
+
+        The records are written out (to the results store and the output
+        stream) as soon as the push is complete. Records written to the
+        results store are not returned: the store holds them instead.
+        """
+        # Superseded runs were already set aside by the job index
+        jobs = self.select_jobs(client, job_index, job, current_push, watermark)
+
+        for current_job in self.fetch_jobs(client, job_index, job, superseded=True):
+            print(f"Skipping {current_job['task_id']} run: {current_job['retry_id']} because there is a newer run of it.")
+
+        entries = []
+
+        if jobs:
+            job_logs = await fetcher.call(
+                fetcher.host(client.global_configuration['treeherder']['host']),
+                client.get_job_logs,
+                [current_job['id'] for current_job in jobs]
+            )
+
+            entries = await fetcher.gather([
+                self.build_job(
+                    fetcher, client, queue, args, current_push, job, current_job, disabled_tests,
+                    ' '.join(map(str, job_logs.get(current_job['id'], [])))
+                )
+                for current_job in jobs
+            ])
+
+            entries = [entry for entry in entries if entry is not None]
+
+        if stream:
+            stream.add(current_push['id'], [record for _, record in entries])
+
+        if self.store:
+            if entries:
+                self.store.add_records(
+                    args.project, job, client.project_configuration[job]['symbol'], current_push, entries
+                )
+            return []
+
+        return entries
+
+    async def build_job(self, fetcher, client, queue, args, current_push, job, current_job, disabled_tests,
+                        current_job_log):
+        """Build the (duration, record) entry of a single job, or None if it is unavailable."""
+        from taskcluster.exceptions import TaskclusterRestFailure
+
+        taskcluster_host = fetcher.host(client.global_configuration['taskcluster']['host'])
+
+        matrix_outcome_details = None
+        matrix_general_details = {}
+        test_details = []
+
+        # TaskCluster
+        try:
+            # Dependent on public artifact visibility
+            if (re.compile("^(ui-|robo|legacy|experimental|smoke){1}.*")).search(
+                client.project_configuration[job]['symbol']
+            ):
+                # Matrix (i.e, matrix_ids.json) generated from Flank
+                matrix_artifact = await self.fetch_artifact(
+                    fetcher, client, queue, current_job,
+                    client.global_configuration['artifacts']['matrix']
+                )
+
+                if matrix_artifact is not None:
+                    for value in matrix_artifact.values():
+                        matrix_general_details = {
+                            "webLink": value['webLink'],
+                            "gcsPath": value['gcsPath'],
+                            "matrixId": value['matrixId'],
+                            "isRoboTest": value['isRoboTest'],
+                        }
+                        matrix_outcome_details = value['axes']
+
+                # Disabled tests (if requested) [TODO: append to dataset or output to file]
+                if args.disabled_tests:
+                    shard_artifact = await self.fetch_artifact(
+                        fetcher, client, queue, current_job,
+                        client.global_configuration['artifacts']['shards']
+                    )
+
+                    if shard_artifact is not None:
+                        for value in shard_artifact.values():
+                            disabled_tests.update(value['junit-ignored'])
+                else:
+                    pass
+
+                # JUnitReport (i.e, FullJUnitReport.xml), streamed to extract the test details
+                try:
+                    test_details.extend(await self.fetch_artifact(
+                        fetcher, client, queue, current_job,
+                        client.global_configuration['artifacts']['report'],
+                        decoder=read_problem_tests,
+                        parse=True
+                    ))
+                except DecodeError as err:
+                    logger.error(f"Error reading JUnit report for {current_job['task_id']}: {err}")
+
+                # For Robo Tests, as of now, there are no artifacts exposing details
+                # about the outcome (e.g, crash details), so we have to write a custom outcome
+                if matrix_general_details['isRoboTest'] is True:
+                    if matrix_outcome_details is not None:
+                        for axis in matrix_outcome_details:
+                            if axis['outcome'] == 'failure':
+                                test_details.append({
+                                    'name': axis['device'],
+                                    'result': 'failure',
+                                    'details': axis['details']
+                                })
+            else:
+                pass
+
+        except (TaskclusterRestFailure, TransportError) as err:
+            # Abort iteration on current job, continue to next job
+            print(f"Artifact(s) not available for {current_job['task_id']}")
+            logger.error(f"Artifact(s) not available for {current_job['task_id']}: {err}")
+            return None
+
+        # Fetch Github or Mercurial associative data from the TaskCluster task
+        # Mercurial (i.e, commit details)
+        hg_projects = [project.strip() for project in client.global_configuration['hg']['projects'].split(',')]
+
+        if args.project in hg_projects:
+            repo, revision = await fetcher.call(taskcluster_host, self.fetch_hg, current_job, queue)
+            html_url = f"{repo.scheme}://{repo.netloc}/{repo.path}/rev/{revision}" if repo else None
+            metadata = self.hg_metadata.get(current_push, repo, revision) if revision else None
+            title = metadata['comments'] if metadata else None
+        else:
+            # Github (i.e, pull request details, or the commit's when there is none)
+            commit = await fetcher.call(
+                fetcher.host(self.github.requester.base_url), self.fetch_github, current_job, queue
+            )
+            revision = commit['sha'] if commit else None
+            html_url = (commit['pull_request'] or commit)['html_url'] if commit else None
+            title = (commit['pull_request']['title'] if commit['pull_request'] else commit['message']) \
+                if commit else None
+
+        # Stitch together dataset from TaskCluster and Github results
+        dt_obj_start = datetime.fromtimestamp(current_job['start_timestamp'])
+        dt_obj_end = datetime.fromtimestamp(current_job['end_timestamp'])
+
+        duration = (dt_obj_end - dt_obj_start).total_seconds() / 60
+        record = {
+            'push_id': current_push['id'],
+            'task_id': current_job['task_id'],
+            'duration': '{0:.0f}'.format(duration),
+            'author': current_job['who'],
+            'result': current_job['result'],
+            'task_html_url': '{0}'.format(''.join(
+                [client.global_configuration['taskcluster']['host'], '/tasks/',
+                    current_job['task_id']]
+            )),
+            'last_modified': current_job['last_modified'],
+            'retry_id': current_job['retry_id'],
+            'task_log': current_job_log,
+            'matrix_general_details': matrix_general_details,
+            'matrix_outcome_details': matrix_outcome_details,
+            'revision': revision,
+            'pullreq_html_url': html_url,
+            'pullreq_html_title': title,
+            'problem_test_details': test_details,
+            'pushlog': self.construct_pushlog(client, args.project, revision)
+        }
+
+        # The fields of a job are only gathered when they are logged
+        if logger.isEnabledFor(logging.INFO):
+            logger.info('Job: %s', current_job['task_id'], extra={'fields': {
+                'duration': round(duration),
+                **{key: record[key] for key in (
+                    'author', 'result', 'task_html_url', 'last_modified', 'task_log', 'revision',
+                    'pullreq_html_url', 'pullreq_html_title', 'pushlog'
+                )},
+                'matrix_details': [axis['details'] for axis in matrix_outcome_details or []],
+                'matrix_outcomes': [axis['outcome'] for axis in matrix_outcome_details or []],
+                'matrix_web_link': matrix_general_details.get('webLink'),
+                'matrix_id': matrix_general_details.get('matrixId'),
+                'problem_test_details': test_details,
+            }})
+
+        return duration, record
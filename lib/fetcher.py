@@ -0,0 +1,143 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+'''Asynchronous fetch engine for fanning out upstream requests'''
+
+import asyncio
+import functools
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import urlparse
+
+
+class AsyncFetcher:
+    '''Run upstream calls concurrently with a bounded per-host limit.
+
+    The Treeherder, Taskcluster and Github clients are blocking, so their
+    calls are dispatched to a thread pool; artifacts are downloaded through
+    the asynchronous side of the shared transport. Every call holds a
+    per-host semaphore, so no single service ever sees more than
+    `concurrency` requests in flight. CPU-bound parsing of downloaded
+    artifacts can be moved off the event loop to a pool of
+    `parse_workers` processes.
+
+    With `metrics`, every call and parse is timed as a phase named after
+    the function run (excluding the wait for a slot), and every download
+    as a request to its endpoint. With `profiler`, the calls are profiled
+    in the threads running them.
+    '''
+
+    # Threads available per unit of concurrency (Treeherder, Taskcluster,
+    # artifacts and Github can all be busy at the same time)
+    THREADS_PER_SLOT = 4
+
+    def __init__(self, concurrency=1, transport=None, parse_workers=0, metrics=None, profiler=None):
+        from lib.transport import Transport
+
+        self.concurrency = max(1, int(concurrency))
+        self.metrics = metrics
+        self.profiler = profiler
+        self.transport = transport or Transport(pool_size=self.concurrency, metrics=metrics)
+        self.parse_workers = max(0, int(parse_workers))
+        self.semaphores = {}
+        self.executor = None
+        self.parser = None
+
+    async def __aenter__(self):
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.concurrency * self.THREADS_PER_SLOT
+        )
+        if self.parse_workers:
+            # Spawned (rather than forked) workers do not inherit the threads
+            # and open connections of this process
+            self.parser = ProcessPoolExecutor(
+                max_workers=self.parse_workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        await self.transport.open()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.transport.close()
+        self.executor.shutdown(wait=True)
+        if self.parser is not None:
+            self.parser.shutdown(wait=True)
+
+    @staticmethod
+    def host(url):
+        return urlparse(url).netloc
+
+    def semaphore(self, host):
+        '''Return the semaphore bounding requests to a host.'''
+        if host not in self.semaphores:
+            self.semaphores[host] = asyncio.Semaphore(self.concurrency)
+        return self.semaphores[host]
+
+    @staticmethod
+    def phase(func):
+        '''Return the name under which the calls of a function are measured.'''
+        func = getattr(func, 'func', func)
+        return getattr(func, '__qualname__', type(func).__name__)
+
+    async def call(self, host, func, *args, **kwargs):
+        '''Run a blocking client call in the thread pool.'''
+        run = functools.partial(func, *args, **kwargs)
+        if self.profiler is not None:
+            run = self.profiler.wrap(run)
+
+        async with self.semaphore(host):
+            loop = asyncio.get_running_loop()
+            if self.metrics is None:
+                return await loop.run_in_executor(self.executor, run)
+
+            with self.metrics.measure('phases', self.phase(func)):
+                return await loop.run_in_executor(self.executor, run)
+
+    async def parse(self, func, *args, **kwargs):
+        '''Run a CPU-bound (picklable) parser in the process pool, or inline without one.'''
+        if self.metrics is None:
+            return await self.run_parser(func, *args, **kwargs)
+
+        with self.metrics.measure('phases', self.phase(func)):
+            return await self.run_parser(func, *args, **kwargs)
+
+    async def run_parser(self, func, *args, **kwargs):
+        if self.parser is None:
+            return func(*args, **kwargs)
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.parser, functools.partial(func, *args, **kwargs)
+        )
+
+    async def download(self, url, headers=None):
+        '''Download a URL, returning (content type, raw body).'''
+        async with self.semaphore(self.host(url)):
+            if self.metrics is None:
+                return await self.transport.download(url, headers=headers)
+
+            from lib.metrics import endpoint
+
+            start = time.perf_counter()
+            try:
+                content_type, body = await self.transport.download(url, headers=headers)
+            except Exception:
+                self.metrics.record('endpoints', endpoint(url), time.perf_counter() - start, error=True)
+                raise
+
+            self.metrics.record('endpoints', endpoint(url), time.perf_counter() - start, len(body))
+            return content_type, body
+
+    async def gather(self, coros):
+        '''Await coroutines and return their results in order.
+
+        With a concurrency of 1 the coroutines are awaited one after the
+        other, reproducing a fully sequential run.
+        '''
+        if self.concurrency == 1:
+            return [await coro for coro in coros]
+        return await asyncio.gather(*coros)
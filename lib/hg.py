@@ -0,0 +1,144 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+'''Per-run index of Mercurial revision metadata'''
+
+import json
+import logging
+import os
+import re
+
+from lib.transport import TransportError
+
+logger = logging.getLogger(__name__)
+
+BUG_PATTERN = re.compile(r'\bbug[\s-]*(\d+)', re.IGNORECASE)
+
+
+class HgMetadata:
+    '''Revision metadata (comments, author, bug numbers) of hg projects
+
+    Each push's revisions are indexed once, so looking a revision up never
+    scans the push again. Revisions a push does not carry are fetched from
+    hg in bulk: a single `[hg] pushes` (json-pushes) request returns every
+    changeset of the hg push containing a revision. They are never fetched
+    twice, and kept in a persistent cache (keyed by their `[hg] json`, i.e.
+    json-rev, URL) since a revision's metadata never changes.
+    '''
+
+    def __init__(self, transport, endpoint='json-rev', pushes_endpoint='json-pushes', cache_path=None):
+        self.transport = transport
+        self.endpoint = endpoint
+        self.pushes_endpoint = pushes_endpoint
+        self.cache_path = cache_path
+        self.indexes = {}
+        self.cache = {}
+        self.failed = set()
+        self.fetched = 0
+        self.requests = 0
+
+        if self.cache_path:
+            try:
+                with open(self.cache_path, encoding='utf-8') as cache_file:
+                    self.cache = json.load(cache_file)
+            except FileNotFoundError:
+                pass
+            except json.JSONDecodeError:
+                print(f'Ignoring unreadable hg cache [{self.cache_path}]')
+
+    @classmethod
+    def from_config(cls, transport, config, cache=True):
+        '''Create the index from the [hg] section of the global configuration (without its cache file unless `cache`)'''
+        return cls(
+            transport,
+            endpoint=config.get('hg', 'json', fallback='json-rev'),
+            pushes_endpoint=config.get('hg', 'pushes', fallback='json-pushes'),
+            cache_path=config.get('cache', 'directory', fallback='.cache') + '/hg.json' if cache else None
+        )
+
+    @staticmethod
+    def describe(comments, author):
+        return {
+            'comments': comments,
+            'author': author,
+            'bugs': sorted({int(bug) for bug in BUG_PATTERN.findall(comments or '')}),
+        }
+
+    def url(self, repo, revision):
+        '''Return the json-rev URL of a revision of a (parsed) repository URL'''
+        return f"{repo.scheme}://{repo.netloc}/{repo.path.strip('/')}/{self.endpoint}/{revision}"
+
+    def pushes_url(self, repo, revision):
+        '''Return the json-pushes URL of the hg push (with all its changesets) containing a revision'''
+        return (f"{repo.scheme}://{repo.netloc}/{repo.path.strip('/')}/{self.pushes_endpoint}"
+                f"?full=1&changeset={revision}")
+
+    def index(self, push):
+        '''Return the revision index of a push, building it on first use'''
+        if push['id'] not in self.indexes:
+            self.indexes[push['id']] = {
+                revision['revision']: self.describe(revision['comments'], revision['author'])
+                for revision in push['revisions']
+            }
+
+        return self.indexes[push['id']]
+
+    def get(self, push, repo, revision):
+        '''Return the metadata of a revision from the push index or the cache, or None'''
+        metadata = self.index(push).get(revision)
+
+        if metadata is None and repo is not None:
+            metadata = self.cache.get(self.url(repo, revision))
+
+        return metadata
+
+    def prefetch(self, push, revisions):
+        '''Fetch the metadata of the (repository, revision) pairs a push does not carry
+
+        Every changeset of the hg push containing a missing revision is
+        cached at once, so revisions pushed together cost one request.
+        '''
+        for repo, revision in dict.fromkeys(revisions):
+            if self.get(push, repo, revision) is not None:
+                continue
+
+            url = self.url(repo, revision)
+
+            if url in self.failed:
+                continue
+
+            try:
+                self.requests += 1
+                data = self.transport.request('GET', self.pushes_url(repo, revision)).json()
+                changesets = [changeset for hg_push in data.values() for changeset in hg_push['changesets']]
+            except (TransportError, ValueError, AttributeError, KeyError, TypeError) as err:
+                logger.error(f'Error fetching Mercurial data for {revision}: {err}')
+                self.failed.add(url)
+                continue
+
+            for changeset in changesets:
+                self.cache[self.url(repo, changeset['node'])] = self.describe(
+                    changeset.get('desc'), changeset.get('author')
+                )
+            self.fetched += len(changesets)
+
+            if url not in self.cache:
+                logger.error(f'Error fetching Mercurial data for {revision}: not found in its push')
+                self.failed.add(url)
+
+    def save(self):
+        if not self.cache_path:
+            return
+
+        os.makedirs(os.path.dirname(self.cache_path) or '.', exist_ok=True)
+
+        with open(f'{self.cache_path}.tmp', 'w', encoding='utf-8') as cache_file:
+            json.dump(self.cache, cache_file)
+        os.replace(f'{self.cache_path}.tmp', self.cache_path)
+
+    def stats(self):
+        return (f'{sum(map(len, self.indexes.values()))} revisions indexed, '
+                f'{self.fetched} fetched in {self.requests} requests ({len(self.cache)} cached)')
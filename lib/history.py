@@ -0,0 +1,188 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+'''Flakiness scoring over the datasets of many daily runs'''
+
+import numpy as np
+
+from lib.results import iter_sections
+
+
+class History:
+    '''Dense test x day and test x device matrices built from daily datasets
+
+    Every job record is counted once (daily windows may overlap) on the
+    day of its `last_modified` timestamp. A test is considered to run in
+    every job of the sections it appeared in, so its number of runs on a
+    day is the number of jobs of those sections on that day.
+    '''
+
+    def __init__(self, tests, days, devices, flaky, failure, runs, device_counts):
+        self.tests = tests
+        self.days = days
+        self.devices = devices
+        # test x day counts of flaky and failed occurrences, and of runs
+        self.flaky = flaky
+        self.failure = failure
+        self.runs = runs
+        # test x device counts of problem occurrences
+        self.device_counts = device_counts
+
+    @classmethod
+    def load(cls, paths):
+        '''Load the datasets (JSON or NDJSON) of many runs, of any project'''
+        tests, sections, devices = {}, {}, {}
+        seen = set()
+        # (test, day, device indexes, result) of every problem occurrence
+        occurrences = []
+        # (section, day) of every job
+        jobs = []
+        # (test, section) pairs the test appeared in
+        incidence = set()
+
+        for path in paths:
+            for section in iter_sections(path):
+                repo = section['summary']['repo']
+
+                for name, records in section.items():
+                    if name == 'summary':
+                        continue
+
+                    section_index = sections.setdefault((repo, name), len(sections))
+
+                    for record in records:
+                        if (repo, name, record['task_id']) in seen:
+                            continue
+                        seen.add((repo, name, record['task_id']))
+
+                        day = np.datetime64(record['last_modified'][:10], 'D')
+                        jobs.append((section_index, day))
+                        axes = [
+                            devices.setdefault(axis['device'], len(devices))
+                            for axis in record['matrix_outcome_details'] or [] if 'device' in axis
+                        ]
+
+                        for problem in record['problem_test_details']:
+                            test_index = tests.setdefault(problem['name'], len(tests))
+                            incidence.add((test_index, section_index))
+                            occurrences.append((test_index, day, axes, problem['result'] == 'flaky'))
+
+        if not jobs:
+            return cls([], np.array([], dtype='datetime64[D]'), [], *(np.zeros((0, 0), dtype=np.int64),) * 4)
+
+        first_day = min(day for _, day in jobs)
+        days = np.arange(first_day, max(day for _, day in jobs) + 1)
+
+        job_counts = np.zeros((len(sections), len(days)), dtype=np.int64)
+        job_sections, job_days = zip(*jobs)
+        np.add.at(job_counts, (np.array(job_sections), (np.array(job_days) - first_day).astype(np.int64)), 1)
+
+        sections_of_tests = np.zeros((len(tests), len(sections)), dtype=np.int64)
+        if incidence:
+            sections_of_tests[tuple(np.array(sorted(incidence)).T)] = 1
+
+        flaky = np.zeros((len(tests), len(days)), dtype=np.int64)
+        failure = np.zeros((len(tests), len(days)), dtype=np.int64)
+        device_counts = np.zeros((len(tests), len(devices)), dtype=np.int64)
+
+        if occurrences:
+            test_indexes = np.array([test for test, _, _, _ in occurrences])
+            day_indexes = (np.array([day for _, day, _, _ in occurrences]) - first_day).astype(np.int64)
+            is_flaky = np.array([result for _, _, _, result in occurrences])
+            np.add.at(flaky, (test_indexes[is_flaky], day_indexes[is_flaky]), 1)
+            np.add.at(failure, (test_indexes[~is_flaky], day_indexes[~is_flaky]), 1)
+
+            device_pairs = [(test, device) for test, _, axes, _ in occurrences for device in axes]
+            if device_pairs:
+                np.add.at(device_counts, tuple(np.array(device_pairs).T), 1)
+
+        return cls(
+            list(tests), days, list(devices), flaky, failure,
+            sections_of_tests @ job_counts, device_counts
+        )
+
+    def window(self, days=None):
+        '''Return the column slice of the last `days` days (all of them with None)'''
+        return slice(max(0, len(self.days) - days) if days else 0, len(self.days))
+
+    def scores(self, days=None):
+        '''Score every test over the last `days` days, as a dict of per-test arrays
+
+        Rates are problem occurrences per run; streaks count consecutive
+        days with at least one problem occurrence; the trend is the slope
+        (per day) of the daily problem rate, fitted over the days it ran.
+        '''
+        columns = self.window(days)
+        flaky, failure, runs = self.flaky[:, columns], self.failure[:, columns], self.runs[:, columns]
+        problems = flaky + failure
+        total_runs = runs.sum(axis=1)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            flake_rate = np.where(total_runs > 0, flaky.sum(axis=1) / total_runs, 0.0)
+            failure_rate = np.where(total_runs > 0, failure.sum(axis=1) / total_runs, 0.0)
+            daily_rate = np.where(runs > 0, problems / runs, 0.0)
+
+        longest_streak, current_streak = self.streaks(problems > 0)
+
+        # Weighted least squares slope of the daily rate over the days each test ran
+        ran = (runs > 0).astype(np.float64)
+        x = np.arange(problems.shape[1], dtype=np.float64)
+        count = ran.sum(axis=1)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_mean = np.where(count > 0, (ran * x).sum(axis=1) / count, 0.0)
+            y_mean = np.where(count > 0, (ran * daily_rate).sum(axis=1) / count, 0.0)
+            dx = (x - x_mean[:, None]) * ran
+            variance = (dx * dx).sum(axis=1)
+            trend = np.where(variance > 0, (dx * (daily_rate - y_mean[:, None])).sum(axis=1) / variance, 0.0)
+
+        return {
+            'flaky': flaky.sum(axis=1),
+            'failure': failure.sum(axis=1),
+            'runs': total_runs,
+            'flake_rate': flake_rate,
+            'failure_rate': failure_rate,
+            'longest_streak': longest_streak,
+            'current_streak': current_streak,
+            'trend': trend,
+        }
+
+    @staticmethod
+    def streaks(active):
+        '''Return the longest and the current (ending on the last day) streak of each row'''
+        longest = np.zeros(active.shape[0], dtype=np.int64)
+        current = np.zeros(active.shape[0], dtype=np.int64)
+
+        if not active.size:
+            return longest, current
+
+        edges = np.diff(np.pad(active.astype(np.int8), ((0, 0), (1, 1))), axis=1)
+        starts, ends = np.argwhere(edges == 1), np.argwhere(edges == -1)
+        lengths = ends[:, 1] - starts[:, 1]
+
+        np.maximum.at(longest, starts[:, 0], lengths)
+        ongoing = ends[:, 1] == active.shape[1]
+        current[starts[ongoing, 0]] = lengths[ongoing]
+
+        return longest, current
+
+    def top_flaky(self, count=10, days=90, min_runs=1):
+        '''Return the tests with the highest flake rate over the last `days` days'''
+        scores = self.scores(days)
+        candidates = np.flatnonzero((scores['flaky'] > 0) & (scores['runs'] >= min_runs))
+        # Highest flake rate first, then most flaky occurrences
+        ranked = candidates[np.lexsort((-scores['flaky'][candidates], -scores['flake_rate'][candidates]))][:count]
+
+        return [
+            {
+                'name': self.tests[index],
+                **{key: values[index].item() for key, values in scores.items()},
+                'devices': [
+                    self.devices[device] for device in np.flatnonzero(self.device_counts[index])
+                ],
+            }
+            for index in ranked
+        ]
@@ -0,0 +1,69 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+'''Streaming extraction of failing and flaky tests from JUnit reports'''
+
+import zlib
+from xml.etree.ElementTree import ParseError, iterparse
+
+from lib.transport import DecodeError, open_compressed
+
+
+def extract_problem_tests(stream):
+    '''Extract failing and flaky test cases from a JUnit XML stream.
+
+    The report is parsed incrementally and every test case (and suite) is
+    discarded as soon as it has been read, so memory stays flat however
+    big the report is. Only <failure> entries are reported; a failure is
+    skipped when its text is identical to the previous failure of the
+    same test case.
+    '''
+    test_details = []
+    # Dictionary to store the last seen failure details for each test case
+    last_seen_failures = {}
+    parents = []
+
+    for event, elem in iterparse(stream, events=('start', 'end')):
+        if event == 'start':
+            parents.append(elem)
+            continue
+
+        parents.pop()
+
+        if elem.tag == 'testcase':
+            result_type = "flaky" if elem.get('flaky', 'false') == 'true' else "failure"
+            test_id = "%s#%s" % (elem.get('classname'), elem.get('name'))
+
+            for entry in elem.iterfind('failure'):
+                if entry.text != last_seen_failures.get(test_id, ""):
+                    test_details.append(
+                        {
+                            "name": elem.get('name'),
+                            "result": result_type,
+                            "details": entry.text,
+                        }
+                    )
+                last_seen_failures[test_id] = entry.text
+
+        if elem.tag in ('testcase', 'testsuite') and parents:
+            parents[-1].remove(elem)
+            elem.clear()
+
+    return test_details
+
+
+def read_problem_tests(content_type, body, url=None):
+    '''Extract failing and flaky test cases from a raw (gzip-compressed) report.'''
+    if content_type != 'application/xml':
+        raise DecodeError(url, f'Unknown artifact type {content_type}')
+
+    try:
+        with open_compressed(body) as stream:
+            return extract_problem_tests(stream)
+    except ParseError as err:
+        raise DecodeError(url, f'Error parsing XML data: {err}') from err
+    except (OSError, EOFError, zlib.error) as err:
+        raise DecodeError(url, f'Error decompressing data: {err}') from err
@@ -0,0 +1,57 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+'''Logging setup shared by the modules of a run, as JSON lines written from a background thread'''
+
+import json
+import logging
+from datetime import datetime, timezone
+
+LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL')
+
+
+class JsonFormatter(logging.Formatter):
+    '''Format a record as a JSON object, merged with the `fields` it was logged with'''
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+
+        return json.dumps(entry, default=str)
+
+
+def setup_logging(level='INFO', path='output.log'):
+    '''Log every module to `path` as JSON lines
+
+    Records are only put on a queue by the thread logging them; a
+    listener thread formats and writes them, and is stopped (flushing
+    the queue) at exit. The file is created on the first record.
+    Pass expensive fields as `extra={'fields': {...}}` behind
+    `logger.isEnabledFor(...)`, so they are only built when logged.
+    '''
+    import atexit
+    import queue
+    from logging.handlers import QueueHandler, QueueListener
+
+    handler = logging.FileHandler(path, mode='w', encoding='utf-8', delay=True)
+    handler.setFormatter(JsonFormatter())
+
+    records = queue.SimpleQueue()
+    listener = QueueListener(records, handler)
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(QueueHandler(records))
+
+    listener.start()
+    atexit.register(listener.stop)
+
+    return listener
@@ -0,0 +1,226 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+'''Latency histograms and call counts of upstream endpoints and pipeline phases'''
+
+import bisect
+import json
+import os
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from requests.adapters import HTTPAdapter
+
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float('inf'))
+
+# Path segments replaced by {id} in endpoint names: numbers, Taskcluster
+# slugs and commit hashes
+ID_SEGMENT = re.compile(r'^(\d+|[A-Za-z0-9_-]{22}|[0-9a-f]{12,40})$')
+
+
+def endpoint(url):
+    '''Return the name of the endpoint of a URL, e.g. host/api/queue/v1/task/{id}'''
+    parts = urlsplit(url)
+    return parts.netloc + '/'.join(
+        '{id}' if ID_SEGMENT.match(segment) else segment for segment in parts.path.split('/')
+    )
+
+
+class Series:
+    '''Latency samples of one endpoint or phase, with byte and error counts'''
+
+    def __init__(self):
+        self.samples = []
+        self.errors = 0
+        self.bytes = 0
+
+    def add(self, seconds, size=0, error=False):
+        self.samples.append(seconds)
+        self.bytes += size
+        self.errors += error
+
+    def summary(self):
+        samples = sorted(self.samples)
+        histogram = [0] * len(BUCKETS)
+
+        for seconds in samples:
+            histogram[bisect.bisect_left(BUCKETS, seconds)] += 1
+
+        def percentile(rank):
+            return samples[min(len(samples) - 1, int(rank * len(samples)))] if samples else 0
+
+        return {
+            'count': len(samples),
+            'errors': self.errors,
+            'bytes': self.bytes,
+            'total': sum(samples),
+            'mean': sum(samples) / len(samples) if samples else 0,
+            'min': samples[0] if samples else 0,
+            'p50': percentile(0.5),
+            'p90': percentile(0.9),
+            'p99': percentile(0.99),
+            'max': samples[-1] if samples else 0,
+            'histogram': {
+                f'le_{bound}': count for bound, count in zip(BUCKETS, histogram) if count
+            },
+        }
+
+
+class Metrics:
+    '''Thread-safe latency series of upstream endpoints, phases and stages of a run
+
+    Endpoints are single HTTP requests (named by `endpoint`), phases are
+    the client calls, downloads and parses of the fetcher (named after
+    the function called), and stages are the steps of a project build.
+    '''
+
+    KINDS = ('endpoints', 'phases', 'stages')
+
+    def __init__(self):
+        self.series = {kind: {} for kind in self.KINDS}
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+
+    def record(self, kind, name, seconds, size=0, error=False):
+        with self.lock:
+            self.series[kind].setdefault(name, Series()).add(seconds, size, error)
+
+    @contextmanager
+    def measure(self, kind, name):
+        '''Time a block, counting it as an error if it raises'''
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.record(kind, name, time.perf_counter() - start, error=True)
+            raise
+        self.record(kind, name, time.perf_counter() - start)
+
+    def summary(self):
+        with self.lock:
+            return {
+                'wall': time.perf_counter() - self.start,
+                **{
+                    kind: dict(sorted(
+                        ((name, series.summary()) for name, series in self.series[kind].items()),
+                        key=lambda item: -item[1]['total']
+                    ))
+                    for kind in self.KINDS
+                },
+            }
+
+    def save(self, path):
+        summary = self.summary()
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as metrics_file:
+            json.dump(summary, metrics_file, indent=4)
+
+        return summary
+
+    @staticmethod
+    def report(summary, top=10):
+        '''Return the top `top` endpoints, phases and stages by total time, as text'''
+        lines = [f"Run took {summary['wall']:.1f}s"]
+
+        for kind in Metrics.KINDS:
+            if not summary[kind]:
+                continue
+
+            lines.append(f'Top {kind} by total time:')
+            for name, series in list(summary[kind].items())[:top]:
+                lines.append(
+                    f"  {series['total']:8.2f}s {series['count']:7} calls  p50 {series['p50'] * 1000:7.1f}ms  "
+                    f"p99 {series['p99'] * 1000:8.1f}ms  {series['bytes'] / 2 ** 20:8.1f} MiB"
+                    f"{'  ' + str(series['errors']) + ' errors' if series['errors'] else ''}  {name}"
+                )
+
+        return '\n'.join(lines)
+
+
+class MeasuredAdapter(HTTPAdapter):
+    '''Connection-pooling adapter recording the latency and size of every response'''
+
+    def __init__(self, metrics, **kwargs):
+        self.metrics = metrics
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        start = time.perf_counter()
+
+        try:
+            response = super().send(request, **kwargs)
+            # Read the body here (unless streamed) so that its transfer is timed too
+            size = int(response.headers.get('Content-Length') or 0) if kwargs.get('stream') \
+                else len(response.content)
+        except Exception:
+            self.metrics.record('endpoints', endpoint(request.url), time.perf_counter() - start, error=True)
+            raise
+
+        self.metrics.record(
+            'endpoints', endpoint(request.url), time.perf_counter() - start, size, response.status_code >= 400
+        )
+        return response
+
+
+class Profiler:
+    '''cProfile over the main thread and every thread running a wrapped call
+
+    Up to Python 3.11, a profile only sees the thread that enabled it, so
+    each worker thread gets its own profile and they are merged when
+    dumped. From 3.12 on, a single profile sees every thread.
+    '''
+
+    def __init__(self):
+        import cProfile
+
+        self.main = cProfile.Profile()
+        self.per_thread = sys.version_info < (3, 12)
+        self.profiles = []
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def wrap(self, func):
+        '''Return `func` profiled in the thread that runs it'''
+        if not self.per_thread:
+            return func
+
+        def profiled(*args, **kwargs):
+            import cProfile
+
+            profile = getattr(self.local, 'profile', None)
+            if profile is None:
+                profile = self.local.profile = cProfile.Profile()
+                with self.lock:
+                    self.profiles.append(profile)
+
+            profile.enable()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profile.disable()
+
+        return profiled
+
+    def dump(self, path):
+        import pstats
+
+        stats = pstats.Stats(self.main)
+        for profile in self.profiles:
+            stats.add(profile)
+        stats.dump_stats(path)
+
+    def __enter__(self):
+        self.main.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.main.disable()
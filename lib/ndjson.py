@@ -0,0 +1,117 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+'''Streaming NDJSON output of the datasets built by `client.py`'''
+
+import gzip
+import json
+import zlib
+
+SUFFIXES = ('.ndjson', '.ndjson.gz')
+
+
+def is_ndjson(path):
+    return str(path).endswith(SUFFIXES)
+
+
+def open_ndjson(path, mode='rt'):
+    '''Open an NDJSON file, gzip-compressed if its name ends with .gz'''
+    if str(path).endswith('.gz'):
+        return gzip.open(path, mode, encoding='utf-8')
+
+    return open(path, mode, encoding='utf-8')
+
+
+def read_lines(path):
+    '''Yield the objects of an NDJSON file, stopping at a truncated end
+
+    A run that was interrupted leaves a file whose last line (or gzip
+    stream) is incomplete; everything before it is still read.
+    '''
+    with open_ndjson(path) as lines:
+        try:
+            for line in lines:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    return
+        except (EOFError, zlib.error):
+            return
+
+
+class NdjsonWriter:
+    '''Write one line per dataset record, and a summary line per section
+
+    Record lines are `{"section": name, "record": {...}}` and summary lines
+    `{"section": name, "index": position, "summary": {...}}`, where the
+    index is the position of the section in the project configuration.
+    The file is flushed after every push, so a partial run stays readable.
+    '''
+
+    def __init__(self, path, sections):
+        self.path = path
+        self.sections = list(sections)
+        self.file = open_ndjson(path, 'wt')
+
+    def section(self, name, push_ids, previous=None):
+        return SectionStream(self, name, push_ids, previous)
+
+    def write(self, line):
+        self.file.write(json.dumps(line) + '\n')
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class SectionStream:
+    '''Write the records of a section in push order as pushes complete
+
+    Pushes may complete in any order; a push is written once every push
+    before it was. In incremental runs, the records of the previous run
+    that were not fetched again are written along with their push, as
+    `data_builder.merge_datasets` orders them.
+    '''
+
+    def __init__(self, writer, name, push_ids, previous=None):
+        self.writer = writer
+        self.name = name
+        self.push_ids = list(push_ids)
+        self.pending = {}
+        self.written = 0
+        self.previous = {}
+
+        for record in previous or []:
+            self.previous.setdefault(record['push_id'], []).append(record)
+
+    def add(self, push_id, records):
+        self.pending[push_id] = records
+
+        while self.written < len(self.push_ids) and self.push_ids[self.written] in self.pending:
+            self.write_push(self.push_ids[self.written], self.pending.pop(self.push_ids[self.written]))
+            self.written += 1
+
+        self.writer.flush()
+
+    def write_push(self, push_id, records):
+        task_ids = {record['task_id'] for record in records}
+        kept = [record for record in self.previous.pop(push_id, []) if record['task_id'] not in task_ids]
+
+        for record in kept + records:
+            self.writer.write({'section': self.name, 'record': record})
+
+    def close(self, summary):
+        '''Write the remaining previous records and the summary of the section'''
+        oldest_push_id = self.push_ids[0] if self.push_ids else 0
+
+        for push_id in sorted(self.previous):
+            if push_id >= oldest_push_id:
+                self.write_push(push_id, [])
+
+        self.writer.write({'section': self.name, 'index': self.writer.sections.index(self.name), 'summary': summary})
+        self.writer.flush()
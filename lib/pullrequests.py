@@ -0,0 +1,207 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+'''Resolution of Github commits to the pull request that introduced them'''
+
+import json
+import logging
+import os
+
+from github import GithubException
+
+logger = logging.getLogger(__name__)
+
+COMMITS_QUERY = '''
+query {{
+  rateLimit {{ cost }}
+  repository(owner: "{owner}", name: "{name}") {{
+    {commits}
+  }}
+}}
+'''
+
+COMMIT_FRAGMENT = '''
+    c{index}: object(oid: "{sha}") {{
+      ... on Commit {{
+        oid
+        url
+        message
+        associatedPullRequests(first: 1) {{ nodes {{ title url }} }}
+      }}
+    }}
+'''
+
+
+class PullRequestResolver:
+    '''Resolve (repository, sha) pairs to their commit and pull request
+
+    Resolutions are memoized for the run, and those with a pull request
+    are also kept in a persistent cache, since a merged commit never
+    changes. Many commits can be resolved at once with batched GraphQL
+    queries. Resolutions are dicts of the commit `sha`, `html_url` and
+    `message`, and of its `pull_request` (`title`, `html_url`) or None.
+    '''
+
+    def __init__(self, github, cache_path=None, batch_size=50):
+        self.github = github
+        self.cache_path = cache_path
+        self.batch_size = batch_size
+        self.memo = {}
+        self.graphql_cost = 0
+        self.rate_limit = None
+        self.cache = {}
+
+        if self.cache_path:
+            try:
+                with open(self.cache_path, encoding='utf-8') as cache_file:
+                    self.cache = json.load(cache_file)
+            except FileNotFoundError:
+                pass
+            except json.JSONDecodeError:
+                print(f'Ignoring unreadable Github cache [{self.cache_path}]')
+
+    @classmethod
+    def from_config(cls, github, config, cache=True):
+        '''Create the resolver from the [github] section of the global configuration (without its cache file unless `cache`)'''
+        return cls(
+            github,
+            cache_path=config.get('cache', 'directory', fallback='.cache') + '/github.json' if cache else None,
+            batch_size=config.getint('github', 'batch_size', fallback=50)
+        )
+
+    @staticmethod
+    def key(repo, sha):
+        return f'{repo}@{sha}'
+
+    def known(self, repo, sha):
+        '''Whether a commit was already resolved, in this run or a previous one'''
+        return self.key(repo, sha) in self.memo or self.key(repo, sha) in self.cache
+
+    def lookup(self, repo, sha):
+        '''Return a memoized or cached resolution, or None'''
+        key = self.key(repo, sha)
+
+        if key not in self.memo and key in self.cache:
+            self.memo[key] = self.cache[key]
+
+        return self.memo.get(key)
+
+    def store(self, repo, sha, resolution):
+        key = self.key(repo, sha)
+        self.memo[key] = resolution
+
+        if resolution and resolution['pull_request']:
+            self.cache[key] = resolution
+
+    def resolve(self, repo, sha):
+        '''Resolve a single commit, through the REST API if it is not known yet'''
+        if self.known(repo, sha):
+            return self.lookup(repo, sha)
+
+        try:
+            commit = self.github.get_repo(repo).get_commit(sha)
+            pulls = commit.get_pulls()
+            pull_request = pulls[0] if pulls is not None and pulls.totalCount > 0 else None
+        except GithubException as err:
+            logger.error(f"Error fetching Github data for {repo}@{sha}: {err}")
+            self.store(repo, sha, None)
+            return None
+
+        self.store(repo, sha, {
+            'sha': commit.sha,
+            'html_url': commit.html_url,
+            'message': commit.commit.message,
+            'pull_request': {
+                'title': pull_request.title,
+                'html_url': pull_request.html_url,
+            } if pull_request else None,
+        })
+
+        return self.lookup(repo, sha)
+
+    def resolve_many(self, commits):
+        '''Resolve many (repository, sha) pairs with batched GraphQL queries'''
+        pending = {}
+
+        for repo, sha in dict.fromkeys(commits):
+            if not self.known(repo, sha):
+                pending.setdefault(repo, []).append(sha)
+
+        for repo, shas in pending.items():
+            for start in range(0, len(shas), self.batch_size):
+                self.query_commits(repo, shas[start:start + self.batch_size])
+
+    def query_commits(self, repo, shas):
+        owner, name = repo.split('/', 1)
+        query = COMMITS_QUERY.format(
+            owner=owner,
+            name=name,
+            commits=''.join(COMMIT_FRAGMENT.format(index=index, sha=sha) for index, sha in enumerate(shas))
+        )
+
+        try:
+            _, data = self.github.requester.graphql_query(query, {})
+        except GithubException as err:
+            # Leave these commits to be resolved one by one
+            logger.error(f"Error querying Github commits of {repo}: {err}")
+            return
+
+        self.graphql_cost += data['data']['rateLimit']['cost']
+        commits = data['data']['repository'] or {}
+
+        for index, sha in enumerate(shas):
+            commit = commits.get(f'c{index}')
+
+            if not commit:
+                continue
+
+            pulls = commit['associatedPullRequests']['nodes']
+            self.store(repo, sha, {
+                'sha': commit['oid'],
+                'html_url': commit['url'],
+                'message': commit['message'],
+                'pull_request': {
+                    'title': pulls[0]['title'],
+                    'html_url': pulls[0]['url'],
+                } if pulls else None,
+            })
+
+    def remaining_rate_limit(self):
+        '''Return the remaining (REST, GraphQL) rate-limit budget'''
+        resources = self.github.get_rate_limit().resources
+        return resources.core.remaining, resources.graphql.remaining
+
+    def start(self):
+        '''Record the rate-limit budget at the start of the run'''
+        try:
+            self.rate_limit = self.remaining_rate_limit()
+        except GithubException as err:
+            logger.error(f"Error fetching Github rate limit: {err}")
+
+    def save(self):
+        if not self.cache_path:
+            return
+
+        os.makedirs(os.path.dirname(self.cache_path) or '.', exist_ok=True)
+
+        with open(f'{self.cache_path}.tmp', 'w', encoding='utf-8') as cache_file:
+            json.dump(self.cache, cache_file)
+        os.replace(f'{self.cache_path}.tmp', self.cache_path)
+
+    def stats(self):
+        '''Describe how much rate-limit budget the run consumed'''
+        consumed = ''
+
+        if self.rate_limit is not None:
+            try:
+                rest, graphql = self.remaining_rate_limit()
+                consumed = (f'{self.rate_limit[0] - rest} REST and '
+                            f'{self.rate_limit[1] - graphql} GraphQL rate-limit points consumed, ')
+            except GithubException as err:
+                logger.error(f"Error fetching Github rate limit: {err}")
+
+        return (f'{consumed}{self.graphql_cost} GraphQL query cost, '
+                f'{len(self.memo)} commits resolved ({len(self.cache)} cached)')
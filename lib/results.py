@@ -0,0 +1,59 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+'''Readers of the datasets built by `client.py`'''
+
+import json
+
+from lib.ndjson import is_ndjson, read_lines
+
+
+def iter_sections(path='output.json', db=None, problems_only=False):
+    '''Yield the sections of a dataset, from its JSON or NDJSON file or from a results store
+
+    Every section is a dict of the section's records, keyed by its name,
+    and of its `summary`. Reading from the store or from NDJSON with
+    `problems_only` only loads the jobs that have failing or flaky tests.
+    '''
+    if db is not None:
+        from lib.store import ResultsStore
+
+        store = ResultsStore(db)
+        try:
+            yield from store.sections(problems_only=problems_only)
+        finally:
+            store.close()
+        return
+
+    if is_ndjson(path):
+        yield from iter_ndjson_sections(path, problems_only)
+        return
+
+    with open(path, encoding='utf-8') as data_file:
+        yield from json.load(data_file)
+
+
+def iter_ndjson_sections(path, problems_only=False):
+    '''Yield the summarized sections of an NDJSON dataset, in configuration order
+
+    The file is read once for the summaries and once more per section, so
+    only the records of one section are held in memory at a time. Sections
+    of an interrupted run that have no summary yet are skipped.
+    '''
+    summaries = sorted(
+        (line for line in read_lines(path) if 'summary' in line),
+        key=lambda line: line['index']
+    )
+
+    for summary in summaries:
+        yield {
+            summary['section']: [
+                line['record'] for line in read_lines(path)
+                if line['section'] == summary['section'] and 'record' in line
+                and (line['record']['problem_test_details'] or not problems_only)
+            ],
+            'summary': summary['summary'],
+        }
@@ -0,0 +1,126 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+'''Rate-limited delivery of Slack webhook messages'''
+
+import json
+import logging
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Incoming webhooks accept about one message per second, with short bursts
+WEBHOOK_RATE = 1.0
+WEBHOOK_BURST = 3
+
+
+class SlackError(Exception):
+    '''A message could not be delivered'''
+
+
+class TokenBucket:
+    '''Thread-safe token bucket, which can also be paused (e.g. after a 429)'''
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        '''Wait until a token is available and take it'''
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        '''Hold every request back for a while, and drop the tokens saved up'''
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+
+class SlackDispatcher:
+    '''Post the messages of a section to a webhook, in order and within rate limits
+
+    Messages share a pooled session and a token bucket. A 429 response
+    pauses the bucket for its Retry-After delay and the message is sent
+    again. Server errors and network errors are retried with a backoff.
+    With `dry_run` set to a directory, each payload is written there as
+    a numbered JSON file instead of being posted.
+    '''
+
+    def __init__(self, webhook_url, rate=WEBHOOK_RATE, burst=WEBHOOK_BURST, retries=5, timeout=15,
+                 dry_run=None):
+        self.webhook_url = webhook_url
+        self.bucket = TokenBucket(rate, burst)
+        self.retries = retries
+        self.timeout = timeout
+        self.dry_run = dry_run
+        self.sent = 0
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_maxsize=burst))
+        self.session.mount('http://', HTTPAdapter(pool_maxsize=burst))
+
+        if self.dry_run:
+            os.makedirs(self.dry_run, exist_ok=True)
+
+    def post_all(self, payloads):
+        '''Post payloads one after the other, in order'''
+        for payload in payloads:
+            self.post(payload)
+
+    def post(self, payload):
+        if self.dry_run:
+            with open(os.path.join(self.dry_run, f'{self.sent:05d}.json'), 'w', encoding='utf-8') as payload_file:
+                json.dump(payload, payload_file)
+            self.sent += 1
+            return
+
+        for attempt in range(self.retries + 1):
+            self.bucket.acquire()
+
+            try:
+                response = self.session.post(url=str(self.webhook_url), json=payload, timeout=self.timeout)
+            except (requests.Timeout, requests.ConnectionError) as err:
+                if attempt == self.retries:
+                    logger.error(f"Slack request failed: {err}")
+                    raise SlackError(f'Slack request failed: {err}') from err
+                logger.warning(f"Retrying Slack request after {type(err).__name__}")
+                time.sleep(min(30, 2 ** attempt))
+                continue
+
+            if response.status_code == 429:
+                retry_after = float(response.headers.get('Retry-After', 1))
+                logger.warning(f"Slack rate limit reached, retrying in {retry_after}s")
+                self.bucket.pause(retry_after)
+            elif response.status_code >= 500 and attempt < self.retries:
+                logger.warning(f"Retrying Slack request after HTTP {response.status_code}")
+                time.sleep(min(30, 2 ** attempt))
+            elif response.status_code >= 400:
+                raise SlackError(f'Slack request failed: HTTP {response.status_code} {response.text}')
+            else:
+                self.sent += 1
+                return
+
+        raise SlackError('Slack request failed: rate limited too many times')
@@ -0,0 +1,62 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+'''Persisted state of incremental runs'''
+
+import json
+import os
+
+
+class IncrementalState:
+    '''Push and job watermarks recorded by previous incremental runs
+
+    For every project and configuration section the state holds the
+    highest processed push id and the highest job `last_modified`
+    timestamp, so that the next run only has to fetch what is newer.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+
+        try:
+            with open(self.path, encoding='utf-8') as state_file:
+                self.watermarks = json.load(state_file)
+        except FileNotFoundError:
+            self.watermarks = {}
+        except json.JSONDecodeError:
+            print(f'Ignoring unreadable incremental state [{self.path}]')
+            self.watermarks = {}
+
+    @classmethod
+    def from_config(cls, config):
+        '''Create the state from the [incremental] section of the global configuration'''
+        return cls(config.get('incremental', 'state', fallback='.cache/state.json'))
+
+    def get(self, project, section):
+        '''Return the watermark of a section as a dict (push_id, last_modified), or None'''
+        return self.watermarks.get(project, {}).get(section)
+
+    def update(self, project, section, push_id, last_modified):
+        previous = self.get(project, section) or {}
+
+        if push_id is None and not previous:
+            return
+
+        self.watermarks.setdefault(project, {})[section] = {
+            'push_id': max(filter(None, [push_id, previous.get('push_id')]), default=None),
+            'last_modified': max(filter(None, [last_modified, previous.get('last_modified')]), default=None),
+        }
+
+    def reset(self, project):
+        self.watermarks.pop(project, None)
+
+    def save(self):
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        with open(f'{self.path}.tmp', 'w', encoding='utf-8') as state_file:
+            json.dump(self.watermarks, state_file, indent=4)
+        os.replace(f'{self.path}.tmp', self.path)
@@ -0,0 +1,266 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+'''SQLite store of the datasets built by `client.py`'''
+
+import itertools
+import json
+import sqlite3
+import textwrap
+from datetime import datetime, timezone
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS pushes (
+    repo TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    revision TEXT,
+    day TEXT,
+    PRIMARY KEY (repo, id)
+);
+CREATE TABLE IF NOT EXISTS sections (
+    repo TEXT NOT NULL,
+    name TEXT NOT NULL,
+    job_symbol TEXT,
+    summary TEXT,
+    position INTEGER,
+    PRIMARY KEY (repo, name)
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    repo TEXT NOT NULL,
+    section TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    push_id INTEGER NOT NULL,
+    job_symbol TEXT,
+    result TEXT,
+    day TEXT,
+    duration REAL,
+    record TEXT NOT NULL,
+    PRIMARY KEY (repo, section, task_id)
+);
+CREATE TABLE IF NOT EXISTS test_outcomes (
+    repo TEXT NOT NULL,
+    section TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    result TEXT,
+    details TEXT
+);
+CREATE TABLE IF NOT EXISTS matrix_axes (
+    repo TEXT NOT NULL,
+    section TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    device TEXT,
+    outcome TEXT,
+    details TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_symbol ON jobs (job_symbol);
+CREATE INDEX IF NOT EXISTS jobs_repo_day ON jobs (repo, day);
+CREATE INDEX IF NOT EXISTS test_outcomes_name ON test_outcomes (name);
+CREATE INDEX IF NOT EXISTS test_outcomes_job ON test_outcomes (repo, section, task_id);
+CREATE INDEX IF NOT EXISTS matrix_axes_job ON matrix_axes (repo, section, task_id);
+'''
+
+
+class ResultsStore:
+    '''Pushes, jobs, test outcomes and matrix axes of every section
+
+    Jobs keep their dataset record (without its test details, which live
+    in `test_outcomes`), so that sections can be read back exactly as they
+    appear in `output.json`, which is exported from the store one section
+    at a time. Each write is a transaction of its own, so an interrupted
+    run leaves every push it finished in the store.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+        # Stores created before sections kept their position
+        if 'position' not in [column[1] for column in self.connection.execute('PRAGMA table_info(sections)')]:
+            with self.connection:
+                self.connection.execute('ALTER TABLE sections ADD COLUMN position INTEGER')
+
+    def close(self):
+        self.connection.close()
+
+    def reset(self, repo):
+        '''Remove everything previously stored for a repository'''
+        with self.connection:
+            for table in ('pushes', 'sections', 'jobs', 'test_outcomes', 'matrix_axes'):
+                self.connection.execute(f'DELETE FROM {table} WHERE repo = ?', (repo,))
+
+    def add_records(self, repo, section, job_symbol, push, entries):
+        '''Store the (duration, record) entries of a section for a push'''
+        day = datetime.fromtimestamp(push['push_timestamp'], timezone.utc).date().isoformat() \
+            if push.get('push_timestamp') else None
+
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO pushes (repo, id, revision, day) VALUES (?, ?, ?, ?)',
+                (repo, push['id'], push.get('revision'), day)
+            )
+
+            for duration, record in entries:
+                key = (repo, section, record['task_id'])
+
+                for table in ('test_outcomes', 'matrix_axes'):
+                    self.connection.execute(
+                        f'DELETE FROM {table} WHERE repo = ? AND section = ? AND task_id = ?', key
+                    )
+
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO jobs '
+                    '(repo, section, task_id, push_id, job_symbol, result, day, duration, record) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (*key, push['id'], job_symbol, record['result'], day, duration,
+                     json.dumps(dict(record, problem_test_details=[])))
+                )
+                self.connection.executemany(
+                    'INSERT INTO test_outcomes (repo, section, task_id, name, result, details) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    [(*key, test['name'], test['result'], test['details'])
+                     for test in record['problem_test_details']]
+                )
+                self.connection.executemany(
+                    'INSERT INTO matrix_axes (repo, section, task_id, device, outcome, details) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    [(*key, axis.get('device'), axis.get('outcome'), axis.get('details'))
+                     for axis in record['matrix_outcome_details'] or []]
+                )
+
+    def summaries(self, repo):
+        '''Return the stored summaries of the sections of a repository, keyed by section'''
+        return {
+            name: json.loads(summary) for name, summary in self.connection.execute(
+                'SELECT name, summary FROM sections WHERE repo = ?', (repo,)
+            )
+        }
+
+    def runs(self, repo, section):
+        '''Return the (push id, retry id) of the stored run of each task of a section'''
+        return {
+            task_id: (push_id, retry_id or 0) for task_id, push_id, retry_id in self.connection.execute(
+                "SELECT task_id, push_id, json_extract(record, '$.retry_id') FROM jobs WHERE repo = ? AND section = ?",
+                (repo, section)
+            )
+        }
+
+    def prune(self, repo, section, oldest_push_id):
+        '''Remove the jobs of a section older than a push'''
+        with self.connection:
+            for table in ('test_outcomes', 'matrix_axes'):
+                self.connection.execute(
+                    f'DELETE FROM {table} WHERE repo = ? AND section = ? AND task_id IN '
+                    '(SELECT task_id FROM jobs WHERE repo = ? AND section = ? AND push_id < ?)',
+                    (repo, section, repo, section, oldest_push_id)
+                )
+            self.connection.execute(
+                'DELETE FROM jobs WHERE repo = ? AND section = ? AND push_id < ?',
+                (repo, section, oldest_push_id)
+            )
+
+    def set_summary(self, repo, section, summary, position=None):
+        '''Store the summary of a section, at its `position` in the project configuration'''
+        with self.connection:
+            self.connection.execute(
+                'INSERT INTO sections (repo, name, job_symbol, summary, position) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (repo, name) DO UPDATE SET job_symbol = excluded.job_symbol, '
+                'summary = excluded.summary, position = excluded.position',
+                (repo, section, summary['job_symbol'], json.dumps(summary), position)
+            )
+
+    def remove_summary(self, repo, section):
+        '''Remove the summary of a section that no longer has any job'''
+        with self.connection:
+            self.connection.execute('DELETE FROM sections WHERE repo = ? AND name = ?', (repo, section))
+
+    def durations(self, repo, section):
+        '''Return the durations of the jobs of a section, in push order'''
+        return [duration for duration, in self.connection.execute(
+            'SELECT duration FROM jobs WHERE repo = ? AND section = ? ORDER BY push_id, rowid', (repo, section)
+        )]
+
+    def sections(self, repo=None, problems_only=False):
+        '''Yield sections as in `output.json`, optionally keeping only jobs with problem tests
+
+        Repositories come in the order they were first stored, and their
+        sections in the order of the project configuration (rather than
+        the order they were completed in).
+        '''
+        query = 'SELECT repo, name, summary FROM sections'
+        params = ()
+
+        if repo is not None:
+            query += ' WHERE repo = ?'
+            params = (repo,)
+
+        order = (' ORDER BY (SELECT MIN(first.rowid) FROM sections AS first WHERE first.repo = sections.repo), '
+                 'position, rowid')
+
+        for section_repo, name, summary in self.connection.execute(query + order, params).fetchall():
+            yield {name: list(self.records(section_repo, name, problems_only)), 'summary': json.loads(summary)}
+
+    def records(self, repo, section, problems_only=False):
+        '''Yield the dataset records of a section, in push order
+
+        Jobs and their test details are read with a single query, whose
+        rows are grouped back by job.
+        '''
+        rows = self.connection.execute(
+            'SELECT jobs.task_id, jobs.record, test_outcomes.name, test_outcomes.result, test_outcomes.details '
+            f'FROM jobs {"JOIN" if problems_only else "LEFT JOIN"} test_outcomes '
+            'ON test_outcomes.repo = jobs.repo AND test_outcomes.section = jobs.section '
+            'AND test_outcomes.task_id = jobs.task_id '
+            'WHERE jobs.repo = ? AND jobs.section = ? ORDER BY jobs.push_id, jobs.rowid, test_outcomes.rowid',
+            (repo, section)
+        )
+
+        for _, job_rows in itertools.groupby(rows, key=lambda row: row[0]):
+            job_rows = list(job_rows)
+            record = json.loads(job_rows[0][1])
+            record['problem_test_details'] = [
+                {'name': name, 'result': result, 'details': details}
+                for _, _, name, result, details in job_rows if name is not None
+            ]
+            yield record
+
+    def export(self, repo, path):
+        '''Write the sections of a repository to a JSON (or NDJSON) dataset, one section at a time
+
+        The file has the same content as the one `client.py` writes without
+        a store, NDJSON lines being grouped by section rather than in the
+        order pushes completed. Returns the number of sections written.
+        '''
+        from lib.ndjson import is_ndjson, open_ndjson
+
+        count = 0
+
+        if is_ndjson(path):
+            positions = dict(self.connection.execute('SELECT name, position FROM sections WHERE repo = ?', (repo,)))
+
+            with open_ndjson(path, 'wt') as output:
+                for count, section in enumerate(self.sections(repo), 1):
+                    name = next(key for key in section if key != 'summary')
+                    for record in section[name]:
+                        output.write(json.dumps({'section': name, 'record': record}) + '\n')
+                    output.write(json.dumps({
+                        'section': name, 'index': positions[name], 'summary': section['summary']
+                    }) + '\n')
+
+            return count
+
+        with open(path, 'w', encoding='utf-8') as output:
+            output.write('[')
+
+            # Each section is indented as an item of the whole list would be
+            for count, section in enumerate(self.sections(repo), 1):
+                output.write(',\n' if count > 1 else '\n')
+                output.write(textwrap.indent(json.dumps(section, indent=4), '    '))
+
+            output.write('\n]' if count else ']')
+
+        return count
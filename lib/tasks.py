@@ -0,0 +1,117 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+'''Per-run cache of Taskcluster task definitions'''
+
+import threading
+
+
+class TaskDefinitions:
+    '''Memoized task definitions, prefetched through task group listings
+
+    Jobs of a push usually share the task group of their decision task.
+    When enough of the wanted tasks belong to the same group, the group is
+    listed page by page (stopping as soon as every wanted task was seen)
+    instead of fetching each definition on its own. Only the definitions
+    of wanted tasks are kept, and none is ever fetched twice within a run.
+    Prefetching goes in rounds (see `data_builder.prefetch_task_definitions`)
+    whose requests do not depend on the order concurrent requests complete.
+    '''
+
+    def __init__(self, queue, group_threshold=4, page_size=1000):
+        self.queue = queue
+        self.group_threshold = group_threshold
+        self.page_size = page_size
+        self.definitions = {}
+        self.listed_groups = set()
+        self.fetching = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, queue, config):
+        '''Create the cache from the [taskcluster] section of the global configuration'''
+        return cls(
+            queue,
+            group_threshold=config.getint('taskcluster', 'group_prefetch_min', fallback=4),
+            page_size=config.getint('taskcluster', 'group_page_size', fallback=1000)
+        )
+
+    def get(self, task_id):
+        '''Return the definition of a task, fetching it if it is not cached yet
+
+        Concurrent callers wait for the fetch already in flight rather
+        than fetching the same task again.
+        '''
+        while True:
+            with self.lock:
+                if task_id in self.definitions:
+                    return self.definitions[task_id]
+
+                fetching = self.fetching.get(task_id)
+                if fetching is None:
+                    fetching = self.fetching[task_id] = threading.Event()
+                    break
+
+            # Fetched by another caller, unless that fetch failed
+            fetching.wait()
+
+        try:
+            definition = self.queue.task(task_id)
+
+            with self.lock:
+                self.definitions[task_id] = definition
+        finally:
+            with self.lock:
+                del self.fetching[task_id]
+            fetching.set()
+
+        return definition
+
+    def missing(self, task_ids):
+        '''Return the distinct task ids whose definition is not known yet, in order'''
+        return [task_id for task_id in dict.fromkeys(task_ids) if task_id not in self.definitions]
+
+    def plan(self, task_lists):
+        '''Return the group listings worth doing for lists of tasks, as a dict of wanted tasks
+
+        The first task of every list must have been fetched: the tasks of
+        the list still missing are looked for in its task group. Nothing is
+        fetched here.
+        '''
+        groups = {}
+
+        for task_ids in filter(None, task_lists):
+            groups.setdefault(self.definitions[task_ids[0]].get('taskGroupId'), set()).update(self.missing(task_ids))
+
+        return {
+            group_id: wanted for group_id, wanted in groups.items()
+            if len(wanted) >= self.group_threshold and group_id not in self.listed_groups
+        }
+
+    def list_group(self, group_id, wanted):
+        '''Page through a task group until every wanted definition was found'''
+        with self.lock:
+            if group_id in self.listed_groups:
+                return
+            self.listed_groups.add(group_id)
+
+        query = {'limit': self.page_size}
+        found = set()
+
+        while True:
+            page = self.queue.listTaskGroup(group_id, query=query)
+
+            for entry in page['tasks']:
+                if entry['status']['taskId'] in wanted:
+                    self.definitions[entry['status']['taskId']] = entry['task']
+                    found.add(entry['status']['taskId'])
+
+            # Only tasks found by this listing count, so that concurrent
+            # listings never change the number of pages requested
+            if not page.get('continuationToken') or wanted <= found:
+                return
+
+            query['continuationToken'] = page['continuationToken']
@@ -0,0 +1,245 @@
+#! /usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+'''Shared HTTP transport for Treeherder, Taskcluster, Github and artifact requests'''
+
+import asyncio
+import gzip
+import io
+import logging
+import random
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+
+class TransportError(Exception):
+    '''Base class for failed upstream requests'''
+
+    def __init__(self, url, message):
+        super().__init__(f'{message} ({url})')
+        self.url = url
+        self.message = message
+
+    def __reduce__(self):
+        # Keep errors raised in parser processes picklable
+        return type(self), (self.url, self.message)
+
+
+class HTTPStatusError(TransportError):
+    '''The server answered with an error status'''
+
+    def __init__(self, url, status):
+        super().__init__(url, f'HTTP {status}')
+        self.status = status
+
+    def __reduce__(self):
+        return type(self), (self.url, self.status)
+
+
+class NetworkError(TransportError):
+    '''The request failed before a response was received'''
+
+
+class DecodeError(TransportError):
+    '''The response body could not be decompressed or decoded'''
+
+
+class RetryPolicy:
+    '''Exponential backoff with full jitter'''
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, retries=4, backoff=0.5, max_backoff=30):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def delay(self, attempt):
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def urllib3_retry(self):
+        return Retry(
+            total=self.retries,
+            backoff_factor=self.backoff,
+            backoff_jitter=self.backoff,
+            backoff_max=self.max_backoff,
+            status_forcelist=self.RETRY_STATUSES,
+            allowed_methods=None,
+            raise_on_status=False
+        )
+
+
+class Transport:
+    '''Pooled keep-alive HTTP transport with retries
+
+    Blocking clients (Treeherder, Taskcluster, Github) send their requests
+    through one adapter, which keeps a pool of keep-alive connections per
+    host and retries transient failures, while artifacts are downloaded
+    through an aiohttp session with the same retry policy. Failures are raised as TransportError subclasses. With
+    `metrics`, the latency and size of every blocking request is recorded.
+    '''
+
+    def __init__(self, pool_size=10, policy=None, timeout=60, metrics=None):
+        self.pool_size = pool_size
+        self.policy = policy or RetryPolicy()
+        self.timeout = timeout
+        options = dict(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=self.policy.urllib3_retry()
+        )
+
+        if metrics is not None:
+            from lib.metrics import MeasuredAdapter
+            self.adapter = MeasuredAdapter(metrics, **options)
+        else:
+            self.adapter = HTTPAdapter(**options)
+        self.session = self.mount(requests.Session())
+        self.async_session = None
+
+    @classmethod
+    def from_config(cls, config, pool_size, metrics=None):
+        '''Create the transport from the [transport] section of the global configuration'''
+        return cls(
+            pool_size=pool_size,
+            policy=RetryPolicy(
+                retries=config.getint('transport', 'retries', fallback=4),
+                backoff=config.getfloat('transport', 'backoff', fallback=0.5)
+            ),
+            timeout=config.getint('transport', 'timeout', fallback=60),
+            metrics=metrics
+        )
+
+    def mount(self, session):
+        '''Route an existing requests session through the pooled adapter'''
+        session.mount('https://', self.adapter)
+        session.mount('http://', self.adapter)
+        return session
+
+    def request(self, method, url, **kwargs):
+        '''Send a blocking request, raising a TransportError on failure'''
+        kwargs.setdefault('timeout', self.timeout)
+
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.RequestException as err:
+            raise NetworkError(url, str(err)) from err
+
+        if response.status_code >= 400:
+            raise HTTPStatusError(url, response.status_code)
+
+        return response
+
+    async def open(self):
+        import ssl
+
+        import aiohttp
+        import certifi
+
+        self.async_session = aiohttp.ClientSession(
+            # Artifacts are served gzip-encoded; keep the compressed bytes so
+            # they can be cached as they are and decompressed as a stream.
+            auto_decompress=False,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            connector=aiohttp.TCPConnector(
+                limit_per_host=self.pool_size,
+                ssl=ssl.create_default_context(cafile=certifi.where())
+            )
+        )
+
+    async def close(self):
+        if self.async_session is not None:
+            await self.async_session.close()
+        self.session.close()
+
+    async def download(self, url, headers=None):
+        '''Download a URL as (content type, raw body), retrying transient failures'''
+        import aiohttp
+
+        for attempt in range(self.policy.retries + 1):
+            try:
+                async with self.async_session.get(url, headers=headers) as response:
+                    if response.status in self.policy.RETRY_STATUSES and attempt < self.policy.retries:
+                        logger.warning(f'Retrying {url} after HTTP {response.status}')
+                    elif response.status >= 400:
+                        raise HTTPStatusError(url, response.status)
+                    else:
+                        return response.content_type, await response.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                if attempt == self.policy.retries:
+                    raise NetworkError(url, str(err) or type(err).__name__) from err
+                logger.warning(f'Retrying {url} after {type(err).__name__}: {err}')
+
+            await asyncio.sleep(self.policy.delay(attempt))
+
+    def create_queue(self, root_url):
+        '''Create a Taskcluster queue client whose requests go through the transport'''
+        from taskcluster import Queue
+        from taskcluster.exceptions import (TaskclusterConnectionError,
+                                            TaskclusterRestFailure)
+
+        transport = self
+
+        class PooledQueue(Queue):
+            '''Queue client for public (unauthenticated) endpoints'''
+
+            def _makeHttpRequest(self, method, route, payload):
+                url = self._constructUrl(route)
+
+                try:
+                    response = transport.request(method, url, json=payload, allow_redirects=False)
+                except HTTPStatusError as err:
+                    raise TaskclusterRestFailure(str(err), superExc=err, status_code=err.status) from err
+                except NetworkError as err:
+                    raise TaskclusterConnectionError(str(err), superExc=err) from err
+
+                if response.status_code == 204:
+                    return None
+
+                return response.json()
+
+        return PooledQueue({'rootUrl': root_url})
+
+    def create_github(self, token, base_url, **kwargs):
+        '''Create a Github client whose requests go through the pooled adapter
+
+        PyGithub opens its connections itself, so its connection classes
+        are replaced (for every client of the process) by ones mounting the
+        adapter on their session, and so the retry policy of the transport.
+        '''
+        from github import Github
+        from github.Requester import (HTTPRequestsConnectionClass,
+                                      HTTPSRequestsConnectionClass, Requester)
+
+        transport = self
+
+        def pooled(connection_class):
+            class PooledConnection(connection_class):
+                def __init__(self, *args, **kwargs):
+                    super().__init__(*args, **kwargs)
+                    transport.mount(self.session)
+
+                def close(self):
+                    # The adapter is shared, and closed with the transport
+                    pass
+
+            return PooledConnection
+
+        Requester.injectConnectionClasses(pooled(HTTPRequestsConnectionClass), pooled(HTTPSRequestsConnectionClass))
+
+        return Github(token, base_url=base_url, **kwargs)
+
+
+def open_compressed(body):
+    '''Return a stream decompressing a (possibly) gzip-compressed body as it is read'''
+    if body[:2] == b'\x1f\x8b':
+        return gzip.GzipFile(fileobj=io.BytesIO(body))
+
+    return io.BytesIO(body)
@@ -7,16 +7,17 @@
 '''Treeherder module for fetching data from Treeherder'''
 
 import logging
+from collections import defaultdict
 
-from thclient import TreeherderClient
-
-logging.basicConfig(filename='output.log', filemode='w', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
 class Treeherder:
     '''Treeherder class for fetching data from Treeherder'''
 
+    JOBS_PAGE_SIZE = 2000
+    JOB_LOGS_BATCH_SIZE = 100
+
     def __init__(self, project):
         self.project = project
         self.config = self.get_global_config()
@@ -27,6 +28,8 @@ class Treeherder:
         return TreeherderConfig().read_global_config()
 
     def create_client(self):
+        from thclient import TreeherderClient
+
         return TreeherderClient(
             server_url=self.config['treeherder']['host']
         )
@@ -51,6 +54,71 @@ class Treeherder:
         except requests.exceptions.HTTPError as err:
             raise SystemExit(err) from err
 
+    def get_push_jobs(self, push_id, **params):
+        '''Fetch every job of a push, one page at a time'''
+        jobs, offset = [], 0
+
+        while True:
+            page = self.client.get_jobs(
+                project=self.project,
+                push_id=push_id,
+                count=self.JOBS_PAGE_SIZE,
+                offset=offset,
+                **params
+            )
+            jobs.extend(page)
+
+            if len(page) < self.JOBS_PAGE_SIZE:
+                return jobs
+
+            offset += len(page)
+
+    def get_job_logs(self, job_ids):
+        '''Fetch the log URLs of many jobs, batched, as {job_id: [url, ...]}'''
+        logs = defaultdict(list)
+
+        for start in range(0, len(job_ids), self.JOB_LOGS_BATCH_SIZE):
+            for log in self.client.get_job_log_url(
+                project=self.project,
+                job_id=job_ids[start:start + self.JOB_LOGS_BATCH_SIZE]
+            ):
+                logs[log['job_id']].append(log['url'])
+
+        return logs
+
+
+class JobIndex:
+    '''In-memory index of a push's jobs
+
+    Runs superseded by a newer run (retry) of the same task are set aside
+    before anything else is fetched for them. Jobs are keyed by
+    (tier, job_type_symbol, job_group_symbol, result, who), and additionally
+    with a `job_group_symbol` and/or `who` of None, so that an empty group
+    symbol or author filter matches every group (Treeherder reports
+    ungrouped jobs as `?`) or author, as it does when querying Treeherder.
+    Jobs keep the order Treeherder returned them in.
+    '''
+
+    def __init__(self, jobs):
+        self.jobs = defaultdict(list)
+        self.superseded = defaultdict(list)
+        latest = {}
+
+        for job in jobs:
+            if job['task_id'] not in latest or job['retry_id'] > latest[job['task_id']]['retry_id']:
+                latest[job['task_id']] = job
+
+        for job in jobs:
+            index = self.jobs if latest[job['task_id']] is job else self.superseded
+            for group in dict.fromkeys((job['job_group_symbol'], None)):
+                for who in dict.fromkeys((job['who'], None)):
+                    index[(str(job['tier']), job['job_type_symbol'], group, job['result'], who)].append(job)
+
+    def lookup(self, tier, job_type_symbol, job_group_symbol, result, who=None, superseded=False):
+        return (self.superseded if superseded else self.jobs).get(
+            (str(tier), job_type_symbol, job_group_symbol or None, result, who or None), []
+        )
+
 
 class TreeherderConfig:
     '''TreeherderConfig class for reading from INI config file'''
@@ -80,5 +148,11 @@ class TreeherderHelper:
     def get_pushes(self):
         return self.client.get_pushes()
 
+    def get_push_jobs(self, push_id, **params):
+        return self.client.get_push_jobs(push_id, **params)
+
+    def get_job_logs(self, job_ids):
+        return self.client.get_job_logs(job_ids)
+
     def get_client(self):
         return self.client.get_client()
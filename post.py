@@ -10,15 +10,13 @@ and failures from a JSON file generated by `client.py`
 '''
 
 import argparse
-import ast
-import json
 import logging
 import os
 import re
 import sys
-from collections import defaultdict
+from collections import Counter
 
-import requests
+from lib.results import iter_sections
 
 
 def parse_args(cmdln_args):
@@ -30,27 +28,26 @@ def parse_args(cmdln_args):
     parser.add_argument(
         '--input',
         default='output.json',
-        help='Input (JSON)',
+        help='Input (JSON, or NDJSON streamed by client.py --output)',
+        required=False
+    )
+    parser.add_argument(
+        '--db',
+        default=None,
+        help='Input (SQLite results store), read instead of --input',
+        required=False
+    )
+    parser.add_argument(
+        '--dry-run',
+        default=None,
+        metavar='DIR',
+        help='Write the Slack payloads to DIR instead of posting them',
         required=False
     )
 
     return parser.parse_args(args=cmdln_args)
 
 
-def post_to_slack(data):
-    '''Post data to Slack'''
-    webhook_url = os.environ.get('SLACK_WEBHOOK')
-
-    try:
-        requests.post(url=str(webhook_url), json=data, timeout=15)
-    except requests.Timeout:
-        logging.error("Request to Slack timed out.")
-        raise
-    except requests.ConnectionError:
-        logging.error("A network problem occurred.")
-        raise
-
-
 def get_slack_emoji(query):
     '''Return Slack emoji based on query'''
     logging.info(f"Received query: {query}")
@@ -87,162 +84,163 @@ def main():
     '''Main entry point'''
     args = parse_args(sys.argv[1:])
 
+    from lib.slack import SlackDispatcher, SlackError
+    dispatcher = SlackDispatcher(os.environ.get('SLACK_WEBHOOK'), dry_run=args.dry_run)
+
     try:
-        with open(args.input, encoding='utf-8') as data_file:
-            dataset = json.load(data_file)
-
-            pattern = r"Bug (\d+)"
-            bz_base_url = "https://bugzil.la/"
-
-            for section in dataset:
-                content, header, footer = ([] for _ in range(3))
-                divider = [{"type": "divider"}]
-                header = [
-                    {
-                        "type": "header",
-                        "text": {
-                            "type": "plain_text",
-                            "text": "Daily {} {} {}: {} w/ {}"
+        dataset = iter_sections(args.input, args.db, problems_only=True)
+
+        pattern = r"Bug (\d+)"
+        bz_base_url = "https://bugzil.la/"
+
+        for section in dataset:
+            content, header, footer = ([] for _ in range(3))
+            divider = [{"type": "divider"}]
+            header = [
+                {
+                    "type": "header",
+                    "text": {
+                        "type": "plain_text",
+                        "text": "Daily {} {} {}: {} w/ {}"
+                        .format(
+                            section['summary']['project'],
+                            get_slack_emoji(section['summary']['project']),
+                            section['summary']['job_symbol'],
+                            get_slack_emoji(section['summary']['job_result']),
+                            get_header_result_text(section['summary']['job_result'])
+                        )
+                    }
+                }
+            ]
+            footer = [
+                {
+                    "type": "context",
+                    "elements": [
+                        {
+                            "type": "mrkdwn",
+                            "text": ":testops-notify: created by [<{}|{}>]"
                             .format(
-                                section['summary']['project'],
-                                get_slack_emoji(section['summary']['project']),
-                                section['summary']['job_symbol'],
-                                get_slack_emoji(section['summary']['job_result']),
-                                get_header_result_text(section['summary']['job_result'])
-                            )
+                                "https://mozilla-hub.atlassian.net/wiki/spaces/MTE/overview",
+                                "Mobile Test Engineering")
                         }
-                    }
-                ]
-                footer = [
-                    {
-                        "type": "context",
-                        "elements": [
+                    ]
+                }
+            ]
+
+            # Iterate over the job results, using the per-test aggregate to skip duplicates
+            job = (next(iter(section.values())))
+            test_name_seen = {}
+            if 'tests' in section['summary']:
+                counts = {name: test['count'] for name, test in section['summary']['tests'].items()}
+            else:
+                # Outputs written before the summary aggregated its tests
+                counts = Counter(test['name'] for problem in job for test in problem['problem_test_details'])
+
+            for problem in job:
+                if problem['problem_test_details']:
+                    for test in problem['problem_test_details']:
+                        if test["name"] in test_name_seen and counts[test["name"]] > 1:
+                            print(f"Skipping duplicate test {test['name']}")
+                            continue
+
+                        test_name_seen[test["name"]] = True
+
+                        occurrence_count = counts[test["name"]] - 1
+
+                        try:
+                            bug_number = re.findall(pattern, problem['pullreq_html_title'] or '')[0]
+                            bug_link = f"<{bz_base_url}{bug_number}|Bug>"
+                        except IndexError:
+                            bug_link = "No Bug"
+
+                        content.append([
+                            test['name'],
                             {
-                                "type": "mrkdwn",
-                                "text": ":testops-notify: created by [<{}|{}>]"
-                                .format(
-                                    "https://mozilla-hub.atlassian.net/wiki/spaces/MTE/overview",
-                                    "Mobile Test Engineering")
-                            }
-                        ]
-                    }
-                ]
-
-                # Iterate over the job results, create dictionaties to check for duplicates
-                job = (next(iter(section.values())))
-                test_name_seen = {}
-                duplicates_list = ast.literal_eval(section["summary"]["duplicates"])
-                test_occurrence_counts = defaultdict(int)
-
-                # Perform a preliminary pass to count occurrences of each test
-                for problem in job:
-                    if problem["problem_test_details"]:
-                        for test in problem["problem_test_details"]:
-                            test_occurrence_counts[test["name"]] += 1
-
-                for problem in job:
-                    if problem['problem_test_details']:
-                        for test in problem['problem_test_details']:
-                            if test["name"] in test_name_seen and test["name"] in duplicates_list:
-                                print(f"Skipping duplicate test {test['name']}")
-                                continue
-
-                            test_name_seen[test["name"]] = True
-
-                            occurrence_count = test_occurrence_counts.get(test["name"], 0) - 1
-
-                            try:
-                                bug_number = re.findall(pattern, problem['pullreq_html_title'])[0]
-                                bug_link = f"<{bz_base_url}{bug_number}|Bug>"
-                            except IndexError:
-                                bug_link = "No Bug"
-
-                            content.append([
-                                test['name'],
-                                {
-                                    "type": "section",
+                                "type": "section",
+                                "text": {
+                                    "type": "mrkdwn",
+                                    "text":
+                                    f"`{test['name']}`"
+                                },
+                                "accessory": {
+                                    "type": "button",
                                     "text": {
-                                        "type": "mrkdwn",
-                                        "text":
-                                        f"`{test['name']}`"
+                                        "type": "plain_text",
+                                        "text": "{} {}".format(
+                                            test['result'],
+                                            get_slack_emoji(test['result'])
+                                        )
                                     },
-                                    "accessory": {
-                                        "type": "button",
-                                        "text": {
-                                            "type": "plain_text",
-                                            "text": "{} {}".format(
-                                                test['result'],
-                                                get_slack_emoji(test['result'])
-                                            )
-                                        },
-                                        "value": "firebase",
-                                        "url":
-                                        problem['matrix_general_details']
-                                        ['webLink'],
-                                        "action_id": "button-action"
-                                    }
-                                },
-                                {
-                                    "type": "context",
-                                    "elements": [
-                                        {
-                                            "type": "mrkdwn",
-                                            "text": f"<{problem['pullreq_html_url']}|Commit>"
-                                        },
-                                        {
-                                            "type": "mrkdwn",
-                                            "text": f"<{problem['task_log']}|Task Log>"
-                                        },
-                                        {
-                                            "type": "mrkdwn",
-                                            "text": f"<{problem['pushlog']}|Push Log>"
-                                        },
-                                        {
-                                            "type": "mrkdwn",
-                                            "text": f"{bug_link}"
-                                        },
-                                        {
-                                            "type": "plain_text",
-                                            "text": f"{problem['revision'][:5]}"
-                                        },
-                                        {
-                                            "type": "plain_text",
-                                            "text": f"{problem['matrix_general_details']['matrixId']}"
-                                        },
-                                        {
-                                            "type": "plain_text",
-                                            "text": f"{section['summary']['repo']}"
-                                        },
-                                        {
-                                            "type": "mrkdwn",
-                                            "text": (
-                                                f"{occurrence_count}x" if occurrence_count > 0 else " "
-                                            ),
-                                        },
-                                    ]
+                                    "value": "firebase",
+                                    "url":
+                                    problem['matrix_general_details']
+                                    ['webLink'],
+                                    "action_id": "button-action"
                                 }
-                            ])
-                if content:
-                    content = sorted(content, key=lambda x: x[0])
-                    [x.__delitem__(0) for x in content]
-                    content = [item for sublist in content for item in sublist]
-
-                    # Chunk messages into groups of 46 to avoid Slack API limits
-                    # 50 is the max number of blocks allowed in a message, and 46 is the max number of blocks
-                    # as we are using 4 blocks for header, dividers and a footer
-                    chunks = [content[i:i + 46] for i in range(0, len(content), 46)]
-                    for chunk in chunks:
-                        post_to_slack({'blocks': header + divider + chunk + divider + footer, 'text': "no-use"})
-
-                    #post_to_slack({'blocks': header + divider + content + divider + footer, 'text': "no-use"})
-
-                    print(f"Slack message posted for [{section['summary']['job_symbol']}] "
-                          f"with results [{section['summary']['job_result']}] ({section['summary']['project']})")
-                else:
-                    print(f"No Slack message posted for [{next(iter(section))}] in "
-                          f"[{section['summary']['job_symbol']}] ({section['summary']['project']})")
-
-    except OSError as err:
+                            },
+                            {
+                                "type": "context",
+                                "elements": [
+                                    {
+                                        "type": "mrkdwn",
+                                        "text": f"<{problem['pullreq_html_url']}|Commit>"
+                                    },
+                                    {
+                                        "type": "mrkdwn",
+                                        "text": f"<{problem['task_log']}|Task Log>"
+                                    },
+                                    {
+                                        "type": "mrkdwn",
+                                        "text": f"<{problem['pushlog']}|Push Log>"
+                                    },
+                                    {
+                                        "type": "mrkdwn",
+                                        "text": f"{bug_link}"
+                                    },
+                                    {
+                                        "type": "plain_text",
+                                        "text": f"{problem['revision'][:5]}"
+                                    },
+                                    {
+                                        "type": "plain_text",
+                                        "text": f"{problem['matrix_general_details']['matrixId']}"
+                                    },
+                                    {
+                                        "type": "plain_text",
+                                        "text": f"{section['summary']['repo']}"
+                                    },
+                                    {
+                                        "type": "mrkdwn",
+                                        "text": (
+                                            f"{occurrence_count}x" if occurrence_count > 0 else " "
+                                        ),
+                                    },
+                                ]
+                            }
+                        ])
+            if content:
+                content = sorted(content, key=lambda x: x[0])
+                [x.__delitem__(0) for x in content]
+                content = [item for sublist in content for item in sublist]
+
+                # Chunk messages into groups of 46 to avoid Slack API limits
+                # 50 is the max number of blocks allowed in a message, and 46 is the max number of blocks
+                # as we are using 4 blocks for header, dividers and a footer
+                chunks = [content[i:i + 46] for i in range(0, len(content), 46)]
+                dispatcher.post_all([
+                    {'blocks': header + divider + chunk + divider + footer, 'text': "no-use"}
+                    for chunk in chunks
+                ])
+
+                #post_to_slack({'blocks': header + divider + content + divider + footer, 'text': "no-use"})
+
+                print(f"Slack message posted for [{section['summary']['job_symbol']}] "
+                      f"with results [{section['summary']['job_result']}] ({section['summary']['project']})")
+            else:
+                print(f"No Slack message posted for [{next(iter(section))}] in "
+                      f"[{section['summary']['job_symbol']}] ({section['summary']['project']})")
+
+    except (OSError, SlackError) as err:
         raise SystemExit(err) from err
 
 
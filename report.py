@@ -1,7 +1,8 @@
 """
 Generates an HTML report from a dataset containing test results. The report
-displays the names of each test, as well as badges indicating whether the test
-result was a failure, or flaky. The report also includes links to the
+displays the names of each test, grouping its occurrences into a single row with
+a count, as well as badges indicating whether the test result was a failure,
+or flaky. The report also includes links to the
 details of each test, the task associated with each test, and the GitHub pull
 request that triggered the test run.
 
@@ -10,7 +11,9 @@ Inputs:
   '--input' specifying the name of the input file containing the test results.
 
 Outputs:
-- A report.html file containing an HTML report of the test results.
+- A report.html file containing an HTML report of the test results, replaced
+  on every run. Traces are stored once per distinct text, in compressed details
+  that are only rendered when a test is expanded.
 """
 
 # This Source Code Form is subject to the terms of the Mozilla Public
@@ -18,13 +21,20 @@ Outputs:
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
 import argparse
+import base64
+import functools
+import gzip
+import hashlib
 import json
+import os
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from html import escape
 
-import requests
-
-session = requests.Session()
+from lib.cassette_options import add_arguments as add_cassette_arguments
+from lib.cassette_options import from_args as cassette_from_args
+from lib.results import iter_sections
 
 
 def parse_args(cmdln_args):
@@ -35,14 +45,43 @@ def parse_args(cmdln_args):
     parser.add_argument(
         '--input',
         default='output.json',
-        help='Input (JSON)',
+        help='Input (JSON, or NDJSON streamed by client.py --output)',
+        required=False
+    )
+    parser.add_argument(
+        '--db',
+        default=None,
+        help='Input (SQLite results store), read instead of --input',
         required=False
     )
+    parser.add_argument(
+        '--bugzilla-workers',
+        default=8,
+        type=int,
+        help='Maximum number of concurrent Bugzilla searches (default: 8)',
+        required=False
+    )
+    parser.add_argument(
+        '--bugzilla-cache',
+        default='.cache/bugzilla.json',
+        help='Cache of Bugzilla search results (default: .cache/bugzilla.json)',
+        required=False
+    )
+    parser.add_argument(
+        '--bugzilla-ttl',
+        default=24,
+        type=float,
+        help='Hours Bugzilla search results are cached for (default: 24, 0 disables the cache)',
+        required=False
+    )
+    add_cassette_arguments(parser)
 
     return parser.parse_args(args=cmdln_args)
 
 
-def search_bugs(test_name):
+def search_bugs(session, test_name):
+    import requests
+
     url = "https://bugzilla.mozilla.org/rest/bug"
     params = {
         "summary": test_name,
@@ -72,181 +111,344 @@ def search_bugs(test_name):
     return bugs
 
 
-def generate_html(test_object):
-    match test_object["testResult"]:
-        case "flaky":
-            color = "#FFFFCC"
-            test_badge = "https://img.shields.io/badge/flaky-yellow"
-        case "failure":
-            color = "#ffcccc"
-            test_badge = "https://img.shields.io/badge/failure-red"
-        case _:
-            color = "#ccffcc"
-            test_badge = "https://img.shields.io/badge/success-green"
-    match test_object["task"]:
-        case _:
-            task_badge = "https://img.shields.io/badge/-task-lightblue"
-
-    if "github" in test_object["source"].lower():
-        source_badge = "https://img.shields.io/badge/Github-Pull%20Request-lightgrey"
-    elif "hg.mozilla.org" in test_object["source"]:
-        source_badge = "https://img.shields.io/badge/Mozilla-Central-orange"
+def load_bug_cache(filename, ttl):
+    '''Load the Bugzilla search results cached less than `ttl` seconds ago'''
+    try:
+        with open(filename, encoding='utf-8') as cache_file:
+            cache = json.load(cache_file)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+    return {
+        test_name: entry for test_name, entry in cache.items()
+        if time.time() - entry['time'] < ttl
+    }
+
+
+def save_bug_cache(filename, cache):
+    try:
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+        with open(f'{filename}.tmp', 'w', encoding='utf-8') as cache_file:
+            json.dump(cache, cache_file)
+        os.replace(f'{filename}.tmp', filename)
+    except OSError as err:
+        print(f"An error occurred while writing the Bugzilla cache to {filename}: {err}")
+
+
+def search_all_bugs(session, test_names, cache, workers):
+    '''Search the bugs of distinct test names, concurrently, skipping cached ones'''
+    missing = [test_name for test_name in dict.fromkeys(test_names) if test_name not in cache]
+
+    if missing:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for test_name, bugs in zip(missing, executor.map(functools.partial(search_bugs, session), missing)):
+                # Failed searches are not cached, so they are retried next time
+                if bugs is not None:
+                    cache[test_name] = {'time': time.time(), 'bugs': bugs}
+
+    return {
+        test_name: cache[test_name]['bugs'] if test_name in cache else None
+        for test_name in test_names
+    }
+
+
+def normalize_trace(trace):
+    '''Normalize a trace so that occurrences differing only in whitespace match'''
+    return '\n'.join(line.rstrip() for line in (trace or '').strip().splitlines())
+
+
+def trace_key(trace):
+    return hashlib.sha1(trace.encode()).hexdigest()[:16]
+
+
+def source_badge(source):
+    if "github" in (source or '').lower():
+        return "https://img.shields.io/badge/Github-Pull%20Request-lightgrey"
+    elif "hg.mozilla.org" in (source or ''):
+        return "https://img.shields.io/badge/Mozilla-Central-orange"
     else:
-        source_badge = "https://img.shields.io/badge/-unknown-lightgrey"
+        return "https://img.shields.io/badge/-unknown-lightgrey"
 
-    bugs = search_bugs(test_object['testName'])
 
-    if bugs:
-        bug_list = '<ul>'
-        for bug in bugs:
-            bug_list += f'<li><a href="{bug["url"]}">{bug["summary"]} (#{bug["id"]})</a></li>'
-            bug_html = f'{bug_list}'
-        bug_list += '</ul>'
+def generate_html(row_id, test_name, occurrences):
+    '''Generate the row of a test, grouping all of its occurrences'''
+    results = [occurrence['testResult'] for occurrence in occurrences]
 
+    if "failure" in results:
+        color = "#ffcccc"
+        test_badge = "https://img.shields.io/badge/failure-red"
+    elif "flaky" in results:
+        color = "#FFFFCC"
+        test_badge = "https://img.shields.io/badge/flaky-yellow"
     else:
-        bug_html = '<a href="https://bugzilla.mozilla.org/enter_bug.cgi?product=Fenix&component=UI%20Tests">' \
-                   '<img src=https://img.shields.io/badge/bugzilla-new%20bug-green></a>'
+        color = "#ccffcc"
+        test_badge = "https://img.shields.io/badge/success-green"
+
+    task_badge = "https://img.shields.io/badge/-task-lightblue"
+    latest = occurrences[-1]
 
     return f"""
         <tr style="background-color:{color};">
             <td>
-                <div class="test-name" onclick="toggleDetails('{escape(test_object['testName'])}_details')">
-                   <span class="icon">&#43;</span> {escape(test_object['testName'])}
-                </div>
-               </div>
-                <div id="{escape(test_object['testName'])}_details" style="display:none;" onclick="event.stopPropagation();">
-                    <div class="toggle" onclick="toggleDetails('{escape(test_object['testName'])}_details')">
-                        <span class="icon">&#8722;</span>
-                    </div>
-                    <div style="display: inline-block;">
-                      <div class="details-link">Hide details</div>
-                    </div>
-                    <div class="console-wrapper">
-                        {bug_html}
-                    </div>
-                    <div class="console-wrapper">
-                        <pre class="console-output log">
-                            <code>{escape(test_object['trace'])}</code>
-                        </pre>
-                    </div>
+                <div class="test-name" onclick="toggleDetails('{row_id}')">
+                   <span class="icon">&#43;</span> {escape(test_name)}
+                   <span class="count">&times;{len(occurrences)}</span>
                 </div>
+                <div id="{row_id}_details" class="details" style="display:none;"></div>
             </td>
-            <td style="text-align: center;"><a href="{escape(test_object['details'])}"><img src="{test_badge}"></a></td>
-            <td style="text-align: center;"><a href="{escape(test_object['task'])}"><img src="{task_badge}"</a></td>
-            <td><a href={escape(test_object['source'])}><img src="{source_badge}"</a></td>
+            <td style="text-align: center;"><a href="{escape(latest['details'] or '')}"><img src="{test_badge}"></a></td>
+            <td style="text-align: center;"><a href="{escape(latest['task'] or '')}"><img src="{task_badge}"></a></td>
+            <td><a href="{escape(latest['source'] or '')}"><img src="{source_badge(latest['source'])}"></a></td>
         </tr>
     """
 
 
-def generate_report(section, test_objects):
-    tests_html = '\n'.join(generate_html(test) for test in test_objects)
+def generate_section(section, test_objects, bugs, details):
+    '''Generate the table of a section, adding the details of its rows to `details`
+
+    Occurrences of a test are grouped into a single row. Their traces are
+    stored once per distinct (normalized) text in `details['traces']`, and
+    rows only refer to them by hash.
+    '''
+    tests = {}
+
+    for test in test_objects:
+        tests.setdefault(test['testName'], []).append(test)
+
+    rows = []
+
+    for test_name, occurrences in tests.items():
+        row_id = f"row{len(details['rows'])}"
+        row_occurrences = []
+
+        for occurrence in occurrences:
+            trace = normalize_trace(occurrence['trace'])
+            details['traces'].setdefault(trace_key(trace), trace)
+            row_occurrences.append({
+                'result': occurrence['testResult'],
+                'trace': trace_key(trace),
+                'details': occurrence['details'],
+                'task': occurrence['task'],
+                'source': occurrence['source'],
+            })
+
+        details['rows'][row_id] = {'bugs': bugs.get(test_name), 'occurrences': row_occurrences}
+        rows.append(generate_html(row_id, test_name, occurrences))
+
+    tests_html = '\n'.join(rows)
 
     return f"""
-        <!DOCTYPE html>
-        <html>
-            <head>
-                <meta charset="utf-8">
-                <title>Test Report</title>
-                <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.2.0/styles/default.min.css" />
-                <script src="https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.2.0/highlight.min.js"></script>
-                <style>
-                    body {{
-                        font-family: "Open Sans", sans-serif;
-                    }}
-                    table {{
-                        border-collapse: collapse;
-                    }}
-                    th, td {{
-                        text-align: left;
-                        padding: 8px;
-                    }}
-                    th {{
-                        background-color: #d3d3d3;
-                        color: black;
-                        font-size: 16px;
-                        font-weight: bold;
-                    }}
-                    .console-output {{
-                        font-family: monospace;
-                        font-size: 12px;
-                        line-height: 1.4;
-                        background-color: #f4f4f4;
-                        border-radius: 5px;
-                        padding: 10px;
-                        white-space: pre-wrap;
-                    }}
-                    .test-name {{
-                        font-family: "Open Sans", sans-serif;
-                        font-weight: bold;
-                        font-size: 14px;
-                        padding: 5px;
-                        margin-bottom: 10px;
-                        border-radius: 5px;
-                    }}
-                    .console-wrapper {{
-                        overflow-y: auto;
-                        padding: 10px;
-                        max-height: 150px
-                    }}
-                    .bugs {{
-                        font-family: "Open Sans", sans-serif;"
-                        font-size: 12px;
-                    }}
-                    .toggle {{
-                       display: inline-block;
-                       cursor: pointer;
-                    }}
-                    .details-link {{
-                        font-family: "Open Sans", sans-serif;
-                        font-size: 12px;
-                    }}
-                    ul {{
-                        padding-left: 60px;
-                        list-style-image: url('https://img.shields.io/badge/-bugzilla-green');
-                    }}
-                    li {{
-                        vertical-align: -2px;
-                    }}
-                </style>
-                <script>
-                    function toggleDetails(id) {{
-                        var element = document.getElementById(id);
-                        if (element.style.display === "none") {{
-                            element.style.display = "block";
-                        }} else {{
-                            element.style.display = "none";
-                        }}
-                    }}
-                </script>
-                <script>
-                    document.addEventListener("DOMContentLoaded", function() {{
-                        hljs.highlightAll();
-                    }});
-                </script>
-            </head>
-            <body>
-                <h1>{section}</h1>
-                <table>
-                    <thead>
-                        <tr>
-                            <th>Test Name</th>
-                            <th><img src="https://www.gstatic.com/mobilesdk/160503_mobilesdk/logo/favicon.ico"></th>
-                            <th><img src="https://media.taskcluster.net/favicons/faviconLogo.png"></th>
-                            <th><img src="https://img.shields.io/badge/Code%20Repository-blue"></th>
-                        </tr>
-                    </thead>
-                    <tbody>
-                        {tests_html}
-                    </tbody>
-                </table>
-            </body>
-        </html>
+        <h1>{escape(section)}</h1>
+        <table>
+            <thead>
+                <tr>
+                    <th>Test Name</th>
+                    <th><img src="https://www.gstatic.com/mobilesdk/160503_mobilesdk/logo/favicon.ico"></th>
+                    <th><img src="https://media.taskcluster.net/favicons/faviconLogo.png"></th>
+                    <th><img src="https://img.shields.io/badge/Code%20Repository-blue"></th>
+                </tr>
+            </thead>
+            <tbody>
+                {tests_html}
+            </tbody>
+        </table>
     """
 
 
+def encode_details(details):
+    '''Encode the details of every row as base64 gzip-compressed JSON'''
+    return base64.b64encode(gzip.compress(json.dumps(details).encode(), mtime=0)).decode()
+
+
+STYLE = """
+    body {
+        font-family: "Open Sans", sans-serif;
+    }
+    table {
+        border-collapse: collapse;
+    }
+    th, td {
+        text-align: left;
+        padding: 8px;
+    }
+    th {
+        background-color: #d3d3d3;
+        color: black;
+        font-size: 16px;
+        font-weight: bold;
+    }
+    .console-output {
+        font-family: monospace;
+        font-size: 12px;
+        line-height: 1.4;
+        background-color: #f4f4f4;
+        border-radius: 5px;
+        padding: 10px;
+        white-space: pre-wrap;
+    }
+    .test-name {
+        font-family: "Open Sans", sans-serif;
+        font-weight: bold;
+        font-size: 14px;
+        padding: 5px;
+        margin-bottom: 10px;
+        border-radius: 5px;
+        cursor: pointer;
+    }
+    .count {
+        font-weight: normal;
+        font-size: 12px;
+        color: #555;
+    }
+    .console-wrapper {
+        overflow-y: auto;
+        padding: 10px;
+        max-height: 150px
+    }
+    .occurrences {
+        font-family: "Open Sans", sans-serif;
+        font-size: 12px;
+    }
+    ul {
+        padding-left: 60px;
+        list-style-image: url('https://img.shields.io/badge/-bugzilla-green');
+    }
+    li {
+        vertical-align: -2px;
+    }
+"""
+
+# Details are decompressed on the first expanded row, and highlight.js is
+# only loaded (and applied to that row's traces) at that point
+SCRIPT = """
+    const HLJS = 'https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.2.0/';
+    const NEW_BUG = 'https://bugzilla.mozilla.org/enter_bug.cgi?product=Fenix&component=UI%20Tests';
+    let detailsPromise = null;
+    let highlighterPromise = null;
+
+    function loadDetails() {
+        if (!detailsPromise) {
+            const blob = document.getElementById('details').textContent.trim();
+            detailsPromise = fetch('data:application/octet-stream;base64,' + blob)
+                .then(response => new Response(response.body.pipeThrough(new DecompressionStream('gzip'))).json());
+        }
+        return detailsPromise;
+    }
+
+    function loadHighlighter() {
+        if (!highlighterPromise) {
+            highlighterPromise = new Promise((resolve, reject) => {
+                const style = document.createElement('link');
+                style.rel = 'stylesheet';
+                style.href = HLJS + 'styles/default.min.css';
+                document.head.appendChild(style);
+                const script = document.createElement('script');
+                script.src = HLJS + 'highlight.min.js';
+                script.onload = () => resolve(window.hljs);
+                script.onerror = reject;
+                document.head.appendChild(script);
+            });
+        }
+        return highlighterPromise;
+    }
+
+    function link(href, text) {
+        const anchor = document.createElement('a');
+        anchor.href = href || '#';
+        anchor.textContent = text;
+        return anchor;
+    }
+
+    function renderDetails(element, row, traces) {
+        const wrapper = document.createElement('div');
+        wrapper.className = 'console-wrapper';
+        if (row.bugs && row.bugs.length) {
+            const list = document.createElement('ul');
+            for (const bug of row.bugs) {
+                const item = document.createElement('li');
+                item.appendChild(link(bug.url, bug.summary + ' (#' + bug.id + ')'));
+                list.appendChild(item);
+            }
+            wrapper.appendChild(list);
+        } else {
+            const image = document.createElement('img');
+            image.src = 'https://img.shields.io/badge/bugzilla-new%20bug-green';
+            const anchor = link(NEW_BUG, '');
+            anchor.appendChild(image);
+            wrapper.appendChild(anchor);
+        }
+        element.appendChild(wrapper);
+
+        // Occurrences sharing a trace are listed together, above the trace
+        const byTrace = new Map();
+        for (const occurrence of row.occurrences) {
+            if (!byTrace.has(occurrence.trace)) {
+                byTrace.set(occurrence.trace, []);
+            }
+            byTrace.get(occurrence.trace).push(occurrence);
+        }
+        for (const [trace, occurrences] of byTrace) {
+            const summary = document.createElement('div');
+            summary.className = 'occurrences';
+            occurrences.forEach((occurrence, index) => {
+                summary.append(index ? ' | ' : '', occurrence.result + ': ');
+                summary.append(link(occurrence.details, 'firebase'), ' ');
+                summary.append(link(occurrence.task, 'task'), ' ');
+                summary.append(link(occurrence.source, 'source'));
+            });
+            element.appendChild(summary);
+            const console = document.createElement('div');
+            console.className = 'console-wrapper';
+            const pre = document.createElement('pre');
+            pre.className = 'console-output log';
+            const code = document.createElement('code');
+            code.textContent = traces[trace];
+            pre.appendChild(code);
+            console.appendChild(pre);
+            element.appendChild(console);
+        }
+    }
+
+    async function toggleDetails(id) {
+        const element = document.getElementById(id + '_details');
+        if (element.style.display !== 'none') {
+            element.style.display = 'none';
+            return;
+        }
+        element.style.display = 'block';
+        if (element.dataset.rendered) {
+            return;
+        }
+        element.dataset.rendered = 'true';
+        const details = await loadDetails();
+        renderDetails(element, details.rows[id], details.traces);
+        loadHighlighter()
+            .then(hljs => element.querySelectorAll('code').forEach(code => hljs.highlightElement(code)))
+            .catch(() => {});
+    }
+"""
+
+
+def generate_report(sections_html, details):
+    return f"""<!DOCTYPE html>
+<html>
+    <head>
+        <meta charset="utf-8">
+        <title>Test Report</title>
+        <style>{STYLE}</style>
+        <script>{SCRIPT}</script>
+        <script id="details" type="application/octet-stream">{encode_details(details)}</script>
+    </head>
+    <body>
+        {''.join(sections_html)}
+    </body>
+</html>
+"""
+
+
 def write_report(report, filename):
     try:
-        with open(filename, 'a') as report_file:
+        with open(filename, 'w', encoding='utf-8') as report_file:
             report_file.write(report)
     except Exception as err:
         print(f"An error occurred while writing the report to {filename}: {err}")
@@ -256,46 +458,74 @@ def write_report(report, filename):
 def main():
     args = parse_args(sys.argv[1:])
 
+    import requests
+
+    # One session for every section, so that connections are reused
+    with cassette_from_args(args), requests.Session() as session:
+        session.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize=max(1, args.bugzilla_workers)))
+        build_report(args, session)
+
+
+def build_report(args, session):
+    '''Search the bugs of the problem tests of a dataset and write report.html'''
+    ttl = args.bugzilla_ttl * 60 * 60
+    # A recording must see every search, so it bypasses the cache
+    bug_cache = load_bug_cache(args.bugzilla_cache, ttl) if ttl > 0 and not args.record else {}
+    sections_html = []
+    details = {'traces': {}, 'rows': {}}
+
     try:
-        with open(args.input, encoding='utf-8') as data_file:
-            dataset = json.load(data_file)
-
-            for section in dataset:
-                content = []
-                job = (next(iter(section.values())))
-                for problem in job:
-                    if problem['problem_test_details']:
-                        for test in problem['problem_test_details']:
-                            content.append([
-                                test['name'],
-                                {
-                                    "testName": test['name'],
-                                    "testResult": test['result'],
-                                    "trace": test['details'],
-                                    "source": problem['pullreq_html_url'],
-                                    "details": problem['matrix_general_details']['webLink'],
-                                    "task": problem['task_html_url']
-                                }
-                            ])
-
-                if content:
-                    content = sorted(content, key=lambda x: x[0])
-                    [x.__delitem__(0) for x in content]
-                    content = [item for sublist in content for item in sublist]
-                    p = generate_report(
-                        f"{section['summary']['project']}  {next(iter(section))}",
-                        content
-                    )
-
-                    write_report(p, "report.html")
-
-                    print(f"Report written for [{section['summary']['job_symbol']}] "
-                          f"with results [{section['summary']['job_result']}] ({section['summary']['project']})")
-                else:
-                    print(f"No report generated for [{next(iter(section))}] in "
-                          f"[{section['summary']['job_symbol']}] ({section['summary']['project']})")
+        dataset = iter_sections(args.input, args.db, problems_only=True)
+
+        for section in dataset:
+            content = []
+            job = (next(iter(section.values())))
+            for problem in job:
+                if problem['problem_test_details']:
+                    for test in problem['problem_test_details']:
+                        content.append([
+                            test['name'],
+                            {
+                                "testName": test['name'],
+                                "testResult": test['result'],
+                                "trace": test['details'],
+                                "source": problem['pullreq_html_url'],
+                                "details": problem['matrix_general_details']['webLink'],
+                                "task": problem['task_html_url']
+                            }
+                        ])
+
+            if content:
+                content = sorted(content, key=lambda x: x[0])
+                [x.__delitem__(0) for x in content]
+                content = [item for sublist in content for item in sublist]
+                bugs = search_all_bugs(
+                    session, [test['testName'] for test in content], bug_cache, max(1, args.bugzilla_workers)
+                )
+                sections_html.append(generate_section(
+                    f"{section['summary']['project']}  {next(iter(section))}",
+                    content,
+                    bugs,
+                    details
+                ))
+
+                print(f"Report generated for [{section['summary']['job_symbol']}] "
+                      f"with results [{section['summary']['job_result']}] ({section['summary']['project']})")
+            else:
+                print(f"No report generated for [{next(iter(section))}] in "
+                      f"[{section['summary']['job_symbol']}] ({section['summary']['project']})")
     except OSError as err:
         raise SystemExit(err) from err
+    finally:
+        if ttl > 0:
+            # Merged into the cache on disk, whose entries a recording did not load
+            save_bug_cache(args.bugzilla_cache, {**load_bug_cache(args.bugzilla_cache, ttl), **bug_cache})
+
+    # One report per run, replacing the report of any previous run
+    if sections_html:
+        write_report(generate_report(sections_html, details), "report.html")
+        print(f"Report written to [report.html] ({len(details['rows'])} tests, "
+              f"{len(details['traces'])} distinct traces)")
 
 
 if __name__ == '__main__':